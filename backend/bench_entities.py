@@ -0,0 +1,92 @@
+import argparse
+import json
+import re
+import time
+from typing import List, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+
+from backend.bench_retrieval import QUESTIONS_PATH
+from backend.config import DB_DSN
+from backend.entity_index import EntityLookup, fold
+
+# team / player resolution latency over the part1 questions:
+#   python -m backend.bench_entities
+#   python -m backend.bench_entities --repeat 500 --question "How many points did Dončić score vs GSW?"
+# compares the alias automaton (EntityLookup.resolve) with the old regex-per-alias matching
+# and exits 1 if the automaton misses an id the regexes found (it also knows last names and
+# name variants the regexes don't, those extra ids are only listed)
+
+
+def regex_resolve(lookup: EntityLookup, question: str) -> Tuple[List[int], List[int]]:
+    # the matching EntityLookup did before the automaton, one re.search per alias
+    folded = fold(question)
+    teams = []
+    for alias, team_id in lookup.team_aliases.items():
+        if re.search(rf"\b{re.escape(alias)}\b", folded) and team_id not in teams:
+            teams.append(team_id)
+    for word in re.findall(r"\b[A-Z]{2,4}\b", question):
+        team_id = lookup.team_abbrs.get(word)
+        if team_id and team_id not in teams:
+            teams.append(team_id)
+    players = [
+        player_id for name, player_id in lookup.player_names.items()
+        if re.search(rf"\b{re.escape(name)}\b", folded)
+    ]
+    return teams, players
+
+
+def time_per_question(fn, questions: List[str], repeat: int) -> List[float]:
+    # microseconds per call, best of ``repeat`` for each question
+    out = []
+    for q in questions:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(q)
+            best = min(best, time.perf_counter() - t0)
+        out.append(best * 1e6)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entity resolution latency")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--question", action="append", help="extra question(s) to include")
+    args = parser.parse_args()
+
+    with open(QUESTIONS_PATH) as f:
+        questions = [q["question"] if isinstance(q, dict) else q for q in json.load(f)]
+    questions += args.question or []
+
+    eng = sa.create_engine(DB_DSN)
+    start = time.perf_counter()
+    with eng.connect() as cx:
+        lookup = EntityLookup.load(cx)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"index: {len(lookup.automaton)} aliases, {len(lookup.automaton.goto)} states, "
+          f"loaded + built in {load_ms:.1f}ms")
+
+    missed = 0
+    for q in questions:
+        new = [set(ids) for ids in lookup.resolve(q)]
+        old = [set(ids) for ids in regex_resolve(lookup, q)]
+        if new != old:
+            lost = any(o - n for n, o in zip(new, old))
+            missed += lost
+            print(f"  {'MISSED' if lost else 'extra'}: {q!r}\n"
+                  f"    automaton teams {sorted(new[0])} players {sorted(new[1])}\n"
+                  f"    regex     teams {sorted(old[0])} players {sorted(old[1])}")
+
+    print(f"{'matcher':>10} {'p50 us':>10} {'p95 us':>10} {'max us':>10}")
+    for name, fn in [("automaton", lookup.resolve), ("regex", lambda q: regex_resolve(lookup, q))]:
+        # the regex loop is slow enough that a few repeats say as much
+        us = time_per_question(fn, questions, args.repeat if name == "automaton" else max(1, args.repeat // 20))
+        print(f"{name:>10} {np.percentile(us, 50):>10.1f} {np.percentile(us, 95):>10.1f} {max(us):>10.1f}")
+    print(f"{len(questions)} questions, {missed} with ids missed by the automaton")
+    raise SystemExit(1 if missed else 0)
+
+
+if __name__ == "__main__":
+    main()
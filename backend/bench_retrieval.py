@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from backend.config import DB_DSN, EMBED_MODEL
+from backend.fake_ollama import STUB_MODEL, stub_embed, start as start_fake_ollama
+from backend.retrieval import EntityLookup, evidence, extract_filters, retrieve_filtered, retrieve_multi
+from backend.utils import ollama_embed
+from backend.vector_index import VectorIndex
+
+# retrieval quality / latency over the part1 questions and their gold evidence:
+#   python -m backend.bench_retrieval --prepare     # embed the local db with the stub embedder
+#   python -m backend.bench_retrieval --reset       # same, after wiping nba_embeddings
+#   python -m backend.bench_retrieval --out bench.json
+#   python -m backend.bench_retrieval --baseline bench.json   # exit 1 if recall / MRR dropped
+# --prepare / --reset write stub vectors into nba_embeddings, point DB_DSN at a local bench database
+
+BASE_DIR = os.path.dirname(__file__)
+QUESTIONS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "questions.json"))
+GOLD_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "gold_evidence.json"))
+
+
+def evidence_key(ev: dict) -> tuple:
+    return tuple(sorted(ev.items()))
+
+
+def ranked_keys(rows) -> List[tuple]:
+    # evidence in rank order, first occurrence only
+    out = []
+    for ev in evidence(rows):
+        key = evidence_key(ev)
+        if key not in out:
+            out.append(key)
+    return out
+
+
+def recall_at(ranked: List[tuple], gold: set, k: int) -> float:
+    return len(set(ranked[:k]) & gold) / len(gold)
+
+
+def reciprocal_rank(ranked: List[tuple], gold: set) -> float:
+    for i, key in enumerate(ranked, 1):
+        if key in gold:
+            return 1.0 / i
+    return 0.0
+
+
+def prepare(stub: bool, reset: bool):
+    # run the embedding pipeline, against an in-process fake ollama for the stub embedder
+    from backend.embeding.config import Config
+    from backend.embeding.embed_pipeline import EmbeddingPipeline
+
+    config = Config()
+    if stub:
+        # the embedding service is built with the config, so point it at the fake first. stub
+        # vectors are cheap to redo, they never go in the shared embedding cache
+        _, url = start_fake_ollama()
+        config.ollama_host = url
+        config.embed_model = STUB_MODEL
+        config.embed_cache_path = ""
+    pipeline = EmbeddingPipeline(config)
+    if reset:
+        # unchanged docs are skipped by content_hash, whatever embedder produced their vectors
+        pipeline.db_manager.drop_vector_indexes()
+        with pipeline.db_manager.get_connection() as conn:
+            conn.execute(text("TRUNCATE nba_embeddings"))
+            conn.commit()
+    pipeline.run()
+
+
+def make_configs(index: VectorIndex) -> Dict[str, Callable]:
+    # name -> fn(cx, qvec, filters) returning rows in rank order
+    return {
+        "pgvector": lambda cx, qvec, f: retrieve_multi(cx, qvec, f),
+        "pgvector-nofilter": lambda cx, qvec, f: retrieve_multi(cx, qvec, None),
+        "pgvector-flat10": lambda cx, qvec, f: retrieve_filtered(cx, qvec, f, 10),
+        "memory": lambda cx, qvec, f: index.search_multi(qvec, f),
+        "memory-nofilter": lambda cx, qvec, f: index.search_multi(qvec, None),
+    }
+
+
+def run_config(cx, fn: Callable, cases: List[dict], ks: List[int], repeat: int) -> dict:
+    latencies = []
+    recalls = {k: [] for k in ks}
+    rrs = []
+    for case in cases:
+        fn(cx, case["qvec"], case["filters"])  # warm up
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            rows = fn(cx, case["qvec"], case["filters"])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        cx.rollback()
+        if not case["gold"]:
+            continue
+        ranked = ranked_keys(rows)
+        for k in ks:
+            recalls[k].append(recall_at(ranked, case["gold"], k))
+        rrs.append(reciprocal_rank(ranked, case["gold"]))
+
+    out = {f"recall@{k}": round(float(np.mean(v)), 4) for k, v in recalls.items()}
+    out["mrr"] = round(float(np.mean(rrs)), 4)
+    for p in (50, 95, 99):
+        out[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 2)
+    return out
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> bool:
+    # print deltas against a previous --out file, False if any quality metric dropped
+    ok = True
+    for name, metrics in report.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key, value in metrics.items():
+            if key not in base:
+                continue
+            delta = value - base[key]
+            worse = delta < -tolerance if not key.endswith("_ms") else False
+            ok = ok and not worse
+            if delta:
+                print(f"{name:>18} {key:>10}: {base[key]} -> {value} ({delta:+.4g}){'  REGRESSION' if worse else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval backends against part1 gold evidence")
+    parser.add_argument("--embedder", choices=["stub", "ollama"], default="stub")
+    parser.add_argument("--prepare", action="store_true", help="run the embedding pipeline first")
+    parser.add_argument("--reset", action="store_true", help="wipe nba_embeddings, then --prepare")
+    parser.add_argument("--configs", default=None, help="comma separated, default all")
+    parser.add_argument("--k", default="1,5,10")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.prepare or args.reset:
+        prepare(args.embedder == "stub", args.reset)
+
+    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+        questions = json.load(f)
+    with open(GOLD_PATH, encoding="utf-8") as f:
+        gold = {g["id"]: {evidence_key(ev) for ev in g["evidence"]} for g in json.load(f)}
+    ks = [int(k) for k in args.k.split(",")]
+
+    eng = sa.create_engine(DB_DSN)
+    index = VectorIndex(path=os.path.join(tempfile.gettempdir(), "bench_vector_index"))
+    report = {}
+    with eng.connect() as cx:
+        lookup = EntityLookup.load(cx)
+        cases = []
+        for q in questions:
+            embed = stub_embed if args.embedder == "stub" else lambda t: ollama_embed(EMBED_MODEL, t)
+            cases.append({
+                "qvec": embed(q["question"]),
+                "filters": extract_filters(q["question"], lookup),
+                "gold": gold.get(q["id"], set()),
+            })
+        configs = make_configs(index)
+        names = args.configs.split(",") if args.configs else list(configs)
+        if any(n.startswith("memory") for n in names):
+            index.sync(cx, rebuild=True)
+            cx.rollback()
+        for name in names:
+            report[name] = run_config(cx, configs[name], cases, ks, args.repeat)
+
+    scored = sum(1 for c in cases if c["gold"])
+    print(f"\n{scored}/{len(cases)} questions with gold evidence, embedder={args.embedder}, repeat={args.repeat}")
+    cols = [f"recall@{k}" for k in ks] + ["mrr", "p50_ms", "p95_ms", "p99_ms"]
+    print(f"{'config':>18} " + " ".join(f"{c:>9}" for c in cols))
+    for name, metrics in report.items():
+        print(f"{name:>18} " + " ".join(f"{metrics[c]:>9}" for c in cols))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
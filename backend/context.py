@@ -0,0 +1,84 @@
+import re
+from typing import List, Tuple
+
+from backend.config import CONTEXT_FORMAT, CONTEXT_TOKEN_BUDGET
+from backend.retrieval import format_source
+
+# prompt context from retrieved rows: deduplicated, grouped into one small table per
+# entity type and cut off at a token budget, best scoring rows first
+
+# (table, key columns) per entity type, in the order the tables are written out
+TABLES = {
+    "game": ("game_details", "game_id"),
+    "boxscore": ("player_box_scores", "game_id/player_id"),
+    "player": ("players", "player_id"),
+    "team": ("teams", "team_id"),
+}
+
+# roughly how llama3's tokenizer splits text: words, digit runs in threes, punctuation
+_TOKENS = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKENS.findall(text))
+
+
+def row_key(row: dict) -> str:
+    if row["entity_type"] == "boxscore":
+        return f"{row['game_id']}/{row['player_id']}"
+    return str(row["entity_id"])
+
+
+def compact_row(row: dict) -> str:
+    # the numbers straight from the joined source row, content_text only when there isn't one
+    src = row.get("source") or {}
+    if row["entity_type"] == "game" and "game" in src:
+        g = src["game"]
+        winner = g["home_abbr"] if g["winning_team_id"] == g["home_team_id"] else g["away_abbr"]
+        return (f"{row_key(row)}: {str(g['game_timestamp'])[:10]} {g['away_abbr']} {g['away_points']} "
+                f"@ {g['home_abbr']} {g['home_points']}, {winner} won")
+    if row["entity_type"] == "boxscore" and "boxscore" in src:
+        b = src["boxscore"]
+        name = f"{src['player']['first_name']} {src['player']['last_name']} " if "player" in src else ""
+        reb = (b["offensive_reb"] or 0) + (b["defensive_reb"] or 0)
+        return (f"{row_key(row)}: {str(b['game_timestamp'])[:10]} {name}{b['team_abbr']} "
+                f"{b['points']} pts {reb} reb {b['assists']} ast")
+    return f"{row_key(row)}: {row['content_text']}"
+
+
+def pack_rows(rows, budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[dict], List[str]]:
+    """Rows (and their lines) that fit in ``budget`` tokens, duplicates dropped, in rank order."""
+    kept, lines, seen = [], [], set()
+    used = 0
+    for row in rows:
+        key = (row["entity_type"], row_key(row))
+        if key in seen or row["content_text"] in seen:
+            continue
+        line = compact_row(row)
+        cost = estimate_tokens(line) + 1
+        if budget and used + cost > budget:
+            # a shorter row further down may still fit
+            continue
+        seen.update((key, row["content_text"]))
+        kept.append(row)
+        lines.append(line)
+        used += cost
+    return kept, lines
+
+
+def build_context(rows, budget: int = CONTEXT_TOKEN_BUDGET, fmt: str = CONTEXT_FORMAT) -> Tuple[str, List[dict]]:
+    """Context text for a prompt and the rows that made it in (cite only those as evidence).
+
+    ``fmt="verbose"`` is the old unbounded one line per row from ``format_source``.
+    """
+    rows = list(rows)
+    if fmt == "verbose":
+        return "\n".join(format_source(r) for r in rows), rows
+    kept, lines = pack_rows(rows, budget)
+    out = []
+    for etype, (table, key) in TABLES.items():
+        group = [line for row, line in zip(kept, lines) if row["entity_type"] == etype]
+        if group:
+            out.append(f"{table} ({key}: row)")
+            out.extend(group)
+    return "\n".join(out), kept
@@ -0,0 +1,323 @@
+import hashlib
+import json
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from backend.embeding.document_builder import DocumentBuilder, json_default
+
+# column-at-a-time DocumentBuilder for whole chunks of extracted rows. every value is
+# json / text encoded once per distinct value in its column (ids, names, dates and small
+# counts repeat a lot), rows are then put together from "%s" templates with the keys
+# already in sort_keys order, so content_text, the serialized json and content_hash
+# come out byte for byte the same as DocumentBuilder's
+
+Columns = Dict[str, List[Any]]
+# per column bound on the encodings a BatchDocumentBuilder keeps between chunks
+MEMO_MAX_ENTRIES = 100_000
+
+
+class Literal(NamedTuple):
+    # constant leaf of a json skeleton, e.g. "entity_type": Literal("boxscore")
+    value: Any
+
+
+def as_columns(data) -> Columns:
+    """Column lists from a chunk of extracted rows.
+
+    Takes a mapping of column -> values, a list of row dicts (what DataExtractor
+    returns), an Arrow table / record batch (``to_pydict``) or a pandas DataFrame.
+    Build frames with ``dtype=object`` so integer columns with NULLs stay ints and
+    dates stay dates, the text has to come out the same as from the row builders.
+    """
+    if isinstance(data, Mapping):
+        return {k: list(v) for k, v in data.items()}
+    if hasattr(data, "to_pydict"):
+        return data.to_pydict()
+    if hasattr(data, "columns") and hasattr(data, "to_dict"):
+        return data.astype(object).where(data.notna(), None).to_dict("list")
+    rows = list(data)
+    if not rows:
+        return {}
+    keys = list(rows[0])
+    if len(keys) == 1:
+        return {keys[0]: [r[keys[0]] for r in rows]}
+    return dict(zip(keys, map(list, zip(*map(itemgetter(*keys), rows)))))
+
+
+def as_rows(cols: Columns) -> List[Dict[str, Any]]:
+    keys = list(cols)
+    return [dict(zip(keys, vals)) for vals in zip(*cols.values())]
+
+
+def memo(fn: Callable, *cols: List[Any], caches: Optional[dict] = None, name: str = "") -> List[Any]:
+    """fn(*values) for each row, computed once per distinct combination of values.
+
+    ``caches`` keeps the results across calls (chunks) under ``name``, bounded by
+    MEMO_MAX_ENTRIES per column.
+    """
+    # 1, 1.0 and True are equal as dict keys but encode differently, so values only key
+    # the cache on their own when each column holds one type (plus None)
+    types = tuple(frozenset(map(type, col)) - {type(None)} for col in cols)
+    if all(len(t) <= 1 for t in types):
+        keys = cols[0] if len(cols) == 1 else list(zip(*cols))
+        tagged = False
+    else:
+        keys = [tuple((v.__class__, v) for v in vals) for vals in zip(*cols)]
+        types, tagged = None, True
+    if caches is None:
+        cache = {}
+    else:
+        cache = caches.setdefault((name, types), {})
+        if len(cache) > MEMO_MAX_ENTRIES:
+            cache.clear()
+    for key in dict.fromkeys(keys):
+        if key in cache:
+            continue
+        if tagged:
+            cache[key] = fn(*(v for _, v in key))
+        else:
+            cache[key] = fn(key) if len(cols) == 1 else fn(*key)
+    return list(map(cache.__getitem__, keys))
+
+
+def json_value(v: Any) -> str:
+    # json.dumps(v, default=json_default), ints / strings / None straight through json's own encoders
+    cls = v.__class__
+    if cls is int:
+        return int.__repr__(v)
+    if cls is str:
+        return encode_basestring_ascii(v)
+    if v is None:
+        return "null"
+    return json.dumps(v, default=json_default)
+
+
+def json_template(skeleton: dict) -> Tuple[str, List[str]]:
+    """``json.dumps(..., sort_keys=True)`` of a skeleton as a "%s" template.
+
+    Leaves are column names (one %s each, returned in template order) or Literals.
+    """
+    fields = []
+
+    def walk(node: dict) -> str:
+        parts = []
+        for key in sorted(node):
+            leaf = node[key]
+            if isinstance(leaf, dict):
+                value = walk(leaf)
+            elif isinstance(leaf, Literal):
+                value = json_value(leaf.value).replace("%", "%%")
+            else:
+                fields.append(leaf)
+                value = "%s"
+            parts.append(f"{json_value(key)}: {value}")
+        return "{" + ", ".join(parts) + "}"
+
+    return walk(skeleton), fields
+
+
+def render(template: str, fields: List[str], cols: Columns, encode: Callable[[Any], str],
+           caches: Optional[dict] = None) -> List[str]:
+    encoded = [memo(encode, cols[f], caches=caches, name=f"{encode.__name__}:{f}") for f in fields]
+    return [template % vals for vals in zip(*encoded)]
+
+
+def md5_column(texts: List[str]) -> List[str]:
+    md5 = hashlib.md5
+    return [md5(t.encode()).hexdigest() for t in texts]
+
+
+def shooting_text(label: str) -> Callable[[Any, Any], str]:
+    # " 2PT: 8/13 (61.5%)", empty when nothing was attempted
+    def fn(made, attempted):
+        if not attempted:
+            return ""
+        pct = round(100 * made / attempted, 1)
+        return f" {label}: {made}/{attempted} ({pct}%)"
+    return fn
+
+
+BOXSCORE_JSON, BOXSCORE_JSON_FIELDS = json_template({
+    "entity_type": Literal("boxscore"),
+    "game_id": "game_id",
+    "player_id": "player_id",
+    "team_id": "team_id",
+    "player_name": "player_name",
+    "team_name": "team_name",
+    "date": "date",
+    "season": "season",
+    "starter": "starter",
+    "minutes": "minutes",
+    "points": "points",
+    "rebounds": "rebounds",
+    "assists": "assists",
+    "steals": "steals",
+    "blocks": "blocks",
+    "turnovers": "turnovers",
+    "fg2": {"made": "fg2_made", "attempted": "fg2_attempted"},
+    "fg3": {"made": "fg3_made", "attempted": "fg3_attempted"},
+    "ft": {"made": "ft_made", "attempted": "ft_attempted"},
+})
+BOXSCORE_TEXT = ("%s (%s) on %s: %s, played %s minutes. "
+                 "Stats: %s points, %s rebounds, %s assists, %s steals, %s blocks.%s%s%s")
+BOXSCORE_TEXT_FIELDS = [
+    "player_name", "team_abbr", "game_date", "starter_text", "minutes",
+    "points", "rebounds", "assists", "steals", "blocks", "fg2_text", "fg3_text", "ft_text",
+]
+
+GAME_JSON, GAME_JSON_FIELDS = json_template({
+    "entity_type": Literal("game"),
+    "game_id": "game_id",
+    "season": "season",
+    "date": "date",
+    "home_team": {"id": "home_team_id", "name": "home_team_name", "points": "home_points"},
+    "away_team": {"id": "away_team_id", "name": "away_team_name", "points": "away_points"},
+    "winner_id": "winning_team_id",
+})
+GAME_TEXT = "Game on %s: %s at %s. Final score: %s %s, %s %s. %s won the game. Season: %s"
+GAME_TEXT_FIELDS = [
+    "game_date", "away_team_name", "home_team_name", "home_team_name", "home_points",
+    "away_team_name", "away_points", "winner_name", "season",
+]
+
+
+class BatchDocumentBuilder:
+    """DocumentBuilder over a chunk of rows at once, same documents out.
+
+    Box scores and games, the bulk of the rows, are built column at a time;
+    the few hundred team / player profiles go through the row builders.
+    """
+
+    def __init__(self):
+        self.row_builder = DocumentBuilder()
+        # encodings / derived values by column, reused across chunks (see memo)
+        self.caches = {}
+        self.builders = {
+            "team": self.build_teams,
+            "player": self.build_players,
+            "game": self.build_games,
+            "boxscore": self.build_boxscores,
+        }
+
+    def build(self, entity_type: str, data) -> List[Dict[str, Any]]:
+        return self.builders[entity_type](data)
+
+    def build_teams(self, data) -> List[Dict[str, Any]]:
+        return [self.row_builder.build_team_document(r) for r in as_rows(as_columns(data))]
+
+    def build_players(self, data) -> List[Dict[str, Any]]:
+        return [self.row_builder.build_player_document(r) for r in as_rows(as_columns(data))]
+
+    def build_games(self, data) -> List[Dict[str, Any]]:
+        c = as_columns(data)
+        if not c:
+            return []
+        c["date"] = memo(str, c["game_date"], caches=self.caches, name="date")
+        c["winner_name"] = [
+            home if winner == home_id else away
+            for winner, home_id, home, away in zip(
+                c["winning_team_id"], c["home_team_id"], c["home_team_name"], c["away_team_name"]
+            )
+        ]
+        content_json = render(GAME_JSON, GAME_JSON_FIELDS, c, json_value, self.caches)
+        content_text = render(GAME_TEXT, GAME_TEXT_FIELDS, c, format, self.caches)
+        hashes = md5_column(content_json)
+
+        return [
+            {
+                "id": f"game_{game_id}_summary",
+                "entity_type": "game",
+                "entity_id": str(game_id),
+                "game_id": game_id,
+                "team_id": None,
+                "player_id": None,
+                "chunk_type": "summary",
+                "content_json": {
+                    "entity_type": "game",
+                    "game_id": game_id,
+                    "season": season,
+                    "date": date_text,
+                    "home_team": {"id": home_id, "name": home_name, "points": home_points},
+                    "away_team": {"id": away_id, "name": away_name, "points": away_points},
+                    "winner_id": winner_id,
+                },
+                "content_text": text,
+                "content_hash": content_hash,
+                "season": season,
+                "game_date": game_date,
+            }
+            for (game_id, season, game_date, date_text, home_id, home_name, home_points,
+                 away_id, away_name, away_points, winner_id, text, content_hash) in zip(
+                c["game_id"], c["season"], c["game_date"], c["date"],
+                c["home_team_id"], c["home_team_name"], c["home_points"],
+                c["away_team_id"], c["away_team_name"], c["away_points"],
+                c["winning_team_id"], content_text, hashes,
+            )
+        ]
+
+    def build_boxscores(self, data) -> List[Dict[str, Any]]:
+        c = as_columns(data)
+        if not c:
+            return []
+        # derived stats, with the row builder's own arithmetic and round()
+        c["rebounds"] = [(o or 0) + (d or 0) for o, d in zip(c["offensive_reb"], c["defensive_reb"])]
+        c["minutes"] = memo(lambda s: round((s or 0) / 60, 1), c["seconds"], caches=self.caches, name="minutes")
+        c["player_name"] = memo(lambda first, last: f"{first} {last}", c["first_name"], c["last_name"],
+                                caches=self.caches, name="player_name")
+        c["date"] = memo(str, c["game_date"], caches=self.caches, name="date")
+        c["starter_text"] = ["Started" if s else "Off the bench" for s in c["starter"]]
+        for label, prefix in (("2PT", "fg2"), ("3PT", "fg3"), ("FT", "ft")):
+            c[f"{prefix}_text"] = memo(shooting_text(label), c[f"{prefix}_made"], c[f"{prefix}_attempted"],
+                                       caches=self.caches, name=f"{prefix}_text")
+
+        content_json = render(BOXSCORE_JSON, BOXSCORE_JSON_FIELDS, c, json_value, self.caches)
+        content_text = render(BOXSCORE_TEXT, BOXSCORE_TEXT_FIELDS, c, format, self.caches)
+        hashes = md5_column(content_json)
+
+        return [
+            {
+                "id": f"boxscore_{game_id}_{player_id}",
+                "entity_type": "boxscore",
+                "entity_id": f"{game_id}_{player_id}",
+                "game_id": game_id,
+                "team_id": team_id,
+                "player_id": player_id,
+                "chunk_type": "performance",
+                "content_json": {
+                    "entity_type": "boxscore",
+                    "game_id": game_id,
+                    "player_id": player_id,
+                    "team_id": team_id,
+                    "player_name": player_name,
+                    "team_name": team_name,
+                    "date": date_text,
+                    "season": season,
+                    "starter": starter,
+                    "minutes": minutes,
+                    "points": points,
+                    "rebounds": rebounds,
+                    "assists": assists,
+                    "steals": steals,
+                    "blocks": blocks,
+                    "turnovers": turnovers,
+                    "fg2": {"made": fg2_made, "attempted": fg2_attempted},
+                    "fg3": {"made": fg3_made, "attempted": fg3_attempted},
+                    "ft": {"made": ft_made, "attempted": ft_attempted},
+                },
+                "content_text": text,
+                "content_hash": content_hash,
+                "season": season,
+                "game_date": game_date,
+            }
+            for (game_id, player_id, team_id, player_name, team_name, date_text, season, starter,
+                 minutes, points, rebounds, assists, steals, blocks, turnovers,
+                 fg2_made, fg2_attempted, fg3_made, fg3_attempted, ft_made, ft_attempted,
+                 game_date, text, content_hash) in zip(
+                c["game_id"], c["player_id"], c["team_id"], c["player_name"], c["team_name"],
+                c["date"], c["season"], c["starter"], c["minutes"], c["points"], c["rebounds"],
+                c["assists"], c["steals"], c["blocks"], c["turnovers"],
+                c["fg2_made"], c["fg2_attempted"], c["fg3_made"], c["fg3_attempted"],
+                c["ft_made"], c["ft_attempted"], c["game_date"], content_text, hashes,
+            )
+        ]
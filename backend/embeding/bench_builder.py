@@ -0,0 +1,93 @@
+import argparse
+import time
+from typing import Any, Callable, Dict, List
+
+from backend.embeding.batch_builder import BatchDocumentBuilder
+from backend.embeding.config import Config
+from backend.embeding.data_extractor import DataExtractor
+from backend.embeding.db_manager import DatabaseManager
+from backend.embeding.document_builder import DocumentBuilder
+
+# per row DocumentBuilder on row dicts vs BatchDocumentBuilder on column chunks (BUILD_MODE=row / batch):
+#   python -m backend.embeding.bench_builder
+#   python -m backend.embeding.bench_builder --chunk 128      # pipeline sized chunks
+# exits 1 if any document differs between the two (content_json also compared as sorted json text)
+
+
+def row_chunks(rows: List[dict], size: int) -> List[List[dict]]:
+    return [rows[i:i + size] for i in range(0, len(rows), size)] if size else [rows]
+
+
+def column_chunks(cols: Dict[str, list], size: int) -> List[Dict[str, list]]:
+    n = len(next(iter(cols.values()), []))
+    if not size:
+        return [cols]
+    return [{k: v[i:i + size] for k, v in cols.items()} for i in range(0, n, size)]
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def count_differences(a: List[dict], b: List[dict]) -> int:
+    differ = abs(len(a) - len(b))
+    for x, y in zip(a, b):
+        if x != y or DocumentBuilder.json_serialize(x["content_json"]) != DocumentBuilder.json_serialize(y["content_json"]):
+            differ += 1
+    return differ
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per row vs batch document building")
+    parser.add_argument("--chunk", type=int, default=0, help="rows per build call, 0 = all at once")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    extractor = DataExtractor(DatabaseManager(Config()))
+    row_builder = DocumentBuilder()
+    entities = [
+        ("team", extractor.extract_teams, row_builder.build_team_document),
+        ("player", extractor.extract_players, row_builder.build_player_document),
+        ("game", extractor.extract_games, row_builder.build_game_document),
+        ("boxscore", extractor.extract_boxscores, row_builder.build_boxscore_document),
+    ]
+
+    failed = 0
+    print(f"{'entity':>9} {'rows':>7} {'row docs/s':>11} {'batch docs/s':>13} {'speedup':>8}")
+    for entity_type, extract, build_row in entities:
+        rows = row_chunks(extract(), args.chunk)
+        cols = column_chunks(extract(columns=True), args.chunk)
+        n = sum(len(part) for part in rows)
+
+        def run_rows():
+            return [build_row(r) for part in rows for r in part]
+
+        def run_batch():
+            # a fresh builder per run, its encoding caches only warm up across the chunks of one run
+            builder = BatchDocumentBuilder()
+            return [doc for part in cols for doc in builder.build(entity_type, part)]
+
+        differ = count_differences(run_rows(), run_batch())
+        if differ:
+            failed += 1
+            print(f"  {entity_type}: {differ} of {n} documents differ")
+
+        row_secs = best_of(run_rows, args.repeat)
+        batch_secs = best_of(run_batch, args.repeat)
+        print(f"{entity_type:>9} {n:>7} {n / row_secs:>11,.0f} {n / batch_secs:>13,.0f} "
+              f"{row_secs / batch_secs:>7.1f}x")
+
+    # the extract side of the same switch: a dict per row vs one list per column
+    dict_secs = best_of(extractor.extract_boxscores, max(1, args.repeat // 2))
+    col_secs = best_of(lambda: extractor.extract_boxscores(columns=True), max(1, args.repeat // 2))
+    print(f"extract box scores: row dicts {dict_secs * 1000:.0f}ms, columns {col_secs * 1000:.0f}ms")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import fake_ollama
+from backend.embeding.config import Config
+from backend.embeding.embedding_service import EmbeddingService
+
+# fixed vs adaptive embedding concurrency against a fake ollama that can only serve
+# --embed-parallel requests at once and answers 503 past --max-queue waiting ones:
+#   python -m backend.embeding.bench_embed_concurrency
+#   python -m backend.embeding.bench_embed_concurrency --embed-parallel 2 --max-queue 4 --fixed 16
+# chunks are fed the way the streaming pipeline does (config.embed_workers callers of embed_batch).
+# exits 1 if the adaptive run fails a chunk
+
+
+def run(config: Config, texts, label: str) -> bool:
+    service = EmbeddingService(config)
+    chunks = [texts[i:i + config.batch_size] for i in range(0, len(texts), config.batch_size)]
+    failed = []
+    limits = []
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.1):
+            limits.append(service.limiter.limit)
+
+    def embed(chunk):
+        try:
+            service.embed_batch(chunk)
+        except Exception:
+            failed.append(len(chunk))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config.embed_workers) as pool:
+        list(pool.map(embed, chunks))
+    secs = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    s = service.stats()
+    mean_limit = sum(limits) / len(limits) if limits else s["limit"]
+    # only texts that got embedded count
+    print(f"{label:>9} {(len(texts) - sum(failed)) / secs:>9,.0f} {mean_limit:>10.1f} {s['limit']:>10.1f} "
+          f"{s.get('throttled', 0) + s.get('timeout', 0):>9} {s['retries']:>8} {s['retries_denied']:>7} "
+          f"{len(failed):>7}/{len(chunks)}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fixed vs adaptive embedding concurrency")
+    parser.add_argument("--docs", type=int, default=4096)
+    parser.add_argument("--fixed", type=int, default=16, help="concurrency of the fixed run")
+    fake_ollama.add_arguments(parser)
+    # slow enough per text that the simulated capacity, not the stub embedder's cpu, is the limit
+    parser.set_defaults(embed_ms=50, embed_item_ms=10, embed_parallel=4, max_queue=8, jitter=0.2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    fake_ollama.configure(args)
+    server, url = fake_ollama.start()
+
+    # box score sized documents
+    texts = [f"doc {i}: " + " ".join(f"word{(i * 7 + j) % 997}" for j in range(80)) for i in range(args.docs)]
+
+    print(f"{'mode':>9} {'texts/s':>9} {'avg limit':>10} {'end limit':>10} {'overload':>9} "
+          f"{'retries':>8} {'denied':>7} {'failed':>7}")
+    ok = True
+    for label in ("fixed", "adaptive"):
+        config = Config()
+        config.ollama_host = url
+        config.embed_cache_path = ""
+        config.embed_backend = "ollama"
+        if label == "fixed":
+            config.embed_concurrency = config.embed_min_concurrency = config.embed_max_concurrency = args.fixed
+        else:
+            config.embed_max_concurrency = max(config.embed_max_concurrency, args.fixed)
+        passed = run(config, texts, label)
+        ok = ok and (passed or label == "fixed")
+
+    server.should_exit = True
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+from backend.embeding.config import Config
+from backend.embeding.db_manager import DatabaseManager
+from backend.embeding.embedding_service import EmbeddingService
+from backend.embeding.local_embedder import LocalEmbedder
+
+# are the in-process (EMBED_BACKEND=local) vectors the ones ollama makes, and how fast:
+#   python -m backend.embeding.bench_local_embed --docs 512                # against a running ollama
+#   python -m backend.embeding.bench_local_embed --against db --docs 2000  # against the vectors in nba_embeddings
+#   python -m backend.embeding.bench_local_embed --quantize --threads 4
+# --against db needs nba_embeddings embedded by ollama (not the bench stub). exits 1 if the
+# lowest cosine similarity is under --min-cosine
+
+
+def sample_docs(db: DatabaseManager, n: int):
+    # (content_text, stored vector) of n random documents
+    with db.get_connection() as conn:
+        rows = conn.execute(text(
+            "SELECT content_text, embedding::text FROM nba_embeddings ORDER BY random() LIMIT :n"
+        ), {"n": n}).fetchall()
+    return [r[0] for r in rows], [json.loads(r[1]) for r in rows]
+
+
+def normalized(vectors: List[List[float]]) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+def neighbour_overlap(a: np.ndarray, b: np.ndarray, k: int = 10, queries: int = 100) -> float:
+    # share of each doc's top-k neighbours (by a vs by b) that agree, over the first `queries` docs
+    q = min(queries, len(a))
+    top_a = np.argsort(-(a[:q] @ a.T), axis=1)[:, 1:k + 1]
+    top_b = np.argsort(-(b[:q] @ b.T), axis=1)[:, 1:k + 1]
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare local cpu embeddings with ollama's")
+    parser.add_argument("--docs", type=int, default=512)
+    parser.add_argument("--against", choices=["ollama", "db"], default="ollama")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--quantize", action="store_true", help="int8 dynamic quantization")
+    parser.add_argument("--min-cosine", type=float, default=None,
+                        help="default 0.999, 0.98 with --quantize")
+    args = parser.parse_args()
+
+    config = Config()
+    config.embed_cache_path = ""
+    if args.threads is not None:
+        config.local_embed_threads = args.threads
+    if args.batch_size:
+        config.local_embed_batch_size = args.batch_size
+    config.local_embed_quantize = args.quantize
+    min_cosine = args.min_cosine or (0.98 if args.quantize else 0.999)
+
+    texts, stored = sample_docs(DatabaseManager(config), args.docs)
+    print(f"{len(texts)} documents, {sum(map(len, texts)) / len(texts):.0f} chars on average")
+
+    if args.against == "ollama":
+        config.embed_backend = "ollama"
+        start = time.perf_counter()
+        service = EmbeddingService(config)
+        reference = service.embed_batch(texts)
+        secs = time.perf_counter() - start
+        print(f"  ollama: {len(texts) / secs:,.1f} docs/s ({service.stats_line()})")
+    else:
+        reference = stored
+
+    local = LocalEmbedder(config)
+    local.embed(texts[:8])  # warm up
+    start = time.perf_counter()
+    vectors = local.embed(texts)
+    secs = time.perf_counter() - start
+    print(f"  local: {len(texts) / secs:,.1f} docs/s ({local.torch.get_num_threads()} threads, "
+          f"{'int8' if args.quantize else 'fp32'})")
+
+    # batching / padding must not move a vector: a few docs one by one against the batched run
+    single = [local.embed([t])[0] for t in texts[:16]]
+    pad_diff = float(np.max(np.abs(np.asarray(single) - np.asarray(vectors[:16]))))
+
+    a, b = normalized(vectors), normalized(reference)
+    cos = np.sum(a * b, axis=1)
+    print(f"cosine vs {args.against}: min {cos.min():.5f}, p1 {np.percentile(cos, 1):.5f}, mean {cos.mean():.5f}")
+    print(f"top-10 neighbour overlap: {neighbour_overlap(a, b):.3f}")
+    print(f"batched vs one at a time: max abs diff {pad_diff:.2e}")
+    ok = cos.min() >= min_cosine
+    print(f"{'OK' if ok else 'MISMATCH'}: lowest cosine {cos.min():.5f} {'>=' if ok else '<'} {min_cosine}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+from backend.embeding.config import Config, ann_index
+from backend.embeding.db_manager import DatabaseManager
+from backend.retrieval import ann_top_k, search_settings
+from backend.utils import vector_literal
+
+# compares full precision / halfvec / bit hnsw indexes on the loaded nba_embeddings:
+#   python -m backend.embeding.bench_quantization --queries 200 --k 10
+# recall is against an exact (no index) scan, the bench indexes are dropped afterwards
+
+MODES = ("none", "halfvec", "bit")
+COLS = "id, entity_type, entity_id, game_id, team_id, player_id, content_text, season, game_date, embedding"
+
+
+def pgvector_version(conn) -> tuple:
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(x) for x in version.split("."))
+
+
+def build_index(conn, config: Config, mode: str) -> float:
+    expr, opclass, _, _ = ann_index(mode, config.vector_distance, config.embed_dim)
+    t0 = time.perf_counter()
+    conn.execute(text(f"SET LOCAL maintenance_work_mem = '{config.index_build_mem}'"))
+    conn.execute(text(f"SET LOCAL max_parallel_maintenance_workers = {config.index_build_workers}"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS idx_bench_quant_{mode} ON nba_embeddings "
+        f"USING hnsw ({expr} {opclass}) "
+        f"WITH (m = {config.hnsw_m}, ef_construction = {config.hnsw_ef_construction})"
+    ))
+    conn.commit()
+    return time.perf_counter() - t0
+
+
+def sample_queries(conn, n: int, seed: int) -> List[List[float]]:
+    # stored embeddings plus a little noise, so the query isn't literally one of the docs
+    conn.execute(text("SELECT setseed(:s)"), {"s": (seed % 1000) / 1000})
+    rows = conn.execute(
+        text("SELECT embedding::text FROM nba_embeddings WHERE embedding IS NOT NULL ORDER BY random() LIMIT :n"),
+        {"n": n}
+    ).scalars().all()
+    conn.rollback()
+    rng = np.random.default_rng(seed)
+    out = []
+    for r in rows:
+        v = np.fromstring(r[1:-1], dtype=np.float32, sep=",")
+        v = v + rng.normal(0, 0.05 * np.abs(v).mean(), v.shape).astype(np.float32)
+        out.append(v.tolist())
+    return out
+
+
+def exact_ids(conn, qvec: List[float], k: int) -> List[str]:
+    conn.execute(text("SET LOCAL enable_indexscan = off"))
+    ids = conn.execute(
+        text("SELECT id FROM nba_embeddings ORDER BY embedding <=> CAST(CAST(:q AS text) AS vector) LIMIT :k"),
+        {"q": vector_literal(qvec), "k": k}
+    ).scalars().all()
+    conn.rollback()
+    return ids
+
+
+def run_mode(conn, mode: str, queries: List[List[float]], truth: List[List[str]], k: int) -> dict:
+    sql = text(ann_top_k(COLS, "", "k", quantization=mode))
+    settings_sql, settings = search_settings(k, quantization=mode)
+    latencies, recalls = [], []
+    for qvec, expected in zip(queries, truth):
+        conn.execute(text(settings_sql), settings)
+        t0 = time.perf_counter()
+        ids = [r["id"] for r in conn.execute(sql, {"q": vector_literal(qvec), "k": k}).mappings()]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        conn.rollback()
+        recalls.append(len(set(ids) & set(expected)) / max(len(expected), 1))
+    size = conn.execute(text(f"SELECT pg_relation_size('idx_bench_quant_{mode}')")).scalar()
+    conn.rollback()
+    return {
+        "mode": mode,
+        "index_mb": round(size / 1e6, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare quantized hnsw index layouts")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--keep", action="store_true", help="leave the bench indexes in place")
+    parser.add_argument("--out", default=None, help="also write the report as json")
+    args = parser.parse_args()
+
+    config = Config()
+    db = DatabaseManager(config)
+    modes = [m for m in args.modes.split(",") if m]
+    report = []
+    with db.get_connection() as conn:
+        if pgvector_version(conn) < (0, 7, 0):
+            skipped = [m for m in modes if m != "none"]
+            if skipped:
+                print(f"pgvector < 0.7 has no halfvec / binary_quantize, skipping {', '.join(skipped)}")
+            modes = [m for m in modes if m == "none"]
+        table_mb = conn.execute(text("SELECT pg_table_size('nba_embeddings')")).scalar() / 1e6
+        conn.rollback()
+
+        queries = sample_queries(conn, args.queries, args.seed)
+        truth = [exact_ids(conn, q, args.k) for q in queries]
+        try:
+            for mode in modes:
+                build_secs = build_index(conn, config, mode)
+                row = run_mode(conn, mode, queries, truth, args.k)
+                row["build_s"] = round(build_secs, 1)
+                report.append(row)
+                print(row)
+        finally:
+            if not args.keep:
+                for mode in modes:
+                    conn.execute(text(f"DROP INDEX IF EXISTS idx_bench_quant_{mode}"))
+                conn.commit()
+
+    print(f"\nnba_embeddings table: {table_mb:.1f} MB, {len(queries)} queries, k={args.k}")
+    print(f"{'mode':>8} {'index MB':>9} {'build s':>8} {'p50 ms':>7} {'p95 ms':>7} {'recall':>7}")
+    for row in report:
+        print(f"{row['mode']:>8} {row['index_mb']:>9} {row['build_s']:>8} {row['p50_ms']:>7} "
+              f"{row['p95_ms']:>7} {row[f'recall@{args.k}']:>7}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"table_mb": table_mb, "k": args.k, "queries": len(queries), "modes": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
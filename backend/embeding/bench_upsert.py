@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+from typing import List, Dict, Any
+from sqlalchemy import text
+
+from backend.embeding.config import Config
+from backend.embeding.db_manager import DatabaseManager
+from backend.embeding.vector_store import VectorStore
+
+# compares VectorStore write paths on synthetic docs:
+#   python -m backend.embeding.bench_upsert --docs 5000
+
+
+def make_docs(n: int, dim: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        docs.append({
+            "id": f"bench_{i}",
+            "entity_type": "bench",
+            "entity_id": str(i),
+            "game_id": None,
+            "team_id": None,
+            "player_id": None,
+            "chunk_type": "bench",
+            "content_json": {"i": i},
+            "content_text": f"synthetic benchmark document {i}",
+            "embedding": [rng.random() for _ in range(dim)],
+            "content_hash": f"{seed}_{i}",
+            "source_hash": None,
+            "season": 2024,
+            "game_date": None,
+        })
+    return docs
+
+
+def clear(db: DatabaseManager):
+    with db.get_connection() as conn:
+        conn.execute(text("DELETE FROM nba_embeddings WHERE entity_type = 'bench'"))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nba_embeddings write paths")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    config = Config()
+    if args.batch_size:
+        config.upsert_batch_size = args.batch_size
+    db = DatabaseManager(config)
+    db.initialize_vector_tables()
+    store = VectorStore(db)
+
+    paths = {"insert": store.upsert_documents_insert, "copy": store.upsert_documents_copy}
+    try:
+        for name, fn in paths.items():
+            clear(db)
+            for label, seed in (("new", 0), ("update", 1)):
+                # fresh dicts each time, the insert path serializes content_json in place
+                docs = make_docs(args.docs, config.embed_dim, seed)
+                start = time.perf_counter()
+                fn(docs)
+                secs = time.perf_counter() - start
+                print(f"{name:>6} {label:>6}: {args.docs} docs in {secs:.2f}s ({args.docs / secs:,.0f} docs/sec)")
+    finally:
+        clear(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import logging
+import random
+
+import numpy as np
+
+from backend import fake_ollama
+from backend.embeding.config import Config
+from backend.embeding.embedding_service import EmbeddingService
+
+# the batched /api/embed path (EMBED_MODE=native) against the in-process stub server:
+#   python -m backend.embeding.check_embed_batching
+#   python -m backend.embeding.check_embed_batching --texts 2000 --max-inputs 16 --max-chars 4000
+# checks that sub-batches cover every input once, in order, within the char / input budgets,
+# and that the batched vectors are the ones single-text requests give. exits 1 on any failure
+
+
+def make_texts(n: int, seed: int = 0):
+    # mixed lengths, some duplicates and one text over the char budget on its own
+    rng = random.Random(seed)
+    texts = [" ".join(f"w{rng.randrange(5000)}" for _ in range(rng.randrange(1, 300))) for _ in range(n)]
+    texts += texts[:5] + ["long " * 20000]
+    rng.shuffle(texts)
+    return texts
+
+
+def check_sub_batches(service: EmbeddingService, texts) -> list:
+    problems = []
+    batches = service._sub_batches(texts)
+    flat = [i for batch in batches for i in batch]
+    if flat != list(range(len(texts))):
+        problems.append("sub-batches don't cover every input exactly once, in order")
+    for batch in batches:
+        chars = sum(len(texts[i]) for i in batch)
+        if len(batch) > service.config.max_batch_inputs:
+            problems.append(f"batch of {len(batch)} inputs over max_batch_inputs")
+        if chars > service.config.max_batch_chars and len(batch) > 1:
+            problems.append(f"batch of {chars} chars over max_batch_chars")
+    print(f"{len(texts)} texts -> {len(batches)} requests")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check batched embedding against the stub ollama")
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--max-inputs", type=int, default=None)
+    parser.add_argument("--max-chars", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    server, url = fake_ollama.start()
+    config = Config()
+    config.ollama_host = url
+    config.embed_cache_path = ""
+    config.embed_backend = "ollama"
+    config.embed_mode = "native"
+    if args.max_inputs:
+        config.max_batch_inputs = args.max_inputs
+    if args.max_chars:
+        config.max_batch_chars = args.max_chars
+    service = EmbeddingService(config)
+
+    texts = make_texts(args.texts)
+    problems = check_sub_batches(service, texts)
+
+    batched = np.asarray(service.embed_batch(texts))
+    single = np.asarray([service._embed_many([t])[0] for t in texts])
+    diff = float(np.max(np.abs(batched - single)))
+    print(f"batched vs one text per request: max abs diff {diff:.2e}")
+    if diff > 1e-6:
+        problems.append("batched vectors differ from single-text ones (order or content)")
+
+    server.should_exit = True
+    for p in problems:
+        print(f"  FAIL: {p}")
+    print("OK" if not problems else f"{len(problems)} problems")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import collections
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+# how many embedding requests go to ollama at once, and when a failed one is tried again.
+# instead of a fixed pool the limit follows what the server sustains (AIMD, like tcp):
+#   +1 slot per round of requests that came back within the latency target,
+#   x backoff on a timeout, a 429 / 503 or a slow round, at most once per request latency
+# every retry comes out of one RetryBudget, so a saturated server gets less traffic, not a storm.
+# the gauges below are in the default prometheus registry (PIPELINE_METRICS_FILE writes them out)
+
+LIMIT = Gauge("embed_concurrency_limit", "Embedding requests allowed in flight")
+IN_FLIGHT = Gauge("embed_requests_in_flight", "Embedding requests in flight")
+THROUGHPUT = Gauge("embed_inputs_per_second", "Texts embedded per second over the last window")
+LATENCY = Gauge("embed_seconds_per_input", "Smoothed embedding request latency per input text")
+REQUESTS = Counter("embed_requests_total", "Embedding requests by outcome", ["outcome"])
+RETRIES = Counter("embed_retries_total", "Embedding requests retried")
+RETRIES_DENIED = Counter("embed_retries_denied_total", "Retries refused by the retry budget")
+
+# outcomes that mean the server has more than it can handle
+OVERLOAD = {"timeout", "throttled", "slow"}
+
+
+class AdaptiveLimiter:
+    """Additive increase / multiplicative decrease limit on requests in flight.
+
+    A response within the latency target adds ``1 / limit`` while the limit is in use
+    (about +1 per round of requests). Timeouts, 429 / 503s and smoothed latency over the
+    target multiply it by ``backoff``, once per request latency so a burst of bad responses
+    counts once. Latency is per input since requests carry different numbers of texts; with
+    no explicit target it is ``tolerance`` x the fastest seen, i.e. ollama started queueing.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_target: float = 0.0,
+                 tolerance: float = 2.0, backoff: float = 0.7, window: float = 10.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target  # seconds per input, 0 = tolerance x baseline
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+
+        self.in_flight = 0
+        self.latency = 0.0        # smoothed seconds per input
+        self.baseline = 0.0       # fastest seconds per input, creeps up so one lucky response doesn't stick
+        self.request_secs = 0.0   # smoothed request latency, the spacing between decreases
+        self.last_decrease = 0.0
+        self.counts: Dict[str, int] = collections.Counter()
+        self.done = collections.deque()  # (finish time, inputs) over the last window
+        self.done_inputs = 0
+        self.started = time.monotonic()
+        self.cond = threading.Condition()
+        LIMIT.set(self.limit)
+
+    def acquire(self) -> float:
+        # blocks for a slot, returns the start time to hand back to release
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            IN_FLIGHT.set(self.in_flight)
+        return time.monotonic()
+
+    def release(self, start: float, inputs: int, outcome: str = "ok"):
+        # outcome: ok, timeout, throttled (429 / 503) or error (anything else, limit unchanged)
+        now = time.monotonic()
+        secs = now - start
+        with self.cond:
+            in_use = self.in_flight >= int(self.limit) / 2
+            self.in_flight -= 1
+            self.request_secs = secs if not self.request_secs else self.request_secs + 0.2 * (secs - self.request_secs)
+
+            if outcome == "ok":
+                per_input = secs / max(1, inputs)
+                self.latency = per_input if not self.latency else self.latency + 0.2 * (per_input - self.latency)
+                self.baseline = per_input if not self.baseline else min(per_input, self.baseline * 1.001)
+                if self.latency > (self.latency_target or self.tolerance * self.baseline):
+                    outcome = "slow"
+                elif in_use:
+                    # with the limit half idle a bigger one tells us nothing
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.done.append((now, inputs))
+                self.done_inputs += inputs
+
+            if outcome in OVERLOAD and now - self.last_decrease >= self.request_secs:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+
+            self.counts[outcome] += 1
+            REQUESTS.labels(outcome).inc()
+            LIMIT.set(self.limit)
+            IN_FLIGHT.set(self.in_flight)
+            LATENCY.set(self.latency)
+            THROUGHPUT.set(self._rate(now))
+            self.cond.notify_all()
+
+    def _rate(self, now: float) -> float:
+        while self.done and self.done[0][0] < now - self.window:
+            self.done_inputs -= self.done.popleft()[1]
+        return self.done_inputs / max(1e-6, min(self.window, now - self.started))
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "inputs_per_sec": self._rate(time.monotonic()),
+                "ms_per_input": self.latency * 1000,
+                **self.counts,
+            }
+
+
+class RetryBudget:
+    """Retries shared by every request: ``min_retries`` plus ``ratio`` of the requests
+    started in the last ``window`` seconds, at most ``max_retries`` for any one request.
+
+    Waits are full jitter exponential backoff, or the server's Retry-After if longer.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_retries: int = 10, max_retries: int = 3,
+                 base_delay: float = 1.0, max_delay: float = 30.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.requests = collections.deque()
+        self.retries = collections.deque()
+        self.total_retries = 0
+        self.denied = 0
+        self.lock = threading.Lock()
+
+    def _trim(self, now: float):
+        for times in (self.requests, self.retries):
+            while times and times[0] < now - self.window:
+                times.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            self.requests.append(now)
+
+    def try_retry(self, attempt: int) -> bool:
+        # attempt = retries this request already had
+        if attempt >= self.max_retries:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            if len(self.retries) >= self.min_retries + self.ratio * len(self.requests):
+                self.denied += 1
+                RETRIES_DENIED.inc()
+                return False
+            self.retries.append(now)
+            self.total_retries += 1
+        RETRIES.inc()
+        return True
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, min(retry_after or 0.0, self.max_delay))
+
+
+def retry_after_secs(headers) -> Optional[float]:
+    # Retry-After in seconds (the http-date form isn't worth parsing here)
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
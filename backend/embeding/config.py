@@ -1,6 +1,35 @@
 import os
 from dataclasses import dataclass
 from typing import Optional
+
+# distance name -> (query operator, hnsw operator class); the index only serves
+# ORDER BY on the operator its opclass was built for
+DISTANCE_OPS = {
+    "cosine": ("<=>", "vector_cosine_ops"),
+    "l2": ("<->", "vector_l2_ops"),
+    "ip": ("<#>", "vector_ip_ops"),
+}
+
+
+
+def ann_index(quantization: str, distance: str, dim: int):
+    """(indexed expression, opclass, operator, query expression) for the hnsw indexes.
+
+    Quantized indexes are expression indexes over the full precision column, so
+    the table keeps ``vector`` for re-ranking. ``{q}`` in the query expression
+    is the query vector. Needs pgvector >= 0.7 for halfvec / bit.
+    """
+    op, opclass = DISTANCE_OPS[distance]
+    if quantization == "halfvec":
+        return (f"(embedding::halfvec({dim}))", opclass.replace("vector_", "halfvec_"), op,
+                f"CAST({{q}} AS halfvec({dim}))")
+    if quantization == "bit":
+        # sign bits compared by hamming distance, whatever VECTOR_DISTANCE is
+        return (f"(binary_quantize(embedding)::bit({dim}))", "bit_hamming_ops", "<~>",
+                f"binary_quantize({{q}})::bit({dim})")
+    return "embedding", opclass, op, "{q}"
+
+
 # config for embed specifically 
 @dataclass
 class Config:
@@ -14,12 +43,97 @@ class Config:
     
     # Processing
     batch_size: int = 128  # Records per batch
-    max_workers: int = 10  # Parallel embedding workers
-    
-    # Retry logic
-    max_retries: int = 3
-    retry_delay: float = 1.0
-    
+
+    # embedding requests in flight to ollama, adapted between min and max from latency,
+    # timeouts and 429 / 503s (backend/embeding/concurrency.py), starting at embed_concurrency
+    embed_concurrency: int = int(os.getenv("EMBED_CONCURRENCY", "8"))
+    embed_min_concurrency: int = int(os.getenv("EMBED_MIN_CONCURRENCY", "1"))
+    embed_max_concurrency: int = int(os.getenv("EMBED_MAX_CONCURRENCY", "16"))
+    # smoothed ms per embedded text that counts as overloaded, 0 = twice the fastest seen
+    embed_latency_target_ms: float = float(os.getenv("EMBED_LATENCY_TARGET_MS", "0"))
+
+    # "ollama" embeds over http, "local" runs the model in process on cpu (backend/embeding/local_embedder.py)
+    embed_backend: str = os.getenv("EMBED_BACKEND", "ollama")
+    local_embed_model: str = os.getenv("LOCAL_EMBED_MODEL", "nomic-ai/nomic-embed-text-v1.5")  # hf hub id or local dir
+    local_embed_threads: int = int(os.getenv("LOCAL_EMBED_THREADS", "0"))  # torch intra-op threads, 0 = torch's default
+    local_embed_batch_size: int = int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32"))
+    local_embed_batch_tokens: int = int(os.getenv("LOCAL_EMBED_BATCH_TOKENS", "8192"))  # padded tokens per forward pass
+    local_embed_max_tokens: int = int(os.getenv("LOCAL_EMBED_MAX_TOKENS", "8192"))  # nomic-embed-text context
+    local_embed_quantize: bool = os.getenv("LOCAL_EMBED_QUANTIZE", "0") == "1"  # int8 dynamic quantization
+
+    # "native" sends many inputs per request to /api/embed, "single" is one prompt per /api/embeddings call
+    embed_mode: str = os.getenv("EMBED_MODE", "native")
+    max_batch_chars: int = int(os.getenv("EMBED_MAX_BATCH_CHARS", "32000"))  # total text length per /api/embed request
+    max_batch_inputs: int = int(os.getenv("EMBED_MAX_BATCH_INPUTS", "64"))
+
+    # "streaming" overlaps extract -> build -> embed -> upsert through bounded queues, "batch" runs them in sequence
+    pipeline_mode: str = os.getenv("PIPELINE_MODE", "streaming")
+    max_inflight_docs: int = int(os.getenv("PIPELINE_MAX_INFLIGHT_DOCS", "2048"))  # memory ceiling across all queues
+    pipeline_log_interval: float = 10.0  # seconds between throughput / queue depth logs
+    incremental: bool = os.getenv("PIPELINE_INCREMENTAL", "1") == "1"  # skip source rows whose hash is unchanged
+    # "batch" extracts column chunks for the column-at-a-time BatchDocumentBuilder, "row" = row dicts + DocumentBuilder
+    build_mode: str = os.getenv("BUILD_MODE", "batch")
+
+    # "copy" = binary COPY into a staging table + one merge per batch, "insert" = row-by-row INSERT ... ON CONFLICT
+    upsert_mode: str = os.getenv("UPSERT_MODE", "copy")
+    upsert_batch_size: int = int(os.getenv("UPSERT_BATCH_SIZE", "1000"))  # docs per committed merge
+
+    # on-disk embedding cache keyed by (embed_model, sha256(text)), empty path disables it
+    embed_cache_path: str = os.getenv(
+        "EMBED_CACHE_PATH",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "embed_cache.sqlite")
+    )
+    embed_cache_max_mb: int = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))
+
+    # HNSW index. "deferred" builds it once after the pipeline has loaded everything
+    # (parallel maintenance workers), "eager" creates it up front so every upsert maintains it
+    index_mode: str = os.getenv("INDEX_MODE", "deferred")
+    vector_distance: str = os.getenv("VECTOR_DISTANCE", "cosine")  # must match backend/config.py
+    # "none", "halfvec" (2 bytes/dim) or "bit" (1 bit/dim) hnsw indexes, must match backend/config.py
+    vector_quantization: str = os.getenv("VECTOR_QUANTIZATION", "none")
+    hnsw_m: int = int(os.getenv("HNSW_M", "16"))
+    hnsw_ef_construction: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+    index_build_workers: int = int(os.getenv("INDEX_BUILD_WORKERS", "4"))  # max_parallel_maintenance_workers
+    index_build_mem: str = os.getenv("INDEX_BUILD_MEM", "1GB")  # maintenance_work_mem, graph should fit in it
+
+    # Retry logic, one budget for all embedding requests: at most max_retries per request and
+    # retry_budget_min + retry_budget_ratio x requests over the last 10s across all of them
+    max_retries: int = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+    retry_delay: float = float(os.getenv("EMBED_RETRY_DELAY", "1.0"))  # backoff base, full jitter
+    retry_budget_ratio: float = float(os.getenv("EMBED_RETRY_BUDGET_RATIO", "0.1"))
+    retry_budget_min: int = int(os.getenv("EMBED_RETRY_BUDGET_MIN", "10"))
+
+    # prometheus textfile with the embed concurrency / throughput gauges, rewritten every log interval
+    metrics_file: str = os.getenv("PIPELINE_METRICS_FILE", "")
+
+    @property
+    def embed_workers(self) -> int:
+        # chunks the streaming pipeline embeds at once, enough requests to fill embed_max_concurrency
+        # (the local backend batches inside one call instead)
+        if self.embed_backend == "local":
+            return 1
+        requests_per_chunk = -(-self.batch_size // self.max_batch_inputs)
+        return max(1, -(-self.embed_max_concurrency // requests_per_chunk))
+
+    @property
+    def queue_size(self) -> int:
+        # chunks of batch_size per queue so the three queues plus the chunks being embedded
+        # stay under max_inflight_docs
+        free = self.max_inflight_docs - self.embed_workers * self.batch_size
+        return max(1, free // (3 * self.batch_size))
+
+    @property
+    def vector_opclass(self) -> str:
+        return ann_index(self.vector_quantization, self.vector_distance, self.embed_dim)[1]
+
+    @property
+    def vector_index_expression(self) -> str:
+        return ann_index(self.vector_quantization, self.vector_distance, self.embed_dim)[0]
+
     @property
     def embedding_endpoint(self) -> str:
-        return f"{self.ollama_host}/api/embeddings"
\ No newline at end of file
+        return f"{self.ollama_host}/api/embeddings"
+
+    @property
+    def batch_embedding_endpoint(self) -> str:
+        return f"{self.ollama_host}/api/embed"
\ No newline at end of file
@@ -1,63 +1,46 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Union
 from sqlalchemy import text
 from backend.embeding.db_manager import DatabaseManager
 
-class DataExtractor:
-    def __init__(self, db_manager: DatabaseManager):
-        self.db = db_manager
-
-    def extract_teams(self) -> List[Dict[str, Any]]:
-
-        query = """
+TEAMS_QUERY = """
         SELECT
             team_id, city, name, abbreviation,
             conference, division
         FROM teams
-        ORDER BY team_id
         """
-        with self.db.get_connection() as conn:
-            res = conn.execute(text(query))
-            return [dict(row._mapping) for row in res]
-        
-    def extract_players(self) -> List[Dict[str, Any]]:
-        query = """
-        SELECT 
+TEAMS_ORDER = "ORDER BY team_id"
+TEAMS_DOC_ID = "'team_' || s.team_id || '_profile'"
+
+PLAYERS_QUERY = """
+        SELECT
             p.player_id, p.team_id, p.first_name, p.last_name,
             p.position, p.height, p.weight, p.birth_date,
             p.draft_year, p.season_exp,
             t.name as team_name, t.abbreviation as team_abbr
         FROM players p
         LEFT JOIN teams t ON p.team_id = t.team_id
-        ORDER BY p.player_id
-        """ 
+        """
+PLAYERS_ORDER = "ORDER BY p.player_id"
+PLAYERS_DOC_ID = "'player_' || s.player_id || '_profile'"
 
-        with self.db.get_connection() as conn:
-            res = conn.execute(text(query))
-            return [dict(row._mapping) for row in res]
-        
-    def extract_games(self) -> List[Dict[str, Any]]:
-        query = """
-        SELECT 
+GAMES_QUERY = """
+        SELECT
             g.game_id, g.season, g.game_timestamp::date as game_date,
-            g.home_team_id, g.away_team_id, 
+            g.home_team_id, g.away_team_id,
             g.home_points, g.away_points, g.winning_team_id,
-            ht.name as home_team_name, ht.abbreviation as 
+            ht.name as home_team_name, ht.abbreviation as
                 home_team_abbr,
-            at.name as away_team_name, at.abbreviation as 
+            at.name as away_team_name, at.abbreviation as
                 away_team_abbr
             FROM game_details g
             JOIN teams ht ON g.home_team_id = ht.team_id
             JOIN teams at ON g.away_team_id = at.team_id
-            ORDER BY g.game_timestamp DESC
         """
+GAMES_ORDER = "ORDER BY g.game_timestamp DESC"
+GAMES_DOC_ID = "'game_' || s.game_id || '_summary'"
 
-        with self.db.get_connection() as conn:
-            res = conn.execute(text(query))
-            return [dict(row._mapping) for row in res]
-        
-    def extract_boxscores(self) -> List[Dict[str, Any]]:
-        query = """
-        SELECT 
+BOXSCORES_QUERY = """
+        SELECT
             b.game_id, b.person_id as player_id, b.team_id,
             b.starter, b.seconds, b.points,
             b.fg2_made, b.fg2_attempted,
@@ -73,9 +56,95 @@ class DataExtractor:
         JOIN players p ON b.person_id = p.player_id
         JOIN teams t ON b.team_id = t.team_id
         JOIN game_details g ON b.game_id = g.game_id
-        ORDER BY g.game_timestamp DESC, b.points DESC
         """
+BOXSCORES_ORDER = "ORDER BY g.game_timestamp DESC, b.points DESC"
+BOXSCORES_DOC_ID = "'boxscore_' || s.game_id || '_' || s.player_id"
+
 
+def with_source_hash(query: str, doc_id: str, changed_only: bool) -> str:
+    """Add an md5 of each source row as ``source_hash``.
+
+    With ``changed_only`` the rows whose hash already matches the one stored
+    on their nba_embeddings document are filtered out in SQL, so unchanged
+    rows never reach the DocumentBuilder.
+    """
+    hashed = f"SELECT q.*, md5(q::text) AS source_hash FROM ({query}) q"
+    if not changed_only:
+        return hashed
+    return f"""
+        SELECT s.* FROM ({hashed}) s
+        LEFT JOIN nba_embeddings e ON e.id = {doc_id}
+        WHERE e.source_hash IS DISTINCT FROM s.source_hash
+        """
+
+
+# a list of row dicts, or {column: [values]} with columns=True
+Chunk = Union[List[Dict[str, Any]], Dict[str, List[Any]]]
+
+
+def to_columns(keys: List[str], rows) -> Dict[str, List[Any]]:
+    # rows transposed into one list per column (BatchDocumentBuilder input), {} when empty
+    rows = list(rows)
+    if not rows:
+        return {}
+    return dict(zip(keys, map(list, zip(*rows))))
+
+
+class DataExtractor:
+    # columns=True returns / yields {column: [values]} instead of a list of row dicts,
+    # which skips building a dict per row (see backend/embeding/batch_builder.py)
+    def __init__(self, db_manager: DatabaseManager):
+        self.db = db_manager
+
+    def _fetch_all(self, query: str, columns: bool = False) -> Chunk:
         with self.db.get_connection() as conn:
             res = conn.execute(text(query))
-            return [dict(row._mapping) for row in res]
\ No newline at end of file
+            if columns:
+                return to_columns(list(res.keys()), res)
+            return [dict(row._mapping) for row in res]
+
+    def _stream(self, query: str, chunk_size: Optional[int] = None, columns: bool = False) -> Iterator[Chunk]:
+        # server side (named) cursor, only chunk_size rows are held client side at a time
+        chunk_size = chunk_size or self.db.config.batch_size
+        with self.db.get_connection() as conn:
+            res = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(query))
+            keys = list(res.keys())
+            for part in res.partitions(chunk_size):
+                if columns:
+                    yield to_columns(keys, part)
+                else:
+                    yield [dict(row._mapping) for row in part]
+
+    def extract_teams(self, changed_only: bool = False, columns: bool = False) -> Chunk:
+        return self._fetch_all(with_source_hash(TEAMS_QUERY + TEAMS_ORDER, TEAMS_DOC_ID, changed_only), columns)
+
+    def extract_players(self, changed_only: bool = False, columns: bool = False) -> Chunk:
+        return self._fetch_all(with_source_hash(PLAYERS_QUERY + PLAYERS_ORDER, PLAYERS_DOC_ID, changed_only), columns)
+
+    def extract_games(self, changed_only: bool = False, columns: bool = False) -> Chunk:
+        return self._fetch_all(with_source_hash(GAMES_QUERY + GAMES_ORDER, GAMES_DOC_ID, changed_only), columns)
+
+    def extract_boxscores(self, changed_only: bool = False, columns: bool = False) -> Chunk:
+        return self._fetch_all(with_source_hash(BOXSCORES_QUERY + BOXSCORES_ORDER, BOXSCORES_DOC_ID, changed_only), columns)
+
+    # streaming variants yield chunks of chunk_size rows, ordered=False skips the sort
+    # changed_only=True only returns rows whose source_hash differs from nba_embeddings
+    def stream_teams(self, chunk_size: Optional[int] = None, ordered: bool = True,
+                     changed_only: bool = False, columns: bool = False) -> Iterator[Chunk]:
+        query = TEAMS_QUERY + (TEAMS_ORDER if ordered else "")
+        return self._stream(with_source_hash(query, TEAMS_DOC_ID, changed_only), chunk_size, columns)
+
+    def stream_players(self, chunk_size: Optional[int] = None, ordered: bool = True,
+                       changed_only: bool = False, columns: bool = False) -> Iterator[Chunk]:
+        query = PLAYERS_QUERY + (PLAYERS_ORDER if ordered else "")
+        return self._stream(with_source_hash(query, PLAYERS_DOC_ID, changed_only), chunk_size, columns)
+
+    def stream_games(self, chunk_size: Optional[int] = None, ordered: bool = True,
+                     changed_only: bool = False, columns: bool = False) -> Iterator[Chunk]:
+        query = GAMES_QUERY + (GAMES_ORDER if ordered else "")
+        return self._stream(with_source_hash(query, GAMES_DOC_ID, changed_only), chunk_size, columns)
+
+    def stream_boxscores(self, chunk_size: Optional[int] = None, ordered: bool = True,
+                         changed_only: bool = False, columns: bool = False) -> Iterator[Chunk]:
+        query = BOXSCORES_QUERY + (BOXSCORES_ORDER if ordered else "")
+        return self._stream(with_source_hash(query, BOXSCORES_DOC_ID, changed_only), chunk_size, columns)
@@ -1,9 +1,22 @@
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from contextlib import contextmanager
+import argparse
 import logging
+import time
 from backend.embeding.config import Config
 
+# hnsw index name -> entity_type it is scoped to. The per type ones keep per type
+# top-k (retrieval.build_multi_query) from being starved by the global index
+# post-filtering on entity_type
+VECTOR_INDEXES = {
+    "idx_embeddings_vector": None,
+    "idx_embeddings_vector_game": "game",
+    "idx_embeddings_vector_boxscore": "boxscore",
+    "idx_embeddings_vector_player": "player",
+    "idx_embeddings_vector_team": "team",
+}
+
 class DatabaseManager:
     def __init__(self, config: Config):
         self.config = config
@@ -32,8 +45,14 @@ class DatabaseManager:
         finally:
             conn.close()
         
-    def initialize_vector_tables(self):
-        """Create pgvector extension and tables"""
+    def initialize_vector_tables(self, full_load: bool = False):
+        """Create pgvector extension and tables.
+
+        In deferred index mode a ``full_load`` (every source row re-extracted)
+        drops all hnsw indexes so the load doesn't maintain the graphs row by
+        row, ``build_vector_indexes`` recreates them afterwards. Incremental
+        runs only drop indexes built with other settings.
+        """
         ddl = """
         CREATE EXTENSION IF NOT EXISTS vector;
         
@@ -46,7 +65,7 @@ class DatabaseManager:
             entity_id TEXT NOT NULL,     -- Original ID from source table
             
             -- Foreign keys (nullable based on entity type)
-            game_id BIGINT REFERENCES games(game_id) ON DELETE CASCADE,
+            game_id BIGINT REFERENCES game_details(game_id) ON DELETE CASCADE,
             team_id BIGINT REFERENCES teams(team_id) ON DELETE CASCADE,
             player_id BIGINT REFERENCES players(player_id) ON DELETE CASCADE,
             
@@ -64,13 +83,23 @@ class DatabaseManager:
             
             -- Tracking
             content_hash TEXT NOT NULL,
+            source_hash TEXT,            -- md5 of the extracted source row
             created_at TIMESTAMPTZ DEFAULT NOW(),
             updated_at TIMESTAMPTZ DEFAULT NOW()
         );
         
-        -- Indexes for efficient retrieval
-        CREATE INDEX IF NOT EXISTS idx_embeddings_vector 
-            ON nba_embeddings USING hnsw (embedding vector_l2_ops);
+        -- bumped on every embedding write so query caches know to invalidate
+        CREATE TABLE IF NOT EXISTS nba_embeddings_version (
+            id INTEGER PRIMARY KEY DEFAULT 1,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        INSERT INTO nba_embeddings_version (id) VALUES (1) ON CONFLICT DO NOTHING;
+        
+        -- tables created before source_hash existed
+        ALTER TABLE nba_embeddings ADD COLUMN IF NOT EXISTS source_hash TEXT;
+        
+        -- Indexes for efficient retrieval (hnsw ones are in build_vector_indexes)
         CREATE INDEX IF NOT EXISTS idx_embeddings_entity 
             ON nba_embeddings(entity_type, entity_id);
         CREATE INDEX IF NOT EXISTS idx_embeddings_game 
@@ -87,4 +116,76 @@ class DatabaseManager:
         
         with self.get_connection() as conn:
             conn.execute(text(ddl))
-            conn.commit()
\ No newline at end of file
+            conn.commit()
+        
+        if self.config.index_mode == "eager":
+            self.build_vector_indexes()
+        else:
+            # stale ones get rebuilt after the load anyway. current ones are kept for incremental
+            # runs, which touch few rows, a full load rebuilds them too rather than maintain them
+            self.drop_vector_indexes(stale_only=not full_load)
+
+    def _vector_index_sql(self, name: str, entity_type: str = None) -> str:
+        where = f" WHERE entity_type = '{entity_type}'" if entity_type else ""
+        return (
+            f"CREATE INDEX IF NOT EXISTS {name} ON nba_embeddings "
+            f"USING hnsw ({self.config.vector_index_expression} {self.config.vector_opclass}) "
+            f"WITH (m = {self.config.hnsw_m}, ef_construction = {self.config.hnsw_ef_construction}){where}"
+        )
+
+    def _stale_vector_indexes(self, conn) -> list:
+        # existing hnsw indexes whose opclass or m / ef_construction differ from the config
+        rows = conn.execute(text("""
+            SELECT c.relname, pg_get_indexdef(c.oid), c.reloptions
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = 'nba_embeddings'::regclass
+        """)).all()
+        want = sorted([f"m={self.config.hnsw_m}", f"ef_construction={self.config.hnsw_ef_construction}"])
+        return [
+            name for name, indexdef, opts in rows
+            if name in VECTOR_INDEXES
+            and (self.config.vector_opclass not in indexdef or sorted(opts or []) != want)
+        ]
+
+    def drop_vector_indexes(self, stale_only: bool = False):
+        with self.get_connection() as conn:
+            names = self._stale_vector_indexes(conn) if stale_only else list(VECTOR_INDEXES)
+            for name in names:
+                self.logger.info(f"Dropping vector index {name}")
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            conn.commit()
+
+    def build_vector_indexes(self, rebuild: bool = False):
+        """Create the hnsw indexes, rebuilding any built with other settings.
+
+        Meant to run once after a bulk load: building the graph over all rows
+        with parallel workers is much cheaper than maintaining it row by row.
+        Indexes that already match the config are left alone.
+        """
+        if rebuild:
+            self.drop_vector_indexes()
+        else:
+            self.drop_vector_indexes(stale_only=True)
+
+        with self.get_connection() as conn:
+            for name, entity_type in VECTOR_INDEXES.items():
+                t0 = time.perf_counter()
+                conn.execute(text(f"SET LOCAL maintenance_work_mem = '{self.config.index_build_mem}'"))
+                conn.execute(text(f"SET LOCAL max_parallel_maintenance_workers = {self.config.index_build_workers}"))
+                conn.execute(text(self._vector_index_sql(name, entity_type)))
+                conn.commit()
+                self.logger.info(f"Vector index {name} ready in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the nba_embeddings hnsw indexes")
+    parser.add_argument("action", choices=["build", "rebuild", "drop"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = DatabaseManager(Config())
+    if args.action == "drop":
+        db.drop_vector_indexes()
+    else:
+        db.build_vector_indexes(rebuild=args.action == "rebuild")
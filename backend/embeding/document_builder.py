@@ -3,6 +3,15 @@ import json
 from typing import Dict, List, Any
 from datetime import date, datetime
 
+
+def json_default(o):
+    # json.dumps hook for the values the builders can't encode natively
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+
+    return str(o)
+
+
 class DocumentBuilder:
 
     @staticmethod
@@ -11,14 +20,7 @@ class DocumentBuilder:
     
     @staticmethod
     def json_serialize(obj: Any) -> str:
-        
-        def default(o):
-            if isinstance(o, (date, datetime)):
-                return o.isoformat()
-
-            return str(o)
-        
-        return json.dumps(obj, default=default, sort_keys=True)
+        return json.dumps(obj, default=json_default, sort_keys=True)
     
 
     def build_team_document(self, team: Dict[str, Any]) -> Dict[str, Any]:
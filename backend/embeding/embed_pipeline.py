@@ -1,21 +1,49 @@
 import logging
-from typing import List, Dict, Any
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Optional
+from prometheus_client import REGISTRY, write_to_textfile
 from tqdm import tqdm
 
 from backend.embeding.config import Config
 from backend.embeding.db_manager import DatabaseManager
-from backend.embeding.data_extractor import DataExtractor
+from backend.embeding.batch_builder import BatchDocumentBuilder
+from backend.embeding.data_extractor import DataExtractor, Chunk
 from backend.embeding.document_builder import DocumentBuilder
-from backend.embeding.embedding_service import EmbeddingService
+from backend.embeding.embedding_service import EmbeddingError, EmbeddingService
 from backend.embeding.vector_store import VectorStore
 
+_DONE = object()  # end-of-stream marker passed between stages
+
+
+class StageStats:
+    # per-stage counters for the streaming pipeline
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, n: int, secs: float):
+        with self.lock:
+            self.items += n
+            self.busy += secs
+
+    def rate(self) -> float:
+        # busy is summed over the stage's threads
+        return self.items * self.workers / self.busy if self.busy > 0 else 0.0
+
+
 class EmbeddingPipeline:
     # main pipeline orchestrator 
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config or Config()
         self.db_manager = DatabaseManager(self.config)
         self.extractor = DataExtractor(self.db_manager)
         self.builder = DocumentBuilder()
+        self.batch_builder = BatchDocumentBuilder()
         self.embedding_service = EmbeddingService(self.config)
         self.vector_store = VectorStore(self.db_manager)
 
@@ -26,25 +54,61 @@ class EmbeddingPipeline:
 
         self.logger = logging.getLogger(__name__)
 
-    def process_entity_type(self, entity_name: str, extract_func: callable, build_func: callable) -> int:
+    @staticmethod
+    def _num_rows(chunk: Chunk) -> int:
+        if isinstance(chunk, dict):
+            return len(next(iter(chunk.values()), []))
+        return len(chunk)
+
+    def _build_docs(self, chunk: Chunk, build_func: callable, entity_type: str) -> List[Dict[str, Any]]:
+        # column chunks go through the batch builder, row dicts one by one through build_func
+        if isinstance(chunk, dict):
+            docs = self.batch_builder.build(entity_type, chunk)
+            source_hashes = chunk.get('source_hash') or [None] * len(docs)
+        else:
+            docs = [build_func(rec) for rec in chunk]
+            source_hashes = [rec.get('source_hash') for rec in chunk]
+        for doc, source_hash in zip(docs, source_hashes):
+            doc['source_hash'] = source_hash
+        return docs
+
+    def _embed_docs(self, docs: List[Dict[str, Any]], entity_name: str) -> List[Dict[str, Any]]:
+        # sets doc['embedding'], docs whose text failed to embed are dropped (logged) instead of
+        # failing the run, with no row written they're picked up again by the next incremental run
+        try:
+            embeds = self.embedding_service.embed_batch([doc['content_text'] for doc in docs])
+        except EmbeddingError as e:
+            self.logger.error(f"Skipping {len(e.failed)} {entity_name} docs that failed to embed: "
+                              f"{[docs[i]['id'] for i in e.failed[:10]]}")
+            embeds = e.embeddings
+        for doc, emb in zip(docs, embeds):
+            doc['embedding'] = emb
+        return [doc for doc in docs if doc['embedding'] is not None]
+
+    def _split_changed(self, docs: List[Dict[str, Any]], existing_hashes: Dict[str, str]):
+        # docs needing an embedding, and docs whose source row changed but built text didn't
+        new_docs, source_only = [], []
+        for doc in docs:
+            if existing_hashes.get(doc['id']) != doc['content_hash']:
+                new_docs.append(doc)
+            else:
+                source_only.append(doc)
+        return new_docs, source_only
+
+    def process_entity_type(self, entity_name: str, entity_type: str,
+                            extract_func: callable, build_func: callable) -> int:
         self.logger.info(f"Processing {entity_name}...")
 
         raw = extract_func()
         if not raw:
-            self.logger.warning(f"No {entity_name} data found")
+            self.logger.info(f"No new/changed {entity_name} source rows")
             return 0
         
-        docs = []
-        for rec in raw:
-            doc = build_func(rec)
-            docs.append(doc)
-
-        existing_hashes = self.vector_store.get_existing_hashes()
-        new_docs = [
-            doc for doc in docs
-            if doc['id'] not in existing_hashes or
-            existing_hashes[doc['id']] != doc['content_hash']
-        ]
+        docs = self._build_docs(raw, build_func, entity_type)
+
+        existing_hashes = self.vector_store.get_existing_hashes(entity_type)
+        new_docs, source_only = self._split_changed(docs, existing_hashes)
+        self.vector_store.update_source_hashes(source_only)
 
         if not new_docs:
             self.logger.info(f"No new/changed {entity_name} doc")
@@ -52,54 +116,221 @@ class EmbeddingPipeline:
         
         self.logger.info(f"Processing {len(new_docs)} new/changed {entity_name} docs")
 
-        texts = [doc['content_text'] for doc in new_docs]
-        all_embeds = []
+        embedded = []
 
-        for i in tqdm(range(0, len(texts), self.config.batch_size),
+        # embed_workers chunks per call so there are enough requests to fill the concurrency limit
+        step = self.config.batch_size * self.config.embed_workers
+        for i in tqdm(range(0, len(new_docs), step),
                       desc=f"Embedding {entity_name}"):
-            batch = texts[i:i+self.config.batch_size]
-            batch_embeds = self.embedding_service.embed_batch(batch)
-            all_embeds.extend(batch_embeds)
+            embedded.extend(self._embed_docs(new_docs[i:i+step], entity_name))
 
-        for doc, embed in zip(new_docs, all_embeds):
-            doc['embedding'] = embed
+        self.vector_store.upsert_documents(embedded)
 
-        self.vector_store.upsert_documents(new_docs)
-
-        return len(new_docs)
+        return len(embedded)
     
+    def _put(self, q: queue.Queue, item, stop: threading.Event) -> bool:
+        # blocking put that gives up once another stage has failed
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def process_entity_type_streaming(self, entity_name: str, entity_type: str,
+                                      stream_func: callable, build_func: callable) -> int:
+        """Run extract -> build -> embed -> upsert concurrently with bounded queues.
+
+        ``stream_func`` yields chunks of raw rows (see ``DataExtractor.stream_*``).
+        Each queue holds at most ``config.queue_size`` chunks of ``batch_size`` rows and
+        ``config.embed_workers`` chunks are embedded at once (enough requests for the
+        embedding service's concurrency limit to use), so no more than
+        ``max_inflight_docs`` rows/docs are held between stages.
+        """
+        self.logger.info(f"Processing {entity_name} (streaming)...")
+
+        stop = threading.Event()
+        errors = []
+        raw_q = queue.Queue(maxsize=self.config.queue_size)
+        doc_q = queue.Queue(maxsize=self.config.queue_size)
+        emb_q = queue.Queue(maxsize=self.config.queue_size)
+        embed_workers = self.config.embed_workers
+        stats = {
+            name: StageStats(name, embed_workers if name == "embed" else 1)
+            for name in ("extract", "build", "embed", "upsert")
+        }
+        skipped = [0]
+        embed_done = [0]
+        embed_lock = threading.Lock()
+
+        def guarded(fn):
+            def wrapper():
+                try:
+                    fn()
+                except Exception as e:
+                    self.logger.error(f"{entity_name} pipeline stage failed: {e}")
+                    errors.append(e)
+                    stop.set()
+            return wrapper
+
+        def extract():
+            it = iter(stream_func())
+            while True:
+                t0 = time.perf_counter()
+                chunk = next(it, None)
+                if chunk is None:
+                    break
+                stats["extract"].record(self._num_rows(chunk), time.perf_counter() - t0)
+                if not self._put(raw_q, chunk, stop):
+                    return
+            self._put(raw_q, _DONE, stop)
+
+        def build():
+            while True:
+                chunk = self._get(raw_q, stop)
+                if chunk is _DONE:
+                    break
+                t0 = time.perf_counter()
+                docs = self._build_docs(chunk, build_func, entity_type)
+                existing_hashes = self.vector_store.get_existing_hashes(
+                    entity_type, ids=[doc['id'] for doc in docs]
+                )
+                new_docs, source_only = self._split_changed(docs, existing_hashes)
+                self.vector_store.update_source_hashes(source_only)
+                skipped[0] += len(source_only)
+                stats["build"].record(len(docs), time.perf_counter() - t0)
+                if new_docs and not self._put(doc_q, new_docs, stop):
+                    return
+            self._put(doc_q, _DONE, stop)
+
+        def embed():
+            while True:
+                docs = self._get(doc_q, stop)
+                if docs is _DONE:
+                    # pass the end on to the other embed workers
+                    self._put(doc_q, _DONE, stop)
+                    break
+                t0 = time.perf_counter()
+                n = len(docs)
+                docs = self._embed_docs(docs, entity_name)
+                stats["embed"].record(n, time.perf_counter() - t0)
+                if docs and not self._put(emb_q, docs, stop):
+                    return
+            with embed_lock:
+                embed_done[0] += 1
+                last = embed_done[0] == embed_workers
+            if last:
+                self._put(emb_q, _DONE, stop)
+
+        def upsert():
+            while True:
+                docs = self._get(emb_q, stop)
+                if docs is _DONE:
+                    break
+                t0 = time.perf_counter()
+                self.vector_store.upsert_documents(docs)
+                stats["upsert"].record(len(docs), time.perf_counter() - t0)
+
+        def report():
+            while not stop.wait(self.config.pipeline_log_interval):
+                self._log_stream_progress(entity_name, stats, raw_q, doc_q, emb_q)
+
+        workers = [
+            threading.Thread(target=guarded(fn), name=f"{entity_name}-{fn.__name__}", daemon=True)
+            for fn in (extract, build, *[embed] * embed_workers, upsert)
+        ]
+        reporter = threading.Thread(target=report, daemon=True)
+        for w in workers:
+            w.start()
+        reporter.start()
+        for w in workers:
+            w.join()
+        stop.set()
+        reporter.join()
+
+        if errors:
+            raise errors[0]
+
+        self._log_stream_progress(entity_name, stats, raw_q, doc_q, emb_q)
+        if skipped[0]:
+            self.logger.info(f"Skipped {skipped[0]} unchanged {entity_name} docs")
+        return stats["upsert"].items
+
+    def _log_stream_progress(self, entity_name: str, stats: Dict[str, StageStats], *queues: queue.Queue):
+        rates = ", ".join(f"{s.name} {s.items} ({s.rate():.0f}/s)" for s in stats.values())
+        depths = "/".join(str(q.qsize()) for q in queues)
+        line = f"[{entity_name}] {rates} | queue depths raw/docs/embedded {depths}"
+        if self.embedding_service.local is None:
+            line += f" | {self.embedding_service.stats_line()}"
+        self.logger.info(line)
+        if self.config.metrics_file:
+            write_to_textfile(self.config.metrics_file, REGISTRY)
+
+    def _process(self, entity_name: str, entity_type: str, extract_func: callable,
+                 stream_func: callable, build_func: callable) -> int:
+        # incremental runs only pull source rows whose hash changed since the last run
+        changed_only = self.config.incremental
+        columns = self.config.build_mode == "batch"
+        if self.config.pipeline_mode == "streaming":
+            # order doesn't matter for embedding, so skip the sort on the server
+            return self.process_entity_type_streaming(
+                entity_name, entity_type,
+                lambda: stream_func(ordered=False, changed_only=changed_only, columns=columns), build_func
+            )
+        return self.process_entity_type(
+            entity_name, entity_type,
+            lambda: extract_func(changed_only=changed_only, columns=columns), build_func
+        )
+
     def run(self):
         self.logger.info("Starting NBA Embedding Pipeling")
 
         self.logger.info("Init vector db...")
-        self.db_manager.initialize_vector_tables()
+        self.db_manager.initialize_vector_tables(full_load=not self.config.incremental)
 
         stats = {}
 
-        stats['teams'] = self.process_entity_type(
-            'teams',
+        stats['teams'] = self._process(
+            'teams', 'team',
             self.extractor.extract_teams,
+            self.extractor.stream_teams,
             self.builder.build_team_document
         )
 
-        stats['players'] = self.process_entity_type(
-            'players',
+        stats['players'] = self._process(
+            'players', 'player',
             self.extractor.extract_players,
+            self.extractor.stream_players,
             self.builder.build_player_document
         )
 
-        stats['games'] = self.process_entity_type(
-            'games',
+        stats['games'] = self._process(
+            'games', 'game',
             self.extractor.extract_games,
+            self.extractor.stream_games,
             self.builder.build_game_document
         )
 
-        stats['boxscores'] = self.process_entity_type(
-            'boxscores',
+        stats['boxscores'] = self._process(
+            'boxscores', 'boxscore',
             self.extractor.extract_boxscores,
+            self.extractor.stream_boxscores,
             self.builder.build_boxscore_document
         )
 
+        if self.config.index_mode == "deferred":
+            self.logger.info("Building vector indexes...")
+            self.db_manager.build_vector_indexes()
+
         self.logger.info("Pipeline completed successfully")
 
         for entity, count in stats.items():
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backend.embeding.config import Config
+
+
+class EmbeddingCache:
+    """Content-addressed on-disk embedding cache.
+
+    Vectors are keyed by (embed model, sha256 of the text) and stored as
+    float32 blobs in a sqlite file. Least recently used entries are evicted
+    once the file holds more than ``max_bytes`` of vectors.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        # shared by the pipeline's embed thread, guarded by self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self.conn.commit()
+        # running size of the stored vectors, summed once here. puts add every row they write, so
+        # a replaced row counts twice: it can only run high, and _evict recounts before evicting
+        self.size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        # returns {text_hash: vector} for the cached subset of texts
+        text_hashes = [self.text_hash(t) for t in texts]
+        hashes = list(set(text_hashes))
+        found = {}
+        with self.lock:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *chunk]
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                self.conn.commit()
+            hit = sum(1 for h in text_hashes if h in found)
+            self.hits += hit
+            self.misses += len(text_hashes) - hit
+        return found
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = [
+            (model, self.text_hash(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+            self.size += sum(len(r[2]) for r in rows)
+            self._evict()
+
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        # the running size may be high, only the real one decides
+        total = self.size = self._total_size()
+        if total <= self.max_bytes:
+            return
+        # drop oldest entries down to 90% of the budget so we don't evict on every put
+        target = total - int(self.max_bytes * 0.9)
+        removed, freed = 0, 0
+        for model, h, size in self.conn.execute(
+            "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_access"
+        ).fetchall():
+            if freed >= target:
+                break
+            self.conn.execute("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", (model, h))
+            removed += 1
+            freed += size
+        self.conn.commit()
+        self.size -= freed
+        self.logger.info(f"Evicted {removed} cached embeddings ({freed / 1e6:.1f} MB)")
+
+    def export_file(self, path: str, model: Optional[str] = None) -> int:
+        # portable .npz snapshot: models, text hashes and a float32 matrix
+        query = "SELECT model, text_hash, vector FROM embeddings"
+        params = []
+        if model:
+            query += " WHERE model = ?"
+            params.append(model)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        models = np.array([r[0] for r in rows])
+        hashes = np.array([r[1] for r in rows])
+        vectors = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]) if rows else np.zeros((0, 0), np.float32)
+        np.savez_compressed(path, models=models, hashes=hashes, vectors=vectors)
+        return len(rows)
+
+    def import_file(self, path: str) -> int:
+        data = np.load(path)
+        now = time.time()
+        rows = [
+            (str(m), str(h), np.ascontiguousarray(v, dtype=np.float32).tobytes(), now)
+            for m, h, v in zip(data["models"], data["hashes"], data["vectors"])
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+            self.size += sum(len(r[2]) for r in rows)
+            self._evict()
+        return len(rows)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            count, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        return {"entries": count, "mb": size / 1e6, "hits": self.hits, "misses": self.misses}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the on-disk embedding cache")
+    parser.add_argument("action", choices=["export", "import", "stats"])
+    parser.add_argument("file", nargs="?")
+    parser.add_argument("--model", default=None, help="only export this embed model")
+    args = parser.parse_args()
+
+    config = Config()
+    cache = EmbeddingCache(config.embed_cache_path, config.embed_cache_max_mb * 1024 * 1024)
+    if args.action == "export":
+        print(f"Exported {cache.export_file(args.file, args.model)} embeddings to {args.file}")
+    elif args.action == "import":
+        print(f"Imported {cache.import_file(args.file)} embeddings from {args.file}")
+    else:
+        print(cache.stats())
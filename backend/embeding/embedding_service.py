@@ -1,79 +1,230 @@
 import requests
 import time
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import logging
 
+from backend.embeding.concurrency import AdaptiveLimiter, RetryBudget, retry_after_secs
 from backend.embeding.config import Config
+from backend.embeding.embedding_cache import EmbeddingCache
+
+
+class EmbeddingError(ValueError):
+    # some texts of an embed_batch call failed, embeddings has None for them and the vectors of the rest
+    def __init__(self, embeddings: List[Optional[List[float]]]):
+        self.embeddings = embeddings
+        self.failed = [i for i, e in enumerate(embeddings) if e is None]
+        super().__init__(f"Failed to generate embeddings for indicies: {self.failed}")
+
 
 class EmbeddingService:
     def __init__(self, config: Config):
         self.config = config
         self.logger = logging.getLogger(__name__)
 
-        # start sess w conn pooling
+        # start sess w conn pooling. no urllib3 retries, every retry goes through self.retries
         self.session = requests.Session()
-        retry_strat = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
         adapter = HTTPAdapter(
-            max_retries=retry_strat,
+            max_retries=0,
             pool_connections=10,
-            pool_maxsize=10
+            pool_maxsize=config.embed_max_concurrency
         )
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
 
-    
-    def _embed_single(self, text: str) -> Optional[List[float]]:
+        # requests in flight follow what ollama keeps up with, see concurrency.py
+        self.limiter = AdaptiveLimiter(
+            config.embed_concurrency, config.embed_min_concurrency, config.embed_max_concurrency,
+            latency_target=config.embed_latency_target_ms / 1000,
+        )
+        self.retries = RetryBudget(
+            ratio=config.retry_budget_ratio, min_retries=config.retry_budget_min,
+            max_retries=config.max_retries, base_delay=config.retry_delay,
+        )
+        # shared by every embed_batch call, the limiter decides how many of its threads send at once
+        self.executor = ThreadPoolExecutor(max_workers=config.embed_max_concurrency)
+
+        self.local = None
+        if config.embed_backend == "local":
+            from backend.embeding.local_embedder import LocalEmbedder
+            self.local = LocalEmbedder(config)
+
+        self.cache = None
+        if config.embed_cache_path:
+            self.cache = EmbeddingCache(config.embed_cache_path, config.embed_cache_max_mb * 1024 * 1024)
+
+    @property
+    def cache_model(self) -> str:
+        # vectors are cached per model and endpoint: /api/embed (native) returns them l2 normalized,
+        # /api/embeddings (single) doesn't, local ones are kept under their own name.
+        # read from config on every call so a changed embed_model can't reuse the old key
+        if self.local:
+            return self.local.cache_model
+        if self.config.embed_mode == "native":
+            return self.config.embed_model
+        return f"{self.config.embed_model}:single"
+
+    def _post(self, url: str, payload: dict, inputs: int) -> dict:
+        # one request with a limiter slot per attempt, retried with backoff while the budget allows
+        self.retries.record_request()
+        attempt = 0
+        while True:
+            start = self.limiter.acquire()
+            outcome, retry_after = "ok", None
+            try:
+                res = self.session.post(url, json=payload, timeout=30 + 2 * inputs)
+                if res.status_code in (429, 503):
+                    # ollama's queue is full (OLLAMA_MAX_QUEUE) or it is loading the model
+                    outcome, retry_after = "throttled", retry_after_secs(res.headers)
+                res.raise_for_status()
+                return res.json()
+            except requests.Timeout as e:
+                outcome, error = "timeout", e
+            except requests.RequestException as e:
+                outcome = "error" if outcome == "ok" else outcome
+                error = e
+            finally:
+                self.limiter.release(start, inputs, outcome)
+
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            if status is not None and 400 <= status < 500 and status != 429:
+                raise error  # the request itself is bad, sending it again won't help
+            if not self.retries.try_retry(attempt):
+                raise error
+            delay = self.retries.backoff(attempt, retry_after)
+            self.logger.warning(f"Embedding request failed ({outcome}: {error}), retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _embed_single(self, text: str) -> List[float]:
         # gen embedding for single text
+        embedding = self._post(
+            self.config.embedding_endpoint,
+            {"model": self.config.embed_model, "prompt": text},
+            inputs=1
+        ).get("embedding")
+        if not embedding or len(embedding) != self.config.embed_dim:
+            raise ValueError(f"Embedding has {len(embedding or [])} dims, expected {self.config.embed_dim}")
+        return embedding
+
+    def _embed_many(self, texts: List[str]) -> List[List[float]]:
+        # one /api/embed request for many inputs
+        embeddings = self._post(
+            self.config.batch_embedding_endpoint,
+            {"model": self.config.embed_model, "input": texts},
+            inputs=len(texts)
+        ).get("embeddings") or []
+
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Batch embed returned {len(embeddings)} vectors for {len(texts)} inputs")
+        if any(not e or len(e) != self.config.embed_dim for e in embeddings):
+            raise ValueError(f"Batch embed returned vectors without {self.config.embed_dim} dims")
+        return embeddings
+
+    def stats(self) -> dict:
+        # current concurrency / throughput for progress logs (also exported as prometheus gauges)
+        return {**self.limiter.stats(), "retries": self.retries.total_retries,
+                "retries_denied": self.retries.denied}
+
+    def stats_line(self) -> str:
+        s = self.stats()
+        return (f"ollama {s['in_flight']} in flight (limit {s['limit']:.1f}), {s['inputs_per_sec']:.0f} texts/s, "
+                f"{s['ms_per_input']:.1f}ms/text, {s['retries']} retries")
 
+    def _sub_batches(self, texts: List[str]) -> List[List[int]]:
+        # group input indices so each request stays under the char / input budget
+        batches, cur, cur_chars = [], [], 0
+        for idx, text in enumerate(texts):
+            n = len(text)
+            if cur and (cur_chars + n > self.config.max_batch_chars
+                        or len(cur) >= self.config.max_batch_inputs):
+                batches.append(cur)
+                cur, cur_chars = [], 0
+            cur.append(idx)
+            cur_chars += n
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        # only texts never embedded with this model get embedded, each distinct text once
+        model = self.cache_model
+        cached = self.cache.get_many(model, texts)
+        hashes = [self.cache.text_hash(t) for t in texts]
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        if missing:
+            miss_texts = list(missing.values())
+            try:
+                miss_embeds = self._embed_uncached(miss_texts)
+            except EmbeddingError as e:
+                # cache what did embed, the failures are raised below for the caller's indices
+                miss_embeds = e.embeddings
+            done = [(h, t, v) for (h, t), v in zip(missing.items(), miss_embeds) if v is not None]
+            self.cache.put_many(model, [t for _, t, _ in done], [v for _, _, v in done])
+            cached.update((h, v) for h, _, v in done)
+
+        embeddings = [cached.get(h) for h in hashes]
+        if any(e is None for e in embeddings):
+            raise EmbeddingError(embeddings)
+        return embeddings
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        if self.local is not None:
+            return self.local.embed(texts)
+        if self.config.embed_mode == "native":
+            return self._embed_batch_native(texts)
+        return self._embed_batch_single(texts)
+
+    def _embed_or_split(self, texts: List[str]) -> List[Optional[List[float]]]:
+        # a request that still fails after its retries is split in halves and sent again, so a
+        # bad text only fails itself. the halves go through _post / the retry budget like any
+        # request, None for a text that fails on its own
         try:
-            res = self.session.post(
-                self.config.embedding_endpoint,
-                json={
-                    "model": self.config.embed_model,
-                    "prompt": text
-                },
-                timeout=30
-            )
-            res.raise_for_status()
-            return res.json()["embedding"]
+            return self._embed_many(texts)
         except Exception as e:
-            self.logger.error(f"Embedding Failed: {e}")
-            print(f"Embedding failed: {e}")
-            return None
-    
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+            if len(texts) == 1:
+                self.logger.error(f"Embedding failed: {e}")
+                return [None]
+            self.logger.warning(f"Embedding {len(texts)} inputs failed ({e}), splitting the request")
+            mid = len(texts) // 2
+            return self._embed_or_split(texts[:mid]) + self._embed_or_split(texts[mid:])
+
+    def _embed_batch_native(self, texts: List[str]) -> List[List[float]]:
         embeddings = [None] * len(texts)
+        batches = self._sub_batches(texts)
+
+        futures = [
+            (self.executor.submit(self._embed_or_split, [texts[i] for i in batch]), batch)
+            for batch in batches
+        ]
+        for future, batch in futures:
+            for idx, embedding in zip(batch, future.result()):
+                embeddings[idx] = embedding
 
-        with ThreadPoolExecutor(max_workers=self.config.max_workers) as executor:
-            future_to_idx = {
-                executor.submit(self._embed_single, text): idx 
-                for idx, text in enumerate(texts)
-            }
-            
-            for future in as_completed(future_to_idx):
-                idx = future_to_idx[future]
-                try:
-                    embedding = future.result()
-                    if embedding and len(embedding) == self.config.embed_dim:
-                        embeddings[idx] = embedding
-                    else:
-                        # retry again
-                        self.logger.warning(f"Retrying embedding {idx}")
-                        embeddings[idx] = self._embed_single(texts[idx])
-                except Exception as e:
-                    self.logger.error(f"Failed to embed text {idx}: {e}")
-                    raise
-        
         if any(e is None for e in embeddings):
-            failed = [i for i, e in enumerate(embeddings) if e is None]
-            raise ValueError(f"Failed to generate embeddings for indicies: {failed}")
+            raise EmbeddingError(embeddings)
 
+        return embeddings
+
+    def _embed_batch_single(self, texts: List[str]) -> List[List[float]]:
+        futures = [self.executor.submit(self._embed_single, text) for text in texts]
+        embeddings = []
+        for idx, future in enumerate(futures):
+            try:
+                embeddings.append(future.result())
+            except Exception as e:
+                self.logger.error(f"Failed to embed text {idx}: {e}")
+                embeddings.append(None)
+
+        if any(e is None for e in embeddings):
+            raise EmbeddingError(embeddings)
 
         return embeddings
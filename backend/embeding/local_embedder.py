@@ -0,0 +1,90 @@
+import logging
+import time
+from typing import List
+
+from backend.embeding.config import Config
+
+# nomic-embed-text in process on cpu with torch / transformers (EMBED_BACKEND=local), so bulk
+# pipeline runs don't go through ollama. same recipe as ollama's /api/embed: the raw text,
+# no "search_document:" prefix, mean pooled over the real tokens, l2 normalized.
+# check it against ollama (or the stored vectors) with
+#   python -m backend.embeding.bench_local_embed
+
+
+class LocalEmbedder:
+    """Batched cpu inference for an embedding model from the huggingface hub / a local dir.
+
+    Inputs are tokenized once, sorted by token count and cut into batches under
+    ``local_embed_batch_size`` inputs / ``local_embed_batch_tokens`` padded tokens,
+    so each batch is only padded to its own longest input.
+    """
+
+    def __init__(self, config: Config):
+        # torch / transformers are only needed for this backend
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self.torch = torch
+
+        if config.local_embed_threads > 0:
+            # intra-op threads, leave cores for the pipeline's other stages / postgres
+            torch.set_num_threads(config.local_embed_threads)
+
+        start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(config.local_embed_model)
+        # nomic-bert ships its modelling code with the weights
+        self.model = AutoModel.from_pretrained(config.local_embed_model, trust_remote_code=True)
+        self.model.eval()
+        if config.local_embed_quantize:
+            # int8 weights for the Linear layers, activations quantized on the fly
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.logger.info(
+            f"Loaded {config.local_embed_model} in {time.perf_counter() - start:.1f}s "
+            f"({torch.get_num_threads()} threads, {'int8' if config.local_embed_quantize else 'fp32'})"
+        )
+
+    @property
+    def cache_model(self) -> str:
+        # never ollama's key: LOCAL_EMBED_MODEL can be any model, and even nomic's weights
+        # are only a stand-in for ollama's vectors once bench_local_embed passes
+        model = f"local:{self.config.local_embed_model}"
+        return f"{model}:int8" if self.config.local_embed_quantize else model
+
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        # input indices, shortest first, grouped so padded batch size stays under the budgets
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batches, cur = [], []
+        for idx in order:
+            # sorted ascending, so this input is the longest in the batch so far
+            if cur and (len(cur) >= self.config.local_embed_batch_size
+                        or (len(cur) + 1) * lengths[idx] > self.config.local_embed_batch_tokens):
+                batches.append(cur)
+                cur = []
+            cur.append(idx)
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        torch = self.torch
+        encoded = self.tokenizer(
+            texts, truncation=True, max_length=self.config.local_embed_max_tokens,
+            padding=False, return_attention_mask=False,
+        )["input_ids"]
+        out = [None] * len(texts)
+
+        with torch.inference_mode():
+            for batch in self._batches([len(ids) for ids in encoded]):
+                inputs = self.tokenizer.pad(
+                    {"input_ids": [encoded[i] for i in batch]}, padding=True, return_tensors="pt"
+                )
+                hidden = self.model(**inputs).last_hidden_state
+                # mean over the real tokens, padding masked out
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+                for idx, vec in zip(batch, pooled.float().tolist()):
+                    out[idx] = vec
+        return out
@@ -1,15 +1,128 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import logging 
+import io
+import struct
+from datetime import date
 from sqlalchemy import text
+from pgvector import Vector
 from backend.embeding.db_manager import DatabaseManager
 import json
 
+# staged columns, in COPY order, with the binary encoder for each
+_STAGE_COLUMNS = [
+    ("id", "text"), ("entity_type", "text"), ("entity_id", "text"),
+    ("game_id", "int8"), ("team_id", "int8"), ("player_id", "int8"),
+    ("chunk_type", "text"), ("content_json", "jsonb"), ("content_text", "text"),
+    ("embedding", "vector"), ("content_hash", "text"), ("source_hash", "text"),
+    ("season", "int4"), ("game_date", "date"),
+]
+_PG_EPOCH = date(2000, 1, 1).toordinal()
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+
+
+def _encode_field(kind: str, value) -> bytes:
+    # one field in postgres binary COPY format: int32 length + payload, -1 for NULL
+    if value is None:
+        return struct.pack("!i", -1)
+    if kind == "text":
+        payload = str(value).encode()
+    elif kind == "int8":
+        payload = struct.pack("!q", int(value))
+    elif kind == "int4":
+        payload = struct.pack("!i", int(value))
+    elif kind == "jsonb":
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        payload = b"\x01" + value.encode()  # jsonb binary format version 1
+    elif kind == "date":
+        if isinstance(value, str):
+            value = date.fromisoformat(value)
+        payload = struct.pack("!i", value.toordinal() - _PG_EPOCH)
+    elif kind == "vector":
+        payload = Vector(value).to_binary()
+    else:
+        raise ValueError(f"No binary encoder for {kind}")
+    return struct.pack("!i", len(payload)) + payload
+
+
+def encode_copy_binary(documents: List[Dict[str, Any]]) -> io.BytesIO:
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    field_count = struct.pack("!h", len(_STAGE_COLUMNS))
+    for doc in documents:
+        buf.write(field_count)
+        for col, kind in _STAGE_COLUMNS:
+            buf.write(_encode_field(kind, doc.get(col)))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+BUMP_VERSION_SQL = """
+UPDATE nba_embeddings_version SET version = version + 1, updated_at = NOW() WHERE id = 1
+"""
+
+
 class VectorStore:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
         self.logger = logging.getLogger(__name__)
 
     def upsert_documents(self, documents: List[Dict[str, Any]]):
+        if self.db.config.upsert_mode == "copy":
+            return self.upsert_documents_copy(documents)
+        return self.upsert_documents_insert(documents)
+
+    def upsert_documents_copy(self, documents: List[Dict[str, Any]]):
+        """Binary COPY into a temp staging table, then one set-based merge.
+
+        Commits every ``config.upsert_batch_size`` documents.
+        """
+        if not documents:
+            return
+
+        cols = ", ".join(col for col, _ in _STAGE_COLUMNS)
+        merge_sql = f"""
+        INSERT INTO nba_embeddings ({cols})
+        SELECT {cols} FROM nba_embeddings_stage
+        ON CONFLICT (id) DO UPDATE SET
+            content_json = EXCLUDED.content_json,
+            content_text = EXCLUDED.content_text,
+            embedding = EXCLUDED.embedding,
+            content_hash = EXCLUDED.content_hash,
+            source_hash = EXCLUDED.source_hash,
+            updated_at = NOW()
+        WHERE nba_embeddings.content_hash != EXCLUDED.content_hash
+           OR nba_embeddings.source_hash IS DISTINCT FROM EXCLUDED.source_hash
+        """
+        batch_size = self.db.config.upsert_batch_size
+
+        raw = self.db.get_engine().raw_connection()
+        try:
+            with raw.cursor() as cur:
+                cur.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS nba_embeddings_stage "
+                    "(LIKE nba_embeddings INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                for i in range(0, len(documents), batch_size):
+                    batch = documents[i:i + batch_size]
+                    cur.copy_expert(
+                        f"COPY nba_embeddings_stage ({cols}) FROM STDIN WITH (FORMAT binary)",
+                        encode_copy_binary(batch)
+                    )
+                    cur.execute(merge_sql)
+                    cur.execute(BUMP_VERSION_SQL)
+                    raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+        self.logger.info(f"Upserted {len(documents)} documents (copy)")
+
+    def upsert_documents_insert(self, documents: List[Dict[str, Any]]):
         # bulk upsert docs w embeds
 
         if not documents:
@@ -21,47 +134,76 @@ class VectorStore:
             id, entity_type, entity_id,
             game_id, team_id, player_id,
             chunk_type, content_json, content_text,
-            embeddine, content_hash,
+            embedding, content_hash, source_hash,
             season, game_date
         ) VALUES (
             :id, :entity_type, :entity_id,
             :game_id, :team_id, :player_id,
             :chunk_type, :content_json, :content_text,
+            CAST(:embedding AS vector), :content_hash, :source_hash,
             :season, :game_date
         )
         ON CONFLICT (id) DO UPDATE SET
             content_json = EXCLUDED.content_json,
             content_text = EXCLUDED.content_text,
-            embedding = EXCULUDED.embedding,
+            embedding = EXCLUDED.embedding,
             content_hash = EXCLUDED.content_hash,
+            source_hash = EXCLUDED.source_hash,
             updated_at = NOW()
-        WHERE nba_embedding.content_hash != EXCLUDED.content_hash
+        WHERE nba_embeddings.content_hash != EXCLUDED.content_hash
+           OR nba_embeddings.source_hash IS DISTINCT FROM EXCLUDED.source_hash
         """
 
         with self.db.get_connection() as conn:
             # convert emb to psql arr
 
             for doc in documents:
+                doc.setdefault('source_hash', None)
                 if 'embedding' in doc:
                     embedding_array = doc['embedding']
                     doc['embedding'] = embedding_array
                     doc['content_json'] = json.dumps(doc['content_json'])
 
             conn.execute(text(upsert_sql), documents)
+            conn.execute(text(BUMP_VERSION_SQL))
             conn.commit()
 
         self.logger.info(f"Upserted {len(documents)} documents")
 
 
 
-    def get_existing_hashes(self) -> Dict[str, str]:
-        # get existing doc hashes for dedup
+    def update_source_hashes(self, documents: List[Dict[str, Any]]):
+        # record new source hashes for docs whose content (and so embedding) didn't change
 
-        query = """
-            SELECT id, content_hash FROM nba_embeddings
-        """
+        rows = [
+            {"id": doc['id'], "source_hash": doc['source_hash']}
+            for doc in documents if doc.get('source_hash')
+        ]
+        if not rows:
+            return
 
         with self.db.get_connection() as conn:
-            res = conn.execute(text(query))
+            conn.execute(
+                text("UPDATE nba_embeddings SET source_hash = :source_hash WHERE id = :id"),
+                rows
+            )
+            conn.commit()
+
+    def get_existing_hashes(self, entity_type: Optional[str] = None,
+                            ids: Optional[List[str]] = None) -> Dict[str, str]:
+        # get existing doc hashes for dedup, scoped to one entity type and/or a set of ids
+
+        query = "SELECT id, content_hash FROM nba_embeddings WHERE TRUE"
+        params = {}
+        if entity_type is not None:
+            query += " AND entity_type = :entity_type"
+            params["entity_type"] = entity_type
+        if ids is not None:
+            if not ids:
+                return {}
+            query += " AND id = ANY(:ids)"
+            params["ids"] = list(ids)
+
+        with self.db.get_connection() as conn:
+            res = conn.execute(text(query), params)
             return {row[0]: row[1] for row in res}
-        
@@ -0,0 +1,209 @@
+import unicodedata
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+# team / player mentions in a question -> ids. every alias (team name, "city name",
+# unambiguous city, abbreviation, full player name and its variants, unique last name)
+# goes into one aho-corasick automaton over accent-folded text, so a question is
+# scanned once instead of one regex per alias. loaded at startup from the teams and
+# players tables, ingest.py bumps nba_ingest_version when it reloads them
+
+# name suffixes dropped for the "Jaren Jackson" alias of "Jaren Jackson Jr."
+_SUFFIXES = {"jr", "jr.", "sr", "sr.", "ii", "iii", "iv"}
+
+# alias checks against the original (unfolded) question text
+ANY_CASE, UPPER, CAPITALIZED = 0, 1, 2
+
+
+def fold(s: str) -> str:
+    # accent-fold + casefold, "Dončić" -> "doncic"
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(c for c in s if not unicodedata.combining(c)).casefold()
+
+
+def fold_with_positions(s: str) -> Tuple[str, Optional[List[int]]]:
+    # folded text plus, for each folded char, its index in s (None when they line up)
+    if s.isascii():
+        return s.lower(), None
+    out, pos = [], []
+    for i, c in enumerate(s):
+        f = fold(c)
+        out.append(f)
+        pos.extend([i] * len(f))
+    return "".join(out), pos
+
+
+def _is_word(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class Mention(NamedTuple):
+    start: int      # span in the original question
+    end: int
+    kind: str       # "team" or "player"
+    id: int
+    alias: str
+
+
+class AliasAutomaton:
+    """Aho-Corasick automaton mapping folded aliases to (kind, id, case check) values."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # per state: (alias, value) of every alias ending there, suffix matches included
+        self.out: List[List[Tuple[str, tuple]]] = [[]]
+        self.aliases: Dict[str, Set[tuple]] = {}
+
+    def add(self, alias: str, value: tuple):
+        if not alias:
+            return
+        self.aliases.setdefault(alias, set()).add(value)
+
+    def build(self) -> "AliasAutomaton":
+        for alias, values in self.aliases.items():
+            state = 0
+            for c in alias:
+                nxt = self.goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][c] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].extend((alias, v) for v in sorted(values))
+        # breadth first so a state's fail link is final before its children's
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, child in self.goto[state].items():
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                nxt = self.goto[f].get(c, 0)
+                self.fail[child] = nxt if nxt != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+                queue.append(child)
+        return self
+
+    def scan(self, folded: str) -> Iterator[Tuple[int, int, str, tuple]]:
+        # (start, end, alias, value) of every alias occurrence, word boundaries not checked
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for alias, value in out[state]:
+                yield i + 1 - len(alias), i + 1, alias, value
+
+    def __len__(self):
+        return len(self.aliases)
+
+
+def name_variants(name: str) -> Set[str]:
+    # "Shai Gilgeous-Alexander" -> also "shai gilgeous alexander", "De'Aaron Fox" -> "deaaron fox"
+    base = fold(name)
+    out = {base, base.replace("-", " "), base.replace("'", "").replace("’", "")}
+    words = base.split()
+    if len(words) > 2 and words[-1] in _SUFFIXES:
+        out.add(" ".join(words[:-1]))
+    return {" ".join(v.split()) for v in out}
+
+
+def ingest_version(cx) -> Optional[int]:
+    # None until ingest.py has run with version tracking
+    if cx.execute(text("SELECT to_regclass('nba_ingest_version')")).scalar() is None:
+        return None
+    return cx.execute(text("SELECT version FROM nba_ingest_version WHERE id = 1")).scalar()
+
+
+class EntityLookup:
+    """Team / player name matching used to turn mentions into ids."""
+
+    def __init__(self, teams: List[dict], players: List[dict], version: Optional[int] = None):
+        self.version = version
+        self.team_aliases: Dict[str, int] = {}
+        self.team_abbrs: Dict[str, int] = {}
+        self.player_names: Dict[str, int] = {}
+        self.automaton = AliasAutomaton()
+
+        cities = {}
+        for t in teams:
+            cities.setdefault(fold(t["city"]), []).append(t["team_id"])
+            self.team_aliases[fold(t["name"])] = t["team_id"]
+            self.team_aliases[fold(f"{t['city']} {t['name']}")] = t["team_id"]
+            self.team_abbrs[t["abbreviation"].upper()] = t["team_id"]
+        for city, ids in cities.items():
+            # only unambiguous cities count, and not "LA" which reads as either LA team
+            if len(ids) == 1 and len(city) > 2:
+                self.team_aliases[city] = ids[0]
+        for alias, team_id in self.team_aliases.items():
+            self.automaton.add(alias, ("team", team_id, ANY_CASE))
+        # abbreviations only as upper-case words so "sac" in a sentence doesn't match
+        for abbr, team_id in self.team_abbrs.items():
+            self.automaton.add(fold(abbr), ("team", team_id, UPPER))
+
+        last_names: Dict[str, Set[int]] = {}
+        for p in players:
+            full = f"{p['first_name']} {p['last_name']}"
+            self.player_names[fold(full)] = p["player_id"]
+            for alias in name_variants(full):
+                self.automaton.add(alias, ("player", p["player_id"], ANY_CASE))
+            for alias in name_variants(p["last_name"]):
+                last_names.setdefault(alias, set()).add(p["player_id"])
+        # "Wembanyama", "Dončić": a capitalized last name only one player has, and
+        # that isn't also a team alias ("Holiday" is two players, so neither)
+        for alias, ids in last_names.items():
+            if len(ids) == 1 and len(alias) > 3 and alias not in self.automaton.aliases:
+                self.automaton.add(alias, ("player", next(iter(ids)), CAPITALIZED))
+        self.automaton.build()
+
+    @classmethod
+    def load(cls, cx) -> "EntityLookup":
+        teams = cx.execute(text("SELECT team_id, city, name, abbreviation FROM teams")).mappings().all()
+        players = cx.execute(text("SELECT player_id, first_name, last_name FROM players")).mappings().all()
+        return cls(teams, players, ingest_version(cx))
+
+    def mentions(self, question: str) -> List[Mention]:
+        """Team / player mentions in question order, longest alias wins where they overlap."""
+        folded, pos = fold_with_positions(question)
+        found = []
+        for start, end, alias, (kind, entity_id, case) in self.automaton.scan(folded):
+            if start > 0 and _is_word(folded[start - 1]):
+                continue
+            if end < len(folded) and _is_word(folded[end]) and _is_word(folded[end - 1]):
+                continue
+            # back to the question's own span for the case checks and the caller
+            s, e = (start, end) if pos is None else (pos[start], pos[end - 1] + 1)
+            if case == UPPER and not question[s:e].isupper():
+                continue
+            if case == CAPITALIZED and not question[s].isupper():
+                continue
+            found.append(Mention(s, e, kind, entity_id, alias))
+        found.sort(key=lambda m: (m.start, -m.end))
+        out, last_end = [], -1
+        for m in found:
+            if m.start >= last_end:
+                out.append(m)
+                last_end = m.end
+            elif out and (m.start, m.end) == (out[-1].start, out[-1].end):
+                # same span, several ids (two players sharing a name)
+                out.append(m)
+        return out
+
+    def resolve(self, question: str) -> Tuple[List[int], List[int]]:
+        # (team ids, player ids) in mention order, one pass over the question
+        teams, players = [], []
+        for m in self.mentions(question):
+            ids = teams if m.kind == "team" else players
+            if m.id not in ids:
+                ids.append(m.id)
+        return teams, players
+
+    def match_teams(self, question: str) -> List[int]:
+        return self.resolve(question)[0]
+
+    def match_players(self, question: str) -> List[int]:
+        return self.resolve(question)[1]
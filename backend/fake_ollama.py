@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# stand-in for the ollama API so benchmarks / the pipeline can run offline.
+# imports nothing from backend so OLLAMA_HOST can still be pointed at it afterwards:
+#   python -m backend.fake_ollama --port 11435 --embed-ms 20 --prompt-ms 300 --token-ms 25
+#   OLLAMA_HOST=http://localhost:11435 python -m backend.bench_retrieval
+
+STUB_DIM = 768
+STUB_MODEL = "stub-bow"
+_TOKEN = re.compile(r"[a-z0-9]+")
+_WORDS = "Based on the context , the answer is in game_details and player_box_scores .".split()
+
+
+@dataclass
+class FakeSettings:
+    # all delays in milliseconds, each scaled by a random +-jitter fraction
+    embed_ms: float = 0.0       # per embed request
+    embed_item_ms: float = 0.0  # extra per input of an /api/embed batch
+    prompt_ms: float = 0.0      # prompt processing, before the first token
+    prompt_token_ms: float = 0.0  # extra prompt processing per prompt token (len / 4)
+    token_ms: float = 0.0       # between generated tokens
+    tokens: int = 32            # tokens per answer
+    parallel: int = 0           # generate requests served at once (OLLAMA_NUM_PARALLEL), 0 = unlimited
+    embed_parallel: int = 0     # embed requests served at once, 0 = unlimited
+    max_queue: int = 0          # embed requests waiting beyond which it answers 503 (OLLAMA_MAX_QUEUE), 0 = unlimited
+    jitter: float = 0.0
+
+
+settings = FakeSettings()
+_generate_slots: Optional[asyncio.Semaphore] = None
+_embed_slots: Optional[asyncio.Semaphore] = None
+_embed_waiting = 0
+
+
+def stub_embed(text: str, dim: int = STUB_DIM) -> List[float]:
+    """Deterministic hashed bag-of-words embedding (unigrams + bigrams), unit length.
+
+    Texts sharing words get similar vectors, so retrieval over it is meaningful
+    without a model.
+    """
+    folded = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    tokens = _TOKEN.findall(folded.casefold())
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        h = int.from_bytes(hashlib.blake2b(feat.encode(), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+async def _delay(ms: float):
+    if ms > 0:
+        await asyncio.sleep(ms * (1 + random.uniform(-settings.jitter, settings.jitter)) / 1000)
+
+
+def _slots() -> asyncio.Semaphore:
+    # created lazily so it binds to the server's event loop
+    global _generate_slots
+    if _generate_slots is None:
+        _generate_slots = asyncio.Semaphore(settings.parallel or 1_000_000)
+    return _generate_slots
+
+
+async def _embed_delay(ms: float) -> bool:
+    # waits for an embed slot, False when the queue is full
+    global _embed_slots, _embed_waiting
+    if settings.max_queue and _embed_waiting >= settings.max_queue:
+        return False
+    if _embed_slots is None:
+        _embed_slots = asyncio.Semaphore(settings.embed_parallel or 1_000_000)
+    _embed_waiting += 1
+    try:
+        await _embed_slots.acquire()
+    finally:
+        _embed_waiting -= 1
+    try:
+        await _delay(ms)
+    finally:
+        _embed_slots.release()
+    return True
+
+
+def _busy() -> JSONResponse:
+    return JSONResponse({"error": "server busy, please try again.  maximum pending requests exceeded"}, status_code=503)
+
+
+app = FastAPI()
+
+
+@app.post("/api/embed")
+async def embed(body: dict):
+    inputs = body.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not await _embed_delay(settings.embed_ms + settings.embed_item_ms * len(inputs)):
+        return _busy()
+    return {"model": body.get("model"), "embeddings": [stub_embed(t) for t in inputs]}
+
+
+@app.post("/api/embeddings")
+async def embeddings(body: dict):
+    if not await _embed_delay(settings.embed_ms):
+        return _busy()
+    return {"embedding": stub_embed(body.get("prompt", ""))}
+
+
+def _prefill_ms(prompt_tokens: int) -> float:
+    return settings.prompt_ms + settings.prompt_token_ms * prompt_tokens
+
+
+async def _tokens(prompt_tokens: int):
+    # waits for a generation slot, then yields tokens at the configured pace
+    async with _slots():
+        await _delay(_prefill_ms(prompt_tokens))
+        for i in range(settings.tokens):
+            if i:
+                await _delay(settings.token_ms)
+            yield _WORDS[i % len(_WORDS)] + " "
+
+
+@app.post("/api/generate")
+async def generate(body: dict):
+    model = body.get("model")
+    prompt_tokens = len(body.get("prompt", "")) // 4
+    done = {"model": model, "response": "", "done": True,
+            "prompt_eval_count": prompt_tokens, "eval_count": settings.tokens,
+            "prompt_eval_duration": int(_prefill_ms(prompt_tokens) * 1e6)}
+    if not body.get("stream", True):
+        parts = [tok async for tok in _tokens(prompt_tokens)]
+        return {**done, "response": "".join(parts)}
+
+    async def lines():
+        async for tok in _tokens(prompt_tokens):
+            yield json.dumps({"model": model, "response": tok, "done": False}) + "\n"
+        yield json.dumps(done) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def run_in_thread(asgi_app, host: str = "127.0.0.1", port: int = 0):
+    # serve an app with uvicorn on a background thread, returns (server, base url)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://{host}:{sock.getsockname()[1]}"
+
+
+def start(host: str = "127.0.0.1", port: int = 0):
+    return run_in_thread(app, host, port)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    # latency knobs, shared with backend/loadtest.py
+    defaults = FakeSettings()
+    parser.add_argument("--embed-ms", type=float, default=defaults.embed_ms)
+    parser.add_argument("--embed-item-ms", type=float, default=defaults.embed_item_ms)
+    parser.add_argument("--prompt-ms", type=float, default=defaults.prompt_ms)
+    parser.add_argument("--prompt-token-ms", type=float, default=defaults.prompt_token_ms)
+    parser.add_argument("--token-ms", type=float, default=defaults.token_ms)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens)
+    parser.add_argument("--parallel", type=int, default=defaults.parallel)
+    parser.add_argument("--embed-parallel", type=int, default=defaults.embed_parallel)
+    parser.add_argument("--max-queue", type=int, default=defaults.max_queue)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+
+
+def configure(args: argparse.Namespace):
+    global settings, _generate_slots, _embed_slots
+    settings = FakeSettings(
+        embed_ms=args.embed_ms, embed_item_ms=args.embed_item_ms, prompt_ms=args.prompt_ms,
+        prompt_token_ms=args.prompt_token_ms,
+        token_ms=args.token_ms, tokens=args.tokens, parallel=args.parallel,
+        embed_parallel=args.embed_parallel, max_queue=args.max_queue, jitter=args.jitter,
+    )
+    _generate_slots = _embed_slots = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake ollama server with a deterministic stub embedder")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
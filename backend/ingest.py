@@ -1,25 +1,228 @@
 import os
+import io
+import csv
+import time
+import argparse
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import text
 from pathlib import Path
-from backend.config import DB_DSN
+from backend.config import DB_DSN, INGEST_MODE, INGEST_CHUNK_ROWS
+from backend.stats import refresh_stats
 
 TABLES = ["game_details", "player_box_scores", "players", "teams"]
 DATA_DIR = Path(__file__).resolve().parent / "data"
 
-def main():
-    print('Starting Database Ingestion')
-    eng = sa.create_engine(DB_DSN)
+# explicit schema for the copy loader so types are never re-inferred from the csv
+TABLE_SCHEMAS = {
+    "game_details": {
+        "columns": {
+            "game_id": "BIGINT NOT NULL",
+            "season": "INTEGER",
+            "game_timestamp": "TIMESTAMP",
+            "home_team_id": "BIGINT",
+            "away_team_id": "BIGINT",
+            "home_points": "INTEGER",
+            "away_points": "INTEGER",
+            "winning_team_id": "BIGINT",
+        },
+        "primary_key": ["game_id"],
+        "indexes": [
+            ["game_timestamp"],
+            ["home_team_id"],
+            ["away_team_id"],
+            ["season"],
+        ],
+    },
+    "player_box_scores": {
+        "columns": {
+            "game_id": "BIGINT NOT NULL",
+            "person_id": "BIGINT NOT NULL",
+            "team_id": "BIGINT",
+            "starter": "BOOLEAN",
+            "seconds": "DOUBLE PRECISION",
+            "points": "INTEGER",
+            "fg2_made": "INTEGER",
+            "fg2_attempted": "INTEGER",
+            "fg3_made": "INTEGER",
+            "fg3_attempted": "INTEGER",
+            "ft_made": "INTEGER",
+            "ft_attempted": "INTEGER",
+            "offensive_reb": "INTEGER",
+            "defensive_reb": "INTEGER",
+            "assists": "INTEGER",
+            "steals": "INTEGER",
+            "blocks": "INTEGER",
+            "turnovers": "INTEGER",
+            "defensive_fouls": "INTEGER",
+            "offensive_fouls": "INTEGER",
+        },
+        "primary_key": ["game_id", "person_id"],
+        "indexes": [
+            ["person_id"],
+            ["team_id"],
+        ],
+    },
+    "players": {
+        "columns": {
+            "player_id": "BIGINT NOT NULL",
+            "team_id": "BIGINT",
+            "first_name": "TEXT",
+            "last_name": "TEXT",
+            "birth_date": "DATE",
+            "height": "INTEGER",
+            "weight": "INTEGER",
+            "position": "TEXT",
+            "draft_year": "INTEGER",
+            "season_exp": "INTEGER",
+        },
+        "primary_key": ["player_id"],
+        "indexes": [
+            ["team_id"],
+        ],
+    },
+    "teams": {
+        "columns": {
+            "team_id": "BIGINT NOT NULL",
+            "city": "TEXT",
+            "name": "TEXT",
+            "abbreviation": "TEXT",
+            "conference": "TEXT",
+            "division": "TEXT",
+        },
+        "primary_key": ["team_id"],
+        "indexes": [
+            ["abbreviation"],
+        ],
+    },
+}
+
+
+def create_table_sql(table: str) -> str:
+    # bare table only, keys and indexes are added after the load
+    schema = TABLE_SCHEMAS[table]
+    cols = ",\n    ".join(f"{c} {t}" for c, t in schema["columns"].items())
+    return f"DROP TABLE IF EXISTS {table} CASCADE;\nCREATE TABLE {table} (\n    {cols}\n)"
+
+
+def finalize_table_sql(table: str) -> list:
+    schema = TABLE_SCHEMAS[table]
+    stmts = [
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({', '.join(schema['primary_key'])})"
+    ]
+    for cols in schema["indexes"]:
+        stmts.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_{'_'.join(cols)} ON {table} ({', '.join(cols)})")
+    stmts.append(f"ANALYZE {table}")
+    return stmts
+
+
+def iter_csv_chunks(path, chunk_rows: int):
+    # stream the csv as (header, csv text chunk, row count) without parsing values
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        n = 0
+        for row in reader:
+            writer.writerow(row)
+            n += 1
+            if n >= chunk_rows:
+                yield header, buf.getvalue(), n
+                buf = io.StringIO()
+                writer = csv.writer(buf, lineterminator="\n")
+                n = 0
+        if n:
+            yield header, buf.getvalue(), n
+
+
+def copy_table(raw_conn, table: str, chunk_rows: int) -> int:
+    path = os.path.join(DATA_DIR, f"{table}.csv")
+    schema = TABLE_SCHEMAS[table]
+    total = 0
+    start = time.perf_counter()
+    with raw_conn.cursor() as cur:
+        cur.execute(create_table_sql(table))
+        for header, chunk, n in iter_csv_chunks(path, chunk_rows):
+            unknown = [c for c in header if c not in schema["columns"]]
+            if unknown:
+                raise ValueError(f"{table}.csv has columns missing from schema: {unknown}")
+            # column list comes from the csv header so file column order doesn't matter
+            cur.copy_expert(
+                f"COPY {table} ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)",
+                io.StringIO(chunk),
+            )
+            total += n
+        load_secs = time.perf_counter() - start
+        for stmt in finalize_table_sql(table):
+            cur.execute(stmt)
+    elapsed = time.perf_counter() - start
+    rate = total / load_secs if load_secs > 0 else float("inf")
+    print(f"  {table}: {total} rows, copy {load_secs:.2f}s ({rate:,.0f} rows/sec), "
+          f"total incl. keys/indexes {elapsed:.2f}s")
+    return total
+
+
+def ingest_copy(eng, chunk_rows: int = INGEST_CHUNK_ROWS):
+    raw_conn = eng.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            # Ensure pgvector extension is available for the `vector` type used to store embeddings
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        for t in TABLES:
+            copy_table(raw_conn, t, chunk_rows)
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+
+def ingest_pandas(eng):
     with eng.begin() as cx:
         # Ensure pgvector extension is available for the `vector` type used to store embeddings
         cx.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         for t in TABLES:
+            start = time.perf_counter()
             path = os.path.join(DATA_DIR, f"{t}.csv")
             df = pd.read_csv(path)
             df.to_sql(t, cx, if_exists="replace", index=False, method="multi", chunksize=5000)
+            elapsed = time.perf_counter() - start
+            print(f"  {t}: {len(df)} rows in {elapsed:.2f}s ({len(df) / elapsed:,.0f} rows/sec)")
+
+
+def bump_ingest_version(eng):
+    # bumped after every load so the server reloads its team / player index (backend/entity_index.py)
+    with eng.begin() as cx:
+        cx.execute(text("""
+            CREATE TABLE IF NOT EXISTS nba_ingest_version (
+                id INTEGER PRIMARY KEY DEFAULT 1,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            )
+        """))
+        cx.execute(text("INSERT INTO nba_ingest_version (id) VALUES (1) ON CONFLICT DO NOTHING"))
+        cx.execute(text("UPDATE nba_ingest_version SET version = version + 1, updated_at = NOW() WHERE id = 1"))
+
+
+def main(mode: str = INGEST_MODE):
+    print(f'Starting Database Ingestion ({mode})')
+    eng = sa.create_engine(DB_DSN)
+    if mode == "copy":
+        ingest_copy(eng)
+    elif mode == "pandas":
+        ingest_pandas(eng)
+    else:
+        raise ValueError(f"Unknown ingest mode: {mode}")
+    # stat tables for the sql fast path, only games whose rows changed are recomputed
+    refresh_stats(eng)
+    bump_ingest_version(eng)
     print('Finished Database Ingestion')
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Load the NBA csvs into postgres")
+    parser.add_argument("--mode", choices=["copy", "pandas"], default=INGEST_MODE)
+    args = parser.parse_args()
+    main(args.mode)
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+from backend import fake_ollama
+
+# closed-loop load test for /api/chat at increasing concurrency:
+#   python -m backend.loadtest --spawn --concurrency 1,4,16,64 --duration 15 --prompt-ms 300 --token-ms 20
+#   python -m backend.loadtest --url http://localhost:8000 --endpoint /api/chat/stream
+# --spawn serves backend.server in process against backend/fake_ollama.py (needs DB_DSN),
+# --url drives an already running server (point its OLLAMA_HOST at a fake_ollama for GPU-free runs)
+# most part1 questions are answered by the sql fast path, SQL_FAST_PATH=off load tests the rag path
+
+BASE_DIR = os.path.dirname(__file__)
+QUESTIONS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "questions.json"))
+
+
+def spawn_server() -> str:
+    # fake ollama first, the backend modules read OLLAMA_HOST when they are imported
+    _, ollama_url = fake_ollama.start()
+    os.environ["OLLAMA_HOST"] = ollama_url
+    from backend.server import app
+
+    _, url = fake_ollama.run_in_thread(app)
+    print(f"server {url}, fake ollama {ollama_url}")
+    return url
+
+
+async def one_request(client: httpx.AsyncClient, endpoint: str, question: str) -> dict:
+    t0 = time.perf_counter()
+    result = {"ok": False, "latency": None, "ttft": None, "error": None}
+    try:
+        if endpoint.endswith("/stream"):
+            async with client.stream("POST", endpoint, json={"question": question}) as r:
+                if r.status_code != 200:
+                    result["error"] = f"http {r.status_code}"
+                else:
+                    event = None
+                    async for line in r.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[7:]
+                            if event == "token" and result["ttft"] is None:
+                                result["ttft"] = time.perf_counter() - t0
+                            elif event == "error":
+                                result["error"] = "stream error event"
+                    result["ok"] = result["error"] is None and event == "done"
+                    if not result["ok"] and result["error"] is None:
+                        result["error"] = "stream ended early"
+        else:
+            r = await client.post(endpoint, json={"question": question})
+            result["ok"] = r.status_code == 200
+            if not result["ok"]:
+                result["error"] = f"http {r.status_code}"
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    result["latency"] = time.perf_counter() - t0
+    return result
+
+
+async def run_step(url: str, endpoint: str, questions: List[str], concurrency: int,
+                   duration: float, timeout: float, unique: bool) -> dict:
+    counter = itertools.count()
+    results = []
+    deadline = time.monotonic() + duration
+
+    async def worker(client):
+        while time.monotonic() < deadline:
+            n = next(counter)
+            q = questions[n % len(questions)]
+            if unique:
+                # defeats the query cache, every request embeds and retrieves
+                q = f"{q} (#{n})"
+            results.append(await one_request(client, endpoint, q))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    lat = np.array([r["latency"] for r in ok]) * 1000
+    ttft = np.array([r["ttft"] for r in ok if r["ttft"] is not None]) * 1000
+
+    def pct(a, p):
+        return round(float(np.percentile(a, p)), 1) if len(a) else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "rps": round(len(ok) / elapsed, 2),
+        "p50_ms": pct(lat, 50),
+        "p95_ms": pct(lat, 95),
+        "p99_ms": pct(lat, 99),
+        "ttft_p50_ms": pct(ttft, 50),
+        "ttft_p95_ms": pct(ttft, 95),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test /api/chat at increasing concurrency")
+    parser.add_argument("--url", default=None, help="running server, default spawns one with --spawn")
+    parser.add_argument("--spawn", action="store_true", help="serve backend.server in process against fake ollama")
+    parser.add_argument("--endpoint", default="/api/chat")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency step")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--unique", action="store_true", help="make every question unique (no cache hits)")
+    parser.add_argument("--out", default=None)
+    fake_ollama.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not args.url and not args.spawn:
+        parser.error("pass --url or --spawn")
+    fake_ollama.configure(args)
+    url = spawn_server() if args.spawn else args.url
+
+    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+        questions = [q["question"] for q in json.load(f)]
+
+    report = []
+    print(f"{'conc':>5} {'reqs':>6} {'rps':>8} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>9}")
+    for c in [int(x) for x in args.concurrency.split(",")]:
+        step = asyncio.run(run_step(url, args.endpoint, questions, c, args.duration, args.timeout, args.unique))
+        report.append(step)
+        print(f"{c:>5} {step['requests']:>6} {step['rps']:>8} {step['error_rate'] * 100:>6.1f} "
+              f"{step['p50_ms']!s:>8} {step['p95_ms']!s:>8} {step['p99_ms']!s:>8} {step['ttft_p50_ms']!s:>9}"
+              + (f"  {step['errors']}" if step["errors"] else ""))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"endpoint": args.endpoint, "unique": args.unique, "steps": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
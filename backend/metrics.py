@@ -0,0 +1,145 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest, write_to_textfile
+
+# per-stage timings for the chat / rag paths, exported as prometheus histograms
+# (GET /metrics on the server, RAG_METRICS_FILE textfile for rag.py) and as a Server-Timing header
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time spent in each stage of answering a question", ["endpoint", "stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+REQUESTS = Counter("chat_requests_total", "Questions answered", ["endpoint", "status"])
+PROMPT_CHARS = Histogram(
+    "chat_prompt_chars", "Prompt size in characters", ["endpoint"],
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+)
+PROMPT_TOKENS = Histogram(
+    "chat_prompt_tokens", "Prompt tokens as counted by ollama (prompt_eval_count)", ["endpoint"],
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+GENERATED_TOKENS = Histogram(
+    "chat_generated_tokens", "Tokens generated per answer (eval_count)", ["endpoint"],
+    buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
+PREFILL_SECONDS = Histogram(
+    "chat_prefill_seconds", "Prompt processing time reported by ollama (prompt_eval_duration)", ["endpoint"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+RETRIEVED_ROWS = Histogram(
+    "chat_retrieved_rows", "Rows retrieved as context", ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+
+_current: ContextVar[Optional["Timings"]] = ContextVar("chat_timings", default=None)
+
+
+class Timings:
+    """Stage spans of one request / question, observed into the histograms by ``finish``."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.counts: Dict[str, int] = {}
+        self.finished = False
+
+    def add(self, stage: str, seconds: float):
+        self.stages.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={secs * 1000:.1f}" for stage, secs in self.stages)
+
+    def as_ms(self) -> Dict[str, float]:
+        out = {}
+        for stage, secs in self.stages:
+            out[stage] = round(out.get(stage, 0.0) + secs * 1000, 1)
+        return out
+
+    def finish(self, status: str = "ok", rows: Optional[int] = None, stats: Optional[dict] = None):
+        # stats: prompt_chars / context_rows plus the counters of ollama's final generate response (see utils._generate_stats)
+        if self.finished:
+            return
+        self.finished = True
+        self.add("total", self.elapsed())
+        for stage, secs in self.stages:
+            STAGE_SECONDS.labels(self.endpoint, stage).observe(secs)
+        REQUESTS.labels(self.endpoint, status).inc()
+        stats = stats or {}
+        if rows is not None:
+            self.counts["rows"] = rows
+            RETRIEVED_ROWS.labels(self.endpoint).observe(rows)
+        if stats.get("context_rows") is not None:
+            self.counts["context_rows"] = stats["context_rows"]
+        if stats.get("prompt_chars") is not None:
+            self.counts["prompt_chars"] = stats["prompt_chars"]
+            PROMPT_CHARS.labels(self.endpoint).observe(stats["prompt_chars"])
+        if stats.get("prompt_eval_count") is not None:
+            self.counts["prompt_tokens"] = stats["prompt_eval_count"]
+            PROMPT_TOKENS.labels(self.endpoint).observe(stats["prompt_eval_count"])
+        if stats.get("prompt_eval_duration") is not None:
+            # nanoseconds, roughly the time to first token of a warm model
+            self.counts["prefill_ms"] = round(stats["prompt_eval_duration"] / 1e6)
+            PREFILL_SECONDS.labels(self.endpoint).observe(stats["prompt_eval_duration"] / 1e9)
+        if stats.get("eval_count") is not None:
+            self.counts["generated_tokens"] = stats["eval_count"]
+            GENERATED_TOKENS.labels(self.endpoint).observe(stats["eval_count"])
+
+    def summary(self) -> str:
+        parts = [f"{stage} {ms:.0f}ms" for stage, ms in self.as_ms().items()]
+        parts += [f"{k} {v}" for k, v in self.counts.items()]
+        return ", ".join(parts)
+
+
+def start(endpoint: str) -> Timings:
+    # makes a Timings current for this task / thread, span() below records into it
+    timings = Timings(endpoint)
+    _current.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage: str):
+    # no-op outside a request, so shared helpers can be instrumented unconditionally
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(stage):
+        yield
+
+
+def latest() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def write_textfile(path: str):
+    # node_exporter textfile collector format, for batch runs like rag.py
+    write_to_textfile(path, REGISTRY)
+
+
+def stage_summary(runs: List[Timings]) -> str:
+    # p50 / p95 / total per stage across a batch of questions
+    per_stage: Dict[str, List[float]] = {}
+    for t in runs:
+        for stage, ms in t.as_ms().items():
+            per_stage.setdefault(stage, []).append(ms)
+    lines = [f"{'stage':>14} {'p50 ms':>9} {'p95 ms':>9} {'sum s':>8}"]
+    for stage, ms in per_stage.items():
+        lines.append(f"{stage:>14} {np.percentile(ms, 50):>9.1f} {np.percentile(ms, 95):>9.1f} {sum(ms) / 1000:>8.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,157 @@
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+from sqlalchemy import text
+
+from backend.config import EMBED_MODEL, QUERY_CACHE_SIZE, QUERY_CACHE_TTL, CACHE_VERSION_CHECK_SECS
+from backend.utils import ollama_embed, ollama_embed_async, ollama_embed_many
+
+_MISSING = object()
+
+
+def normalize_question(question: str) -> str:
+    # case / whitespace / trailing punctuation insensitive key for a question
+    q = unicodedata.normalize("NFKC", question).casefold()
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip("?!. ")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            item = self.data.get(key, _MISSING)
+            if item is not _MISSING and item[0] > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not _MISSING:
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = await compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.data), "hits": self.hits, "misses": self.misses}
+
+
+class QueryCache:
+    """Query-embedding and top-k retrieval caches for the chat / rag paths.
+
+    Retrieval results are dropped whenever ``nba_embeddings_version`` moves,
+    which the embedding pipeline bumps on every write. The version is polled at
+    most every ``CACHE_VERSION_CHECK_SECS`` seconds.
+    """
+
+    def __init__(self, engine=None, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.engine = engine
+        self.embeddings = TTLCache(max_size, ttl)
+        self.retrievals = TTLCache(max_size, ttl)
+        self.version = None
+        self.version_checked = 0.0
+        self.lock = threading.Lock()
+
+    def embed(self, question: str, model: str = EMBED_MODEL) -> List[float]:
+        key = (model, "embeddings", normalize_question(question))
+        return self.embeddings.get_or_compute(key, lambda: ollama_embed(model, question))
+
+    def embed_many(self, questions: List[str], model: str = EMBED_MODEL) -> List[List[float]]:
+        # cached ones from the cache, all the misses in a single batched request. keyed apart from
+        # embed(): /api/embed vectors come back normalized, /api/embeddings ones don't
+        keys = [(model, "embed", normalize_question(q)) for q in questions]
+        out = [self.embeddings.get(key, _MISSING) for key in keys]
+        todo = [i for i, v in enumerate(out) if v is _MISSING]
+        if todo:
+            for i, vec in zip(todo, ollama_embed_many(model, [questions[i] for i in todo])):
+                self.embeddings.put(keys[i], vec)
+                out[i] = vec
+        return out
+
+    def retrieve(self, question: str, k: int, fetch: Callable[[], List[dict]],
+                 model: str = EMBED_MODEL, scope: Optional[Hashable] = None) -> List[dict]:
+        # scope separates different retrieval functions sharing one cache
+        self._check_version()
+        key = (model, normalize_question(question), k, scope)
+        return self.retrievals.get_or_compute(key, lambda: [dict(r) for r in fetch()])
+
+    async def embed_async(self, question: str, client, model: str = EMBED_MODEL) -> List[float]:
+        key = (model, "embeddings", normalize_question(question))
+        return await self.embeddings.aget_or_compute(
+            key, lambda: ollama_embed_async(client, model, question)
+        )
+
+    async def retrieve_async(self, question: str, k: int, fetch: Callable[[], Awaitable[List[dict]]],
+                             model: str = EMBED_MODEL, scope: Optional[Hashable] = None) -> List[dict]:
+        # the version poll is a blocking query, keep it off the event loop
+        if self.engine is not None and time.monotonic() - self.version_checked >= CACHE_VERSION_CHECK_SECS:
+            await asyncio.to_thread(self._check_version)
+        key = (model, normalize_question(question), k, scope)
+
+        async def compute():
+            return [dict(r) for r in await fetch()]
+
+        return await self.retrievals.aget_or_compute(key, compute)
+
+    def _check_version(self):
+        if self.engine is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.version_checked < CACHE_VERSION_CHECK_SECS:
+                return
+            self.version_checked = now
+        try:
+            with self.engine.connect() as cx:
+                version = cx.execute(text("SELECT version FROM nba_embeddings_version WHERE id = 1")).scalar()
+        except Exception:
+            # table not created yet (pipeline never ran), nothing to invalidate against
+            return
+        with self.lock:
+            if self.version is not None and version != self.version:
+                self.retrievals.clear()
+            self.version = version
+
+    def invalidate(self):
+        self.retrievals.clear()
+
+    def stats(self) -> dict:
+        return {"embeddings": self.embeddings.stats(), "retrievals": self.retrievals.stats()}
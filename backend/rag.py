@@ -1,60 +1,211 @@
+import argparse
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sqlalchemy as sa
-from sqlalchemy import text
-from backend.config import DB_DSN, EMBED_MODEL, LLM_MODEL
-from backend.utils import ollama_embed, ollama_generate
+from backend import metrics
+from backend.config import (
+    DB_DSN, LLM_MODEL, RETRIEVAL_BACKEND, RAG_METRICS_FILE, RAG_BATCH_CONCURRENCY, SQL_FAST_PATH,
+)
+from backend.metrics import span
+from backend.utils import ollama_generate
+from backend.query_cache import QueryCache
+from backend.vector_index import VectorIndex
+from backend.retrieval import (
+    EntityLookup, QuestionFilters, DEFAULT_TYPE_K, extract_filters, retrieve_multi, retrieve_batch, evidence,
+)
+from backend.context import build_context
+from backend.router import QuestionRouter
+
+# answers part1/questions.json into part1/answers.json:
+#   python -m backend.rag                              # one question at a time
+#   python -m backend.rag --batch --concurrency 4      # batched embed + retrieval, concurrent generation
+# --batch appends each answer to answers.json.partial.jsonl as it completes, rerunning resumes from it
 
 BASE_DIR = os.path.dirname(__file__)
 QUESTIONS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "questions.json"))
 ANSWERS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "answers.json"))
 TEMPLATE_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "answers_template.json"))
+PARTIAL_PATH = ANSWERS_PATH + ".partial.jsonl"
+
+vector_index = VectorIndex() if RETRIEVAL_BACKEND == "memory" else None
+
 
+def retrieve(cx, qvec, type_k=None, filters=None):
+    # per entity type top-k (DEFAULT_TYPE_K) with source rows joined in, narrowed by any filters
+    if vector_index is not None:
+        return vector_index.retrieve(cx, qvec, type_k, filters)
+    return retrieve_multi(cx, qvec, filters or QuestionFilters(), type_k or DEFAULT_TYPE_K)
 
-def retrieve(cx, qvec, k=5):
-    sql = (
-       "SELECT game_id, game_timestamp, home_team_id, away_team_id, home_points, away_points, "
-        "1 - (embedding <=> (:q)::vector) AS score FROM game_details ORDER BY embedding <-> (:q)::vector LIMIT :k"
-    )
-    return cx.execute(text(sql), {"q": qvec, "k": k}).mappings().all()
 
+def load_template(path=TEMPLATE_PATH) -> str:
+    # read once, serialized compactly so the prompt prefix is byte-identical every call
+    with open(path, encoding="utf-8") as f:
+        return json.dumps(json.load(f), separators=(",", ":"))
 
-def build_context(rows):
-    return "\n".join(
-        [
-            f"{r['game_id']} {r['game_timestamp']} {r['home_team_id']} vs {r['away_team_id']} {r['home_points']}-{r['away_points']}"
-            for r in rows
-        ]
-    )
+
+# everything question independent goes first, ollama can then reuse the prompt's kv cache
+# for this prefix from one question to the next
+PROMPT_PREFIX = (
+    f"Use this format to answer the questions:\n{load_template()}\n"
+    f"Answer using only this context. Cite game_ids used.\n"
+    f"Context:\n"
+)
 
 
 # Feel free to edit this prompt, but ensure it still uses context directly from the embeddings
-def answer(question, rows):
-    # Use answers template in the response
-    with open(TEMPLATE_PATH, encoding="utf-8") as f:
-        answers_template = json.load(f)
-    ctx = build_context(rows)
-    prompt = (
-        f"Use this format to answer the questions:\n{json.dumps(answers_template)}\n"
-        f"Answer using only this context. Cite game_ids used.\n"
-        f"Context:\n{ctx}\n\nQ: {question}\nA:"
-    )
-    return ollama_generate(LLM_MODEL, prompt)
+def answer(question, rows, stats=None):
+    """Answer from the retrieved rows, returns (answer, rows that made it into the context)."""
+    with span("prompt"):
+        ctx, used = build_context(rows)
+        prompt = f"{PROMPT_PREFIX}{ctx}\n\nQ: {question}\nA:"
+    if stats is not None:
+        stats.update(prompt_chars=len(prompt), context_rows=len(used))
+    with span("generate"):
+        return ollama_generate(LLM_MODEL, prompt, stats), used
 
 
-if __name__ == "__main__":
-    eng = sa.create_engine(DB_DSN)
-    with open(QUESTIONS_PATH, encoding="utf-8") as f:
-        qs = json.load(f)
+def run_sequential(eng, query_cache, qs):
+    # one question at a time: embed, retrieve, generate
     outs = []
+    runs = []
     with eng.begin() as cx:
+        lookup = EntityLookup.load(cx)
+        router = QuestionRouter.load(cx, lookup) if SQL_FAST_PATH else None
         for q in qs:
-            qvec = ollama_embed(EMBED_MODEL, q["question"])
-            rows = retrieve(cx, qvec, 5)
-            ans = answer(q["question"], rows)
+            timings = metrics.start("rag")
+            if router is not None:
+                with span("router"):
+                    routed = router.route(cx, q["question"])
+                if routed:
+                    timings.finish("fast_path")
+                    print(f"{q['id']} ({routed['route']}): {timings.summary()}")
+                    runs.append(timings)
+                    outs.append({"answer": routed["answer"], "evidence": routed["evidence"]})
+                    continue
+            with span("embed"):
+                qvec = query_cache.embed(q["question"])
+            with span("filters"):
+                filters = extract_filters(q["question"], lookup)
+            with span("retrieve"):
+                rows = query_cache.retrieve(
+                    q["question"], tuple(DEFAULT_TYPE_K.items()), lambda: retrieve(cx, qvec, DEFAULT_TYPE_K, filters)
+                )
+            stats = {}
+            ans, used = answer(q["question"], rows, stats)
+            timings.finish("ok", len(rows), stats)
+            print(f"{q['id']}: {timings.summary()}")
+            runs.append(timings)
             outs.append({
                 "answer": ans,
-                "evidence": [{"table": "game_details", "id": int(r["game_id"])} for r in rows],
+                "evidence": evidence(used),
             })
+    return outs, runs
+
+
+def load_partial(path):
+    # answers already written by an interrupted --batch run, by question index
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # half written last line
+                done[rec["index"]] = rec
+    return done
+
+
+def run_batch(eng, query_cache, qs, concurrency, partial_path):
+    """All embeddings in one request, all retrievals in one statement, then the generations
+    ``concurrency`` at a time. Each answer is appended to ``partial_path`` as it completes
+    and skipped when the run is restarted."""
+    done = {i: rec for i, rec in load_partial(partial_path).items()
+            if i < len(qs) and rec.get("question") == qs[i]["question"]}
+    todo = [i for i in range(len(qs)) if i not in done]
+    if done:
+        print(f"Resuming: {len(done)} answers in {partial_path}, {len(todo)} to go")
+    lock = threading.Lock()
+
+    def save(i, ans, ev):
+        rec = {"index": i, "question": qs[i]["question"], "answer": ans, "evidence": ev}
+        with lock:
+            with open(partial_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            done[i] = rec
+
+    all_rows = []
+    if todo:
+        timings = metrics.start("rag_batch")
+        with eng.begin() as cx:
+            lookup = EntityLookup.load(cx)
+            router = QuestionRouter.load(cx, lookup) if SQL_FAST_PATH else None
+            if router is not None:
+                with span("router"):
+                    for i in list(todo):
+                        routed = router.route(cx, qs[i]["question"])
+                        if routed:
+                            save(i, routed["answer"], routed["evidence"])
+                            todo.remove(i)
+            questions = [qs[i]["question"] for i in todo]
+            if questions:
+                with span("embed"):
+                    qvecs = query_cache.embed_many(questions)
+                with span("filters"):
+                    filters = [extract_filters(q, lookup) for q in questions]
+                with span("retrieve"):
+                    if vector_index is not None:
+                        all_rows = [retrieve(cx, v, DEFAULT_TYPE_K, f) for v, f in zip(qvecs, filters)]
+                    else:
+                        all_rows = retrieve_batch(cx, qvecs, filters, DEFAULT_TYPE_K)
+        timings.finish("ok", sum(len(r) for r in all_rows))
+        print(f"batch: {len(done)} answered from the stat tables or earlier runs, "
+              f"{len(todo)} to generate: {timings.summary()}")
+
+    runs = []  # per generation, the batch stages are printed above
+
+    def generate(i, rows):
+        t = metrics.start("rag_batch")
+        stats = {}
+        ans, used = answer(qs[i]["question"], rows, stats)
+        t.finish("ok", len(rows), stats)
+        save(i, ans, evidence(used))
+        with lock:
+            runs.append(t)
+        print(f"{qs[i]['id']}: {t.summary()}")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for fut in as_completed([pool.submit(generate, i, rows) for i, rows in zip(todo, all_rows)]):
+            fut.result()
+    return [{"answer": done[i]["answer"], "evidence": done[i]["evidence"]} for i in range(len(qs))], runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer the part1 questions")
+    parser.add_argument("--batch", action="store_true", help="batched embed / retrieval, concurrent generation")
+    parser.add_argument("--concurrency", type=int, default=RAG_BATCH_CONCURRENCY,
+                        help="generations in flight with --batch (match OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--fresh", action="store_true", help="ignore answers left by an interrupted --batch run")
+    args = parser.parse_args()
+
+    eng = sa.create_engine(DB_DSN)
+    query_cache = QueryCache(eng)
+    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+        qs = json.load(f)
+    if args.batch:
+        if args.fresh and os.path.exists(PARTIAL_PATH):
+            os.remove(PARTIAL_PATH)
+        outs, runs = run_batch(eng, query_cache, qs, args.concurrency, PARTIAL_PATH)
+    else:
+        outs, runs = run_sequential(eng, query_cache, qs)
     with open(ANSWERS_PATH, "w", encoding="utf-8") as f:
         json.dump(outs, f, ensure_ascii=False, indent=2)
+    if args.batch and os.path.exists(PARTIAL_PATH):
+        # complete, answers.json has everything now
+        os.remove(PARTIAL_PATH)
+    print(f"Query cache: {query_cache.stats()}")
+    print(metrics.stage_summary(runs))
+    if RAG_METRICS_FILE:
+        metrics.write_textfile(RAG_METRICS_FILE)
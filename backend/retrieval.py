@@ -0,0 +1,492 @@
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from backend.config import (
+    VECTOR_DISTANCE, VECTOR_QUANTIZATION, QUANT_RERANK_FACTOR, EMBED_DIM,
+    HNSW_EF_SEARCH, HNSW_ITERATIVE_SCAN, HNSW_MAX_SCAN_TUPLES,
+)
+from backend.embeding.config import DISTANCE_OPS, ann_index
+from backend.entity_index import EntityLookup, fold
+from backend.utils import vector_literal
+
+# ORDER BY with the operator the hnsw indexes were built for, otherwise postgres can't use them
+DISTANCE_OP = DISTANCE_OPS[VECTOR_DISTANCE][0]
+QV = "CAST(CAST(:q AS text) AS vector)"
+
+MONTHS = {
+    m: i + 1 for i, m in enumerate(
+        ["january", "february", "march", "april", "may", "june", "july",
+         "august", "september", "october", "november", "december"]
+    )
+}
+MONTHS.update({m[:3]: i for m, i in list(MONTHS.items())})
+MONTHS["sept"] = 9
+
+HOLIDAYS = {
+    "christmas": (12, 25),
+    "new year's eve": (12, 31),
+    "new years eve": (12, 31),
+    "new year's day": (1, 1),
+    "new years day": (1, 1),
+}
+
+_MONTH_RE = "|".join(sorted(MONTHS, key=len, reverse=True))
+_MDY_NAME = re.compile(rf"\b({_MONTH_RE})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(\d{{4}}))?", re.I)
+_DMY_NAME = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+({_MONTH_RE})\.?(?:,?\s+(\d{{4}}))?", re.I)
+_ISO = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_NUMERIC = re.compile(r"(?<![\d-])(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?(?![\d-])")
+_SEASON = re.compile(r"\b(20\d{2})(?:\s*[-/]\s*(?:20)?\d{2})?\s+(?:nba\s+|regular\s+)?season\b", re.I)
+_YEAR = re.compile(r"\b(20\d{2})\b")
+
+
+@dataclass
+class QuestionFilters:
+    dates: List[date] = field(default_factory=list)
+    season: Optional[int] = None
+    team_ids: List[int] = field(default_factory=list)
+    player_ids: List[int] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.dates or self.season or self.team_ids or self.player_ids)
+
+
+def _year(y: Optional[str]) -> Optional[int]:
+    if not y:
+        return None
+    y = int(y)
+    return y + 2000 if y < 100 else y
+
+
+def _season_year(month: int, season: int) -> int:
+    # a season labelled 2023 runs October 2023 - June 2024
+    return season if month >= 8 else season + 1
+
+
+def _safe_date(y: Optional[int], m: int, d: int, season: Optional[int]) -> Optional[date]:
+    if y is None:
+        if season is None:
+            return None
+        y = _season_year(m, season)
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+
+def extract_dates(question: str, season: Optional[int] = None) -> List[date]:
+    found = []
+    q = question
+    for m in _ISO.finditer(q):
+        found.append(_safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3)), season))
+    q = _ISO.sub(" ", q)
+    for m in _MDY_NAME.finditer(q):
+        found.append(_safe_date(_year(m.group(3)), MONTHS[m.group(1).lower()], int(m.group(2)), season))
+    for m in _DMY_NAME.finditer(q):
+        found.append(_safe_date(_year(m.group(3)), MONTHS[m.group(2).lower()], int(m.group(1)), season))
+    # numeric dates are month first: 1-26-24, 2/1/2024, 4/9
+    for m in _NUMERIC.finditer(_SEASON.sub(" ", q)):
+        found.append(_safe_date(_year(m.group(3)), int(m.group(1)), int(m.group(2)), season))
+
+    folded = fold(question)
+    years = [int(y) for y in _YEAR.findall(question)]
+    for name, (month, day) in HOLIDAYS.items():
+        if name in folded:
+            if years:
+                found.extend(date(y, month, day) for y in years)
+            elif season is not None:
+                found.append(date(_season_year(month, season), month, day))
+
+    out = []
+    for d in found:
+        if d and d not in out:
+            out.append(d)
+    return out
+
+
+def extract_season(question: str) -> Optional[int]:
+    m = _SEASON.search(question)
+    return int(m.group(1)) if m else None
+
+
+def extract_filters(question: str, lookup: Optional[EntityLookup] = None) -> QuestionFilters:
+    season = extract_season(question)
+    filters = QuestionFilters(dates=extract_dates(question, season), season=season)
+    if lookup is not None:
+        filters.team_ids, filters.player_ids = lookup.resolve(question)
+    return filters
+
+
+# WHERE condition on nba_embeddings columns per QuestionFilters field. {v} is the value's sql:
+# a bind parameter in filter_clauses, a column of the question row in build_batch_query
+FILTER_SQL = {
+    "dates": "game_date = ANY({v})",
+    "season": "season = {v}",
+    # game docs carry no team_id, match them through game_details instead
+    "team_ids": "(team_id = ANY({v}) OR game_id IN ("
+                "SELECT game_id FROM game_details "
+                "WHERE home_team_id = ANY({v}) OR away_team_id = ANY({v})))",
+    # keep game rows, but only the named players' box scores / profiles
+    "player_ids": "(player_id IS NULL OR player_id = ANY({v}))",
+}
+
+
+def active_filters(filters: QuestionFilters) -> List[str]:
+    # the FILTER_SQL fields this question constrains
+    return [name for name in FILTER_SQL
+            if (filters.season is not None if name == "season" else getattr(filters, name))]
+
+
+def filter_clauses(filters: QuestionFilters, params: dict) -> List[str]:
+    # WHERE conditions on nba_embeddings columns, bind values are added to params
+    where = []
+    for name in active_filters(filters):
+        where.append(FILTER_SQL[name].format(v=f":{name}"))
+        value = getattr(filters, name)
+        params[name] = list(value) if isinstance(value, list) else value
+    return where
+
+
+def build_filtered_query(qvec: List[float], filters: QuestionFilters, k: int) -> Tuple[str, dict]:
+    """ANN search over nba_embeddings with the question's constraints as WHERE clauses.
+
+    The conditions line up with the partial indexes created in
+    ``DatabaseManager.initialize_vector_tables`` (game_date, season, team_id,
+    player_id) so postgres can narrow the candidate rows before ranking.
+    """
+    params = {"q": vector_literal(qvec), "k": k}
+    where = filter_clauses(filters, params)
+
+    cols = "id, entity_type, entity_id, game_id, team_id, player_id, content_text, season, game_date, embedding"
+    qv = QV
+    score = f"1 - (embedding <=> {qv}) AS score"
+    if not where or HNSW_ITERATIVE_SCAN != "off":
+        # with iterative scan the index keeps scanning until k rows pass the filters
+        sql = ann_top_k(cols, f"WHERE {' AND '.join(where)} " if where else "", "k")
+    else:
+        # materialize the filtered candidates (via the metadata indexes) and rank them
+        # exactly; a filtered HNSW scan would post-filter its ef_search candidates and
+        # can come back with fewer than k rows
+        sql = (
+            f"WITH candidates AS MATERIALIZED (SELECT {cols} FROM nba_embeddings "
+            f"WHERE {' AND '.join(where)}) "
+            f"SELECT {cols.replace(', embedding', '')}, {score} FROM candidates "
+            f"ORDER BY embedding {DISTANCE_OP} {qv} LIMIT :k"
+        )
+    return sql, params
+
+
+def ann_top_k(cols: str, where_sql: str, k_param: str, quantization: str = VECTOR_QUANTIZATION,
+              qv: str = QV) -> str:
+    """Top ``:k_param`` rows of nba_embeddings ordered through the hnsw index.
+
+    With a quantized index the compact expression picks ``QUANT_RERANK_FACTOR``
+    times as many candidates, which are then re-ranked by the full precision
+    distance. ``qv`` is the query vector expression (a bind param by default).
+    """
+    out = f"{cols.replace(', embedding', '')}, 1 - (embedding <=> {qv}) AS score"
+    if quantization == "none":
+        return f"SELECT {out} FROM nba_embeddings {where_sql}ORDER BY embedding {DISTANCE_OP} {qv} LIMIT :{k_param}"
+    expr, _, op, query = ann_index(quantization, VECTOR_DISTANCE, EMBED_DIM)
+    return (
+        f"SELECT {out} FROM (SELECT {cols} FROM nba_embeddings {where_sql}"
+        f"ORDER BY {expr} {op} {query.format(q=qv)} LIMIT :{k_param} * {QUANT_RERANK_FACTOR}) c "
+        f"ORDER BY embedding {DISTANCE_OP} {qv} LIMIT :{k_param}"
+    )
+
+
+def search_settings(k: int, quantization: str = VECTOR_QUANTIZATION) -> Tuple[str, dict]:
+    # transaction-local hnsw knobs, run before the ANN queries of one retrieval
+    fetch = k * QUANT_RERANK_FACTOR if quantization != "none" else k
+    sql = "SELECT set_config('hnsw.ef_search', :ef_search, true)"
+    params = {"ef_search": str(max(HNSW_EF_SEARCH, fetch))}
+    if HNSW_ITERATIVE_SCAN != "off":
+        sql += (", set_config('hnsw.iterative_scan', :iterative_scan, true)"
+                ", set_config('hnsw.max_scan_tuples', :max_scan_tuples, true)")
+        params["iterative_scan"] = HNSW_ITERATIVE_SCAN
+        params["max_scan_tuples"] = str(HNSW_MAX_SCAN_TUPLES)
+    return sql, params
+
+
+def relaxations(filters: QuestionFilters) -> List[QuestionFilters]:
+    # progressively looser filters to try when a stricter set matches nothing
+    # (e.g. a question quoting the wrong date)
+    chain = [filters]
+    if filters.dates or filters.season is not None:
+        chain.append(QuestionFilters(team_ids=filters.team_ids, player_ids=filters.player_ids))
+    if not filters.is_empty():
+        chain.append(QuestionFilters())
+    return chain
+
+
+def retrieve_filtered(cx, qvec: List[float], filters: QuestionFilters, k: int = 5):
+    sql, params = search_settings(k)
+    cx.execute(text(sql), params)
+    rows = []
+    for f in relaxations(filters):
+        sql, params = build_filtered_query(qvec, f, k)
+        rows = cx.execute(text(sql), params).mappings().all()
+        if rows:
+            break
+    return rows
+
+
+async def retrieve_filtered_async(cx, qvec: List[float], filters: QuestionFilters, k: int = 5):
+    sql, params = search_settings(k)
+    await cx.execute(text(sql), params)
+    rows = []
+    for f in relaxations(filters):
+        sql, params = build_filtered_query(qvec, f, k)
+        rows = (await cx.execute(text(sql), params)).mappings().all()
+        if rows:
+            break
+    return rows
+
+
+ENTITY_TYPES = ("game", "boxscore", "player", "team")
+DEFAULT_TYPE_K = {"game": 3, "boxscore": 5, "player": 1, "team": 1}
+
+# source row for each entity type, joined back on the hit's ids. games and box scores
+# carry the team abbreviations (box scores also the game date) so compact context lines
+# (context.compact_row) are built from the numbers, not content_text
+_SOURCE_COLS = (
+    "SELECT hit.*, to_jsonb(g) || jsonb_build_object('home_abbr', ht.abbreviation, 'away_abbr', at.abbreviation) "
+    "AS game, to_jsonb(b) || jsonb_build_object('team_abbr', bt.abbreviation, "
+    "'game_timestamp', bg.game_timestamp) AS boxscore, "
+    "to_jsonb(p) AS player, to_jsonb(t) AS team "
+)
+_SOURCE_JOINS = """
+LEFT JOIN game_details g ON hit.entity_type = 'game' AND g.game_id = hit.game_id
+LEFT JOIN teams ht ON ht.team_id = g.home_team_id
+LEFT JOIN teams at ON at.team_id = g.away_team_id
+LEFT JOIN player_box_scores b ON hit.entity_type = 'boxscore'
+    AND b.game_id = hit.game_id AND b.person_id = hit.player_id
+LEFT JOIN teams bt ON bt.team_id = b.team_id
+LEFT JOIN game_details bg ON bg.game_id = b.game_id
+LEFT JOIN players p ON hit.entity_type IN ('boxscore', 'player') AND p.player_id = hit.player_id
+LEFT JOIN teams t ON hit.entity_type = 'team' AND t.team_id = hit.team_id
+"""
+
+
+def build_multi_query(qvec: List[float], filters: QuestionFilters,
+                      type_k: Dict[str, int]) -> Tuple[str, dict]:
+    """Per-entity-type top-k from nba_embeddings plus each hit's source row, in one statement.
+
+    One ``UNION ALL`` branch per entity type, each with its own ORDER BY / LIMIT
+    and a literal ``entity_type`` so it can use an index scoped to that type.
+    """
+    params = {"q": vector_literal(qvec)}
+    where = filter_clauses(filters, params)
+    qv = QV
+    cols = "id, entity_type, entity_id, game_id, team_id, player_id, content_text, season, game_date, embedding"
+    # same choice as build_filtered_query: exact ranking over materialized candidates
+    # unless iterative scan lets the per type indexes handle the filters
+    inline = not where or HNSW_ITERATIVE_SCAN != "off"
+    type_where = f"{' AND '.join(where)} AND " if where and inline else ""
+
+    branches = []
+    for etype, k in type_k.items():
+        if etype not in ENTITY_TYPES or k <= 0:
+            continue
+        params[f"k_{etype}"] = k
+        if inline:
+            type_sql = f"WHERE {type_where}entity_type = '{etype}' "
+            branches.append(f"({ann_top_k(cols, type_sql, f'k_{etype}')})")
+        else:
+            branches.append(
+                f"(SELECT {cols.replace(', embedding', '')}, 1 - (embedding <=> {qv}) AS score "
+                f"FROM candidates WHERE entity_type = '{etype}' "
+                f"ORDER BY embedding {DISTANCE_OP} {qv} LIMIT :k_{etype})"
+            )
+    if not branches:
+        raise ValueError(f"No valid entity types in {type_k}")
+
+    sql = (
+        (f"WITH candidates AS MATERIALIZED (SELECT {cols} FROM nba_embeddings "
+         f"WHERE {' AND '.join(where)}) " if not inline else "")
+        + _SOURCE_COLS
+        + f"FROM ({' UNION ALL '.join(branches)}) hit"
+        + _SOURCE_JOINS
+        + "ORDER BY hit.score DESC"
+    )
+    return sql, params
+
+
+def _with_source(row) -> dict:
+    # flatten the joined source columns into one "source" dict; asyncpg hands jsonb back as text
+    out = dict(row)
+    source = {}
+    for key in ("game", "boxscore", "player", "team"):
+        val = out.pop(key, None)
+        if isinstance(val, str):
+            val = json.loads(val)
+        if val:
+            source[key] = val
+    out["source"] = source
+    return out
+
+
+def retrieve_multi(cx, qvec: List[float], filters: Optional[QuestionFilters] = None,
+                   type_k: Optional[Dict[str, int]] = None) -> List[dict]:
+    type_k = type_k or DEFAULT_TYPE_K
+    sql, params = search_settings(max(type_k.values()))
+    cx.execute(text(sql), params)
+    rows = []
+    for f in relaxations(filters or QuestionFilters()):
+        sql, params = build_multi_query(qvec, f, type_k)
+        rows = cx.execute(text(sql), params).mappings().all()
+        if rows:
+            break
+    return [_with_source(r) for r in rows]
+
+
+async def retrieve_multi_async(cx, qvec: List[float], filters: Optional[QuestionFilters] = None,
+                               type_k: Optional[Dict[str, int]] = None) -> List[dict]:
+    type_k = type_k or DEFAULT_TYPE_K
+    sql, params = search_settings(max(type_k.values()))
+    await cx.execute(text(sql), params)
+    rows = []
+    for f in relaxations(filters or QuestionFilters()):
+        sql, params = build_multi_query(qvec, f, type_k)
+        rows = (await cx.execute(text(sql), params)).mappings().all()
+        if rows:
+            break
+    return [_with_source(r) for r in rows]
+
+
+# the batch query groups questions by which filters they have (their "shape", one bit per
+# FILTER_SQL field) so every LATERAL arm has plain predicates the metadata indexes can serve
+_FILTER_BITS = {name: 1 << i for i, name in enumerate(FILTER_SQL)}
+
+
+def _filter_shape(f: QuestionFilters) -> int:
+    return sum(_FILTER_BITS[name] for name in active_filters(f))
+
+
+def _pg_array(values) -> Optional[str]:
+    # array literal for one unnest element
+    return "{" + ",".join(str(v) for v in values) + "}" if values else None
+
+
+def build_batch_query(qvecs: List[List[float]], filters: List[QuestionFilters],
+                      type_k: Dict[str, int]) -> Tuple[str, dict]:
+    """``build_multi_query`` for many questions in one statement.
+
+    The questions are unnested into rows (vector plus filter columns) and each
+    one runs the per type top-k as a LATERAL subquery. Unfiltered questions go
+    through the hnsw indexes, filtered ones rank their candidates exactly, the
+    same split retrieve_multi makes per question.
+    """
+    shapes = [_filter_shape(f) for f in filters]
+    params = {
+        "qids": list(range(len(qvecs))),
+        "vecs": [vector_literal(v) for v in qvecs],
+        "shapes": shapes,
+        "dates": [_pg_array(f.dates) for f in filters],
+        "seasons": [f.season for f in filters],
+        "team_ids": [_pg_array(f.team_ids) for f in filters],
+        "player_ids": [_pg_array(f.player_ids) for f in filters],
+    }
+    cols = "id, entity_type, entity_id, game_id, team_id, player_id, content_text, season, game_date, embedding"
+    qv = "q.vec"
+    branches = []
+    for etype, k in type_k.items():
+        if etype not in ENTITY_TYPES or k <= 0:
+            continue
+        params[f"k_{etype}"] = k
+        for shape in sorted(set(shapes)):
+            # the shape test only involves q, postgres runs it once per question and skips the other arms
+            # q is the unnested question row, its columns are named like the filter fields
+            where = [f"q.shape = {shape}"] + [
+                FILTER_SQL[name].format(v=f"q.{name}") for name, bit in _FILTER_BITS.items() if shape & bit
+            ]
+            type_sql = f"WHERE {' AND '.join(where)} AND entity_type = {etype!r} "
+            if shape == 0 or HNSW_ITERATIVE_SCAN != "off":
+                branches.append(f"({ann_top_k(cols, type_sql, f'k_{etype}', qv=qv)})")
+            else:
+                # OFFSET 0 keeps the filtered rows a subquery, so they're ranked exactly, not by the index
+                branches.append(
+                    f"(SELECT {cols.replace(', embedding', '')}, 1 - (embedding <=> {qv}) AS score "
+                    f"FROM (SELECT {cols} FROM nba_embeddings {type_sql}OFFSET 0) c "
+                    f"ORDER BY embedding {DISTANCE_OP} {qv} LIMIT :k_{etype})"
+                )
+    if not branches:
+        raise ValueError(f"No valid entity types in {type_k}")
+
+    sql = (
+        "WITH q AS MATERIALIZED (SELECT qid, CAST(vec AS vector) AS vec, shape, CAST(dates AS date[]) AS dates, "
+        "season, CAST(team_ids AS int[]) AS team_ids, CAST(player_ids AS int[]) AS player_ids "
+        "FROM unnest(CAST(:qids AS int[]), CAST(:vecs AS text[]), CAST(:shapes AS int[]), CAST(:dates AS text[]), "
+        "CAST(:seasons AS int[]), CAST(:team_ids AS text[]), CAST(:player_ids AS text[])) "
+        "AS u(qid, vec, shape, dates, season, team_ids, player_ids)) "
+        + _SOURCE_COLS
+        + f"FROM (SELECT q.qid, h.* FROM q CROSS JOIN LATERAL ({' UNION ALL '.join(branches)}) h) hit"
+        + _SOURCE_JOINS
+        + "ORDER BY hit.qid, hit.score DESC"
+    )
+    return sql, params
+
+
+def retrieve_batch(cx, qvecs: List[List[float]], filters: Optional[List[Optional[QuestionFilters]]] = None,
+                   type_k: Optional[Dict[str, int]] = None) -> List[List[dict]]:
+    """retrieve_multi for a list of questions, rows per question in input order.
+
+    One statement per relaxation level: questions whose filters matched
+    nothing are retried together with the next looser filters.
+    """
+    type_k = type_k or DEFAULT_TYPE_K
+    filters = [f or QuestionFilters() for f in (filters or [None] * len(qvecs))]
+    sql, params = search_settings(max(type_k.values()))
+    cx.execute(text(sql), params)
+    chains = [relaxations(f) for f in filters]
+    out: List[List[dict]] = [[] for _ in qvecs]
+    pending = list(range(len(qvecs)))
+    level = 0
+    while pending:
+        batch = [i for i in pending if level < len(chains[i])]
+        if not batch:
+            break
+        sql, params = build_batch_query([qvecs[i] for i in batch], [chains[i][level] for i in batch], type_k)
+        for r in cx.execute(text(sql), params).mappings():
+            row = _with_source(r)
+            out[batch[row.pop("qid")]].append(row)
+        pending = [i for i in batch if not out[i]]
+        level += 1
+    return out
+
+
+def format_source(row: dict) -> str:
+    # one compact fact line per hit, from the joined source row when there is one
+    src = row.get("source") or {}
+    if "game" in src:
+        g = src["game"]
+        return (f"game_details {g['game_id']}: {g['game_timestamp']} home {g['home_team_id']} "
+                f"{g['home_points']} - away {g['away_team_id']} {g['away_points']}, "
+                f"winner {g['winning_team_id']} | {row['content_text']}")
+    if "boxscore" in src:
+        b = src["boxscore"]
+        name = ""
+        if "player" in src:
+            name = f"{src['player']['first_name']} {src['player']['last_name']} "
+        return (f"player_box_scores {b['game_id']}/{b['person_id']}: {name}team {b['team_id']} "
+                f"pts {b['points']} oreb {b['offensive_reb']} dreb {b['defensive_reb']} "
+                f"ast {b['assists']} | {row['content_text']}")
+    return f"[{row['entity_type']} {row['entity_id']}] {row['content_text']}"
+
+
+def evidence(rows) -> List[dict]:
+    out = []
+    for r in rows:
+        if r["entity_type"] == "game":
+            out.append({"table": "game_details", "id": int(r["game_id"])})
+        elif r["entity_type"] == "boxscore":
+            out.append({"table": "player_box_scores", "id": int(r["game_id"]), "player_id": int(r["player_id"])})
+        elif r["entity_type"] == "player":
+            out.append({"table": "players", "id": int(r["player_id"])})
+        elif r["entity_type"] == "team":
+            out.append({"table": "teams", "id": int(r["team_id"])})
+    return out
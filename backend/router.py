@@ -0,0 +1,315 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from backend.retrieval import EntityLookup, QuestionFilters, extract_filters, fold
+
+# sql fast path: lookup questions of a known shape ("how many points did X score in game Y",
+# "who led scoring in game Z", ...) answered straight from the stat tables (backend/stats.py),
+# no embedding, ann search or generation. route() returns None for anything it can't answer
+# with certainty and the caller falls back to rag
+
+# first match wins, so the more specific shapes go first
+INTENTS = [
+    ("triple_double", re.compile(r"triple[- ]double")),
+    ("leading_scorer", re.compile(r"\b(leading|top|high(est)?) scorer\b|\bled (all |the )?(\w+ )?scor|\bmost points\b")),
+    ("player_with_points", re.compile(r"\b(which|what) player (had|scored|recorded|put up|dropped) (\d{1,3}) points\b")),
+    ("winner", re.compile(r"\b(which|what) team won\b|\bwho won\b|\bfinal score\b")),
+    ("season_average", re.compile(r"\baverag|\bper game\b|\bppg\b")),
+    ("points", re.compile(r"\bhow many points did\b")),
+]
+# "148-143", not a date like 1-26-24
+_SCORE = re.compile(r"(?<![\d/-])(\d{2,3})\s*-\s*(\d{2,3})(?![\d/-])")
+_TEAM_SCORER = re.compile(r"\bscorer for\b|'s? (leading|top) scorer\b")
+
+
+def game_evidence(game_id) -> dict:
+    return {"table": "game_details", "id": int(game_id)}
+
+
+def boxscore_evidence(game_id, player_id) -> dict:
+    return {"table": "player_box_scores", "id": int(game_id), "player_id": int(player_id)}
+
+
+class QuestionRouter:
+    """Answers recognized question shapes from the stat tables."""
+
+    def __init__(self, lookup: EntityLookup, team_names: Dict[int, str], player_names: Dict[int, str]):
+        self.lookup = lookup
+        self.team_names = team_names
+        self.player_names = player_names
+
+    @classmethod
+    def load(cls, cx, lookup: Optional[EntityLookup] = None) -> Optional["QuestionRouter"]:
+        # None until `python -m backend.stats refresh` (or ingest) has created the stat tables
+        if cx.execute(text("SELECT to_regclass('stat_games')")).scalar() is None:
+            print("Stat tables missing, sql fast path disabled (run python -m backend.stats refresh)")
+            return None
+        teams = cx.execute(text("SELECT team_id, city, name FROM teams")).mappings().all()
+        players = cx.execute(text("SELECT player_id, first_name, last_name FROM players")).mappings().all()
+        return cls(
+            lookup or EntityLookup.load(cx),
+            {t["team_id"]: f"{t['city']} {t['name']}" for t in teams},
+            {p["player_id"]: f"{p['first_name']} {p['last_name']}" for p in players},
+        )
+
+    def team_mentions(self, question: str) -> List[Tuple[int, int]]:
+        # (position, team_id) in the order the teams are mentioned
+        first = {}
+        for m in self.lookup.mentions(question):
+            if m.kind == "team":
+                first.setdefault(m.id, m.start)
+        return sorted((pos, team_id) for team_id, pos in first.items())
+
+    def route(self, cx, question: str) -> Optional[dict]:
+        folded = fold(question)
+        intent, match = None, None
+        for name, pattern in INTENTS:
+            match = pattern.search(folded)
+            if match:
+                intent = name
+                break
+        if intent is None:
+            return None
+        filters = extract_filters(question, self.lookup)
+        mentions = self.team_mentions(question)
+        filters.team_ids = [team_id for _, team_id in mentions]
+        m = _SCORE.search(question)
+        score = tuple(sorted(int(x) for x in m.groups())) if m else None
+        if score and score[0] < 50:
+            score = None
+
+        if intent == "points":
+            if len(filters.player_ids) == 1:
+                return self.player_points(cx, filters, score, "debut" in folded)
+            if filters.team_ids and not filters.player_ids:
+                return self.team_points(cx, filters, score)
+            return None
+        if intent == "winner":
+            return self.winner(cx, filters, score)
+        if intent == "leading_scorer":
+            team_id = None
+            tm = _TEAM_SCORER.search(folded)
+            if tm:
+                # the team named right after "scorer for" / right before "'s leading scorer"
+                after = [t for pos, t in mentions if pos >= tm.end()]
+                before = [t for pos, t in mentions if pos < tm.start()]
+                team_id = (after[0] if after else None) if "for" in tm.group(0) else (before[-1] if before else None)
+            return self.leading_scorer(cx, filters, score, team_id)
+        if intent == "triple_double":
+            return self.triple_double(cx, filters, score)
+        if intent == "player_with_points":
+            return self.player_with_points(cx, filters, int(match.group(3)))
+        if intent == "season_average":
+            return self.season_average(cx, filters)
+        return None
+
+    # -- game resolution
+
+    @staticmethod
+    def _game_where(filters: QuestionFilters, score, use_dates: bool, params: dict) -> List[str]:
+        where = []
+        if use_dates and filters.dates:
+            where.append("g.game_date = ANY(:dates)")
+            params["dates"] = list(filters.dates)
+        if filters.season is not None:
+            where.append("g.season = :season")
+            params["season"] = filters.season
+        for i, team_id in enumerate(filters.team_ids[:2]):
+            where.append(f":team_{i} IN (g.home_team_id, g.away_team_id)")
+            params[f"team_{i}"] = team_id
+        if score:
+            where.append("LEAST(g.home_points, g.away_points) = :lo AND GREATEST(g.home_points, g.away_points) = :hi")
+            params["lo"], params["hi"] = score
+        return where
+
+    def _attempts(self, filters: QuestionFilters, score):
+        # question dates are sometimes off (wrong year), retry without them when teams or
+        # the score still pin the game down
+        yield True
+        if filters.dates and (score or len(filters.team_ids) >= 2):
+            yield False
+
+    def find_game(self, cx, filters: QuestionFilters, score) -> Optional[dict]:
+        """The one game matching the question, None if none or several do."""
+        if not (filters.dates or score) and len(filters.team_ids) < 2:
+            return None
+        for use_dates in self._attempts(filters, score):
+            params = {}
+            where = self._game_where(filters, score, use_dates, params)
+            if len(where) < 2:
+                continue
+            rows = cx.execute(
+                text(f"SELECT g.* FROM stat_games g WHERE {' AND '.join(where)} LIMIT 2"), params
+            ).mappings().all()
+            if len(rows) == 1:
+                return dict(rows[0])
+            if rows:
+                return None
+        return None
+
+    def _score_text(self, g: dict) -> str:
+        home, away = self.team_names.get(g["home_team_id"]), self.team_names.get(g["away_team_id"])
+        return f"{away} {g['away_points']} at {home} {g['home_points']} on {g['game_date']}"
+
+    # -- shapes
+
+    def team_points(self, cx, filters, score) -> Optional[dict]:
+        g = self.find_game(cx, filters, score)
+        if not g:
+            return None
+        team_id = filters.team_ids[0]
+        points = g["home_points"] if team_id == g["home_team_id"] else g["away_points"]
+        return {
+            "route": "team_points",
+            "answer": f"The {self.team_names.get(team_id)} scored {points} points ({self._score_text(g)}).",
+            "evidence": [game_evidence(g["game_id"])],
+        }
+
+    def winner(self, cx, filters, score) -> Optional[dict]:
+        g = self.find_game(cx, filters, score)
+        if not g or not g["winning_team_id"]:
+            return None
+        won, lost = sorted((g["home_points"], g["away_points"]), reverse=True)
+        return {
+            "route": "winner",
+            "answer": f"The {self.team_names.get(g['winning_team_id'])} won {won}-{lost} "
+                      f"against the {self.team_names.get(g['losing_team_id'])} on {g['game_date']}.",
+            "evidence": [game_evidence(g["game_id"])],
+        }
+
+    def leading_scorer(self, cx, filters, score, team_id=None) -> Optional[dict]:
+        g = self.find_game(cx, filters, score)
+        if not g:
+            return None
+        if team_id is not None:
+            row = cx.execute(
+                text("SELECT player_id, points FROM stat_team_leaders WHERE game_id = :g AND team_id = :t"),
+                {"g": g["game_id"], "t": team_id},
+            ).mappings().first()
+            if not row:
+                return None
+            player_id, points, team = row["player_id"], row["points"], team_id
+        elif g["top_scorer_id"]:
+            player_id, points, team = g["top_scorer_id"], g["top_points"], g["top_scorer_team_id"]
+        else:
+            return None
+        return {
+            "route": "leading_scorer",
+            "answer": f"{self.player_names.get(player_id)} led the scoring with {points} points for the "
+                      f"{self.team_names.get(team)} ({self._score_text(g)}).",
+            "evidence": [boxscore_evidence(g["game_id"], player_id)],
+        }
+
+    def player_points(self, cx, filters, score, debut: bool) -> Optional[dict]:
+        player_id = filters.player_ids[0]
+        if debut and not (filters.dates or score or len(filters.team_ids) >= 2):
+            return self.debut_points(cx, filters, player_id)
+        # the player's own team may be among the mentions, any of them just has to be in the game
+        for use_dates in self._attempts(filters, score):
+            params = {"player_id": player_id}
+            where = self._game_where(filters, score, use_dates, params)
+            if not where:
+                continue
+            rows = cx.execute(text(
+                "SELECT b.game_id, b.points, b.team_id, g.* FROM player_box_scores b "
+                "JOIN stat_games g ON g.game_id = b.game_id "
+                f"WHERE b.person_id = :player_id {''.join(' AND ' + w for w in where)} "
+                "ORDER BY g.game_date LIMIT 2"
+            ), params).mappings().all()
+            if len(rows) == 1:
+                return self._points_answer(player_id, rows[0])
+            if rows:
+                return None
+        return None
+
+    def debut_points(self, cx, filters, player_id: int) -> Optional[dict]:
+        # a debut with nothing pinning the game: the player's first game here is only their debut
+        # if they were drafted in the data's first season or later (the data starts mid-career
+        # for everyone else, undrafted players included), and it has to fit the season / team asked
+        params = {"player_id": player_id}
+        where = self._game_where(filters, None, False, params)
+        row = cx.execute(text(
+            "SELECT * FROM (SELECT b.points, b.team_id, g.* FROM player_box_scores b "
+            "JOIN stat_games g ON g.game_id = b.game_id "
+            "JOIN players p ON p.player_id = b.person_id "
+            "WHERE b.person_id = :player_id AND p.draft_year >= (SELECT min(season) FROM stat_games) "
+            f"ORDER BY g.game_date LIMIT 1) g {'WHERE ' + ' AND '.join(where) if where else ''}"
+        ), params).mappings().first()
+        return self._points_answer(player_id, row) if row else None
+
+    def _points_answer(self, player_id: int, r) -> dict:
+        return {
+            "route": "player_points",
+            "answer": f"{self.player_names.get(player_id)} scored {r['points']} points "
+                      f"({self._score_text(r)}).",
+            "evidence": [boxscore_evidence(r["game_id"], player_id)],
+        }
+
+    def triple_double(self, cx, filters, score) -> Optional[dict]:
+        g = self.find_game(cx, filters, score)
+        if not g:
+            return None
+        params = {"g": g["game_id"]}
+        player_sql = ""
+        if filters.player_ids:
+            player_sql = " AND person_id = ANY(:players)"
+            params["players"] = list(filters.player_ids)
+        rows = cx.execute(text(
+            "SELECT person_id, points, coalesce(offensive_reb, 0) + coalesce(defensive_reb, 0) AS rebounds, "
+            "assists, steals, blocks FROM player_box_scores WHERE game_id = :g" + player_sql
+        ), params).mappings().all()
+        hits = [
+            r for r in rows
+            if sum(1 for k in ("points", "rebounds", "assists", "steals", "blocks") if (r[k] or 0) >= 10) >= 3
+        ]
+        if not hits:
+            return None
+        lines = [
+            f"{self.player_names.get(r['person_id'])} recorded a triple-double with {r['points']} points, "
+            f"{r['rebounds']} rebounds and {r['assists']} assists"
+            for r in hits
+        ]
+        return {
+            "route": "triple_double",
+            "answer": "; ".join(lines) + f" ({self._score_text(g)}).",
+            "evidence": [boxscore_evidence(g["game_id"], r["person_id"]) for r in hits],
+        }
+
+    def player_with_points(self, cx, filters, points: int) -> Optional[dict]:
+        if not filters.dates:
+            return None
+        params = {"points": points}
+        where = self._game_where(filters, None, True, params)
+        rows = cx.execute(text(
+            "SELECT b.game_id, b.person_id, g.* FROM player_box_scores b "
+            "JOIN stat_games g ON g.game_id = b.game_id "
+            f"WHERE b.points = :points AND {' AND '.join(where)} ORDER BY b.game_id, b.person_id"
+        ), params).mappings().all()
+        if not rows:
+            return None
+        lines = [f"{self.player_names.get(r['person_id'])} ({self._score_text(r)})" for r in rows]
+        return {
+            "route": "player_with_points",
+            "answer": f"{points} points: " + "; ".join(lines) + ".",
+            "evidence": [boxscore_evidence(r["game_id"], r["person_id"]) for r in rows],
+        }
+
+    def season_average(self, cx, filters) -> Optional[dict]:
+        if len(filters.player_ids) != 1 or filters.season is None:
+            return None
+        player_id = filters.player_ids[0]
+        r = cx.execute(
+            text("SELECT * FROM stat_player_seasons WHERE player_id = :p AND season = :s"),
+            {"p": player_id, "s": filters.season},
+        ).mappings().first()
+        if not r:
+            return None
+        return {
+            "route": "season_average",
+            "answer": f"{self.player_names.get(player_id)} averaged {r['ppg']} points, {r['rpg']} rebounds "
+                      f"and {r['apg']} assists over {r['games']} games in the {filters.season} season "
+                      f"(high {r['high_points']}).",
+            "evidence": [{"table": "players", "id": int(player_id)}],
+        }
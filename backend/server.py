@@ -1,12 +1,75 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import time
+import httpx
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import sqlalchemy as sa
-from backend.config import DB_DSN, EMBED_MODEL, LLM_MODEL
-from backend.utils import ollama_embed, ollama_generate
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from backend.config import (
+    DB_DSN, LLM_MODEL, ASYNC_DB_DSN, DB_POOL_SIZE, DB_POOL_OVERFLOW,
+    DB_STATEMENT_TIMEOUT, OLLAMA_MAX_CONNECTIONS, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    RETRIEVAL_BACKEND, SQL_FAST_PATH, CACHE_VERSION_CHECK_SECS,
+)
+from backend import metrics
+from backend.metrics import span
+from backend.utils import OllamaStreamError, ollama_generate_async, ollama_generate_stream_async
+from backend.query_cache import QueryCache
+from backend.vector_index import VectorIndex
+from backend.entity_index import ingest_version
+from backend.retrieval import (
+    EntityLookup, DEFAULT_TYPE_K, extract_filters, retrieve_multi_async, evidence,
+)
+from backend.context import build_context
+from backend.router import QuestionRouter
+
+
+class Clients:
+    # shared keep-alive ollama client and async db pool, opened/closed by lifespan
+    http: httpx.AsyncClient = None
+    db = None
+    lookup: EntityLookup = None
+    router: QuestionRouter = None
+    entities_checked: float = 0.0
+
 
-app = FastAPI()
+clients = Clients()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+        ),
+    )
+    clients.db = create_async_engine(
+        ASYNC_DB_DSN,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_OVERFLOW,
+        pool_pre_ping=True,
+        connect_args={"command_timeout": DB_STATEMENT_TIMEOUT},
+    )
+    async with clients.db.connect() as cx:
+        clients.lookup = await cx.run_sync(EntityLookup.load)
+        clients.entities_checked = time.monotonic()
+        if SQL_FAST_PATH:
+            clients.router = await cx.run_sync(QuestionRouter.load, clients.lookup)
+    if vector_index is not None:
+        await asyncio.to_thread(sync_vector_index)
+    try:
+        yield
+    finally:
+        await clients.http.aclose()
+        await clients.db.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:4200"],
@@ -14,28 +77,205 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# sync engine is only used by the query cache's version poll and the in-process index
 eng = sa.create_engine(DB_DSN)
+query_cache = QueryCache(eng)
+vector_index = VectorIndex() if RETRIEVAL_BACKEND == "memory" else None
+
+
+def sync_vector_index():
+    with eng.connect() as cx:
+        vector_index.sync(cx)
+
+
+def reload_entities():
+    # ingest.py bumps nba_ingest_version after reloading teams / players
+    with eng.connect() as cx:
+        version = ingest_version(cx)
+        if version == clients.lookup.version:
+            return
+        lookup = EntityLookup.load(cx)
+        router = QuestionRouter.load(cx, lookup) if SQL_FAST_PATH else None
+    clients.lookup, clients.router = lookup, router
+    print(f"Reloaded team / player index (ingest version {version}, {len(lookup.automaton)} aliases)")
+
+
+async def check_entities():
+    # polled like the query cache's version, at most every CACHE_VERSION_CHECK_SECS
+    if time.monotonic() - clients.entities_checked < CACHE_VERSION_CHECK_SECS:
+        return
+    clients.entities_checked = time.monotonic()
+    await asyncio.to_thread(reload_entities)
 
 
 class Q(BaseModel):
     question: str
 
 
+async def retrieve_rows(question: str, type_k: dict = DEFAULT_TYPE_K):
+    # games, box scores, players and teams ranked per type, source rows joined in
+    with span("embed"):
+        qvec = await query_cache.embed_async(question, clients.http)
+
+    with span("filters"):
+        filters = extract_filters(question, clients.lookup)
+
+    def search_memory():
+        if vector_index.due():
+            sync_vector_index()
+        return vector_index.search_multi(qvec, filters, type_k)
+
+    async def fetch():
+        if vector_index is not None:
+            # numpy releases the GIL in the matmul, keep it off the event loop
+            return await asyncio.to_thread(search_memory)
+        async with clients.db.connect() as cx:
+            return await retrieve_multi_async(cx, qvec, filters, type_k)
+
+    with span("retrieve"):
+        return await query_cache.retrieve_async(question, tuple(type_k.items()), fetch)
+
+
+# question independent, first in the prompt so ollama's kv cache for it is reused
+CHAT_PREFIX = "Answer using only the context tables below.\n"
+
+
+def build_prompt(question: str, rows, stats: dict):
+    # returns the prompt and the rows that made it into the context
+    with span("prompt"):
+        ctx, used = build_context(rows)
+        prompt = f"{CHAT_PREFIX}{ctx}\n\nQ:{question}\nA:"
+    stats.update(prompt_chars=len(prompt), context_rows=len(used))
+    return prompt, used
+
+
+async def fast_path(question: str):
+    # stat table answer for recognized lookup questions, None -> rag
+    if clients.router is None:
+        return None
+    with span("router"):
+        async with clients.db.connect() as cx:
+            return await cx.run_sync(clients.router.route, question)
+
+
 @app.post("/api/chat")
-def answer(q: Q):
-    print('Received question')
-    qvec = ollama_embed(EMBED_MODEL, q.question)
-    with eng.begin() as cx:
-       rows = cx.execute(
-            text(
-                "SELECT game_id, game_timestamp, home_team_id, away_team_id, home_points, away_points "
-                "FROM game_details ORDER BY embedding <-> :q LIMIT :k"
-            ),
-            {"q": qvec, "k": 5},
-        ).mappings().all()
-    ctx = "\n".join([str(dict(r)) for r in rows])
-    resp = ollama_generate(LLM_MODEL, f"Use context only:\n{ctx}\n\nQ:{q.question}\nA:")
+async def answer(q: Q, response: Response):
+    timings = metrics.start("chat")
+    rows, stats = None, {}
+    try:
+        await check_entities()
+        routed = await fast_path(q.question)
+        if routed:
+            timings.finish("fast_path")
+            print(f"chat ({routed['route']}): {timings.summary()}")
+            response.headers["Server-Timing"] = timings.server_timing()
+            return routed
+        rows = await retrieve_rows(q.question)
+        prompt, used = build_prompt(q.question, rows, stats)
+        with span("generate"):
+            resp = await ollama_generate_async(clients.http, LLM_MODEL, prompt, stats)
+    except Exception:
+        timings.finish("error", len(rows) if rows is not None else None, stats)
+        raise
+    timings.finish("ok", len(rows), stats)
+    print(f"chat: {timings.summary()}")
+    response.headers["Server-Timing"] = timings.server_timing()
     return {
             "answer": resp,
-            "evidence": [{"table": "game_details", "id": int(r["game_id"])} for r in rows],
-        }
\ No newline at end of file
+            "evidence": evidence(used),
+        }
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/api/chat/stream")
+async def answer_stream(q: Q):
+    """Server-Sent Events version of /api/chat.
+
+    Emits one ``evidence`` event as soon as retrieval finishes, a ``token``
+    event per fragment streamed from ollama, then ``done`` with the full
+    answer and timings. Retrieval runs inside the stream so the response
+    starts right away, every stage's timing is in the ``done`` event
+    (``stages_ms``) and /metrics. A fast path answer comes as a single
+    ``token`` event.
+    """
+
+    async def events():
+        timings = metrics.start("chat_stream")
+        rows, stats = None, {}
+        try:
+            await check_entities()
+            routed = await fast_path(q.question)
+            if not routed:
+                rows = await retrieve_rows(q.question)
+        except Exception as e:
+            timings.finish("error")
+            yield sse("error", {"detail": str(e)})
+            return
+
+        if routed:
+            timings.finish("fast_path")
+            yield sse("evidence", routed["evidence"])
+            yield sse("token", {"token": routed["answer"]})
+            total = round(timings.elapsed() * 1000, 1)
+            yield sse("done", {
+                "answer": routed["answer"],
+                "route": routed["route"],
+                "ttfb_ms": total,
+                "first_token_ms": total,
+                "total_ms": total,
+                "stages_ms": timings.as_ms(),
+            })
+            return
+
+        prompt, used = build_prompt(q.question, rows, stats)
+        yield sse("evidence", evidence(used))
+        ttfb = timings.elapsed()
+        first_token = None
+        parts = []
+        gen_start = time.perf_counter()
+        try:
+            async for token in ollama_generate_stream_async(clients.http, LLM_MODEL, prompt, stats):
+                if first_token is None:
+                    first_token = timings.elapsed()
+                    timings.add("first_token", time.perf_counter() - gen_start)
+                parts.append(token)
+                yield sse("token", {"token": token})
+            timings.add("generate", time.perf_counter() - gen_start)
+            timings.finish("ok", len(rows), stats)
+        except (httpx.HTTPError, OllamaStreamError) as e:
+            timings.finish("error", len(rows), stats)
+            yield sse("error", {"detail": str(e)})
+            return
+        finally:
+            # no-op unless the client went away mid stream
+            timings.finish("cancelled", len(rows), stats)
+        total = timings.elapsed()
+        print(f"chat stream: ttfb {ttfb * 1000:.0f}ms, first token "
+              f"{(first_token or total) * 1000:.0f}ms, total {total * 1000:.0f}ms")
+        yield sse("done", {
+            "answer": "".join(parts),
+            "ttfb_ms": round(ttfb * 1000, 1),
+            "first_token_ms": round((first_token or total) * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "stages_ms": timings.as_ms(),
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(body, media_type=content_type)
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return query_cache.stats()
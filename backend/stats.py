@@ -0,0 +1,201 @@
+import argparse
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from backend.config import DB_DSN
+
+# precomputed per game / per player aggregates for the sql fast path (backend/router.py):
+#   python -m backend.stats refresh     # only games whose source rows changed (also run by ingest.py)
+#   python -m backend.stats rebuild     # drop and recompute everything
+#   python -m backend.stats status
+# plain tables rather than materialized views: ingest drops and recreates the source
+# tables with CASCADE, which would take views built on them along
+
+STAT_TABLES = ["stat_games", "stat_team_leaders", "stat_player_seasons"]
+
+DDL = """
+CREATE TABLE IF NOT EXISTS stat_games (
+    game_id BIGINT PRIMARY KEY,
+    season INTEGER,
+    game_date DATE,
+    home_team_id BIGINT,
+    away_team_id BIGINT,
+    home_points INTEGER,
+    away_points INTEGER,
+    winning_team_id BIGINT,
+    losing_team_id BIGINT,
+    top_scorer_id BIGINT,        -- leading scorer of the game, either team
+    top_scorer_team_id BIGINT,
+    top_points INTEGER,
+    source_hash TEXT NOT NULL    -- md5 of the game_details row and its box scores
+);
+CREATE INDEX IF NOT EXISTS idx_stat_games_date ON stat_games (game_date);
+CREATE INDEX IF NOT EXISTS idx_stat_games_home ON stat_games (home_team_id, game_date);
+CREATE INDEX IF NOT EXISTS idx_stat_games_away ON stat_games (away_team_id, game_date);
+CREATE INDEX IF NOT EXISTS idx_stat_games_season ON stat_games (season);
+
+-- leading scorer per team per game
+CREATE TABLE IF NOT EXISTS stat_team_leaders (
+    game_id BIGINT NOT NULL,
+    team_id BIGINT NOT NULL,
+    player_id BIGINT NOT NULL,
+    points INTEGER,
+    rebounds INTEGER,
+    assists INTEGER,
+    PRIMARY KEY (game_id, team_id)
+);
+
+CREATE TABLE IF NOT EXISTS stat_player_seasons (
+    player_id BIGINT NOT NULL,
+    season INTEGER NOT NULL,
+    games INTEGER,
+    points INTEGER,
+    rebounds INTEGER,
+    assists INTEGER,
+    ppg NUMERIC(5, 1),
+    rpg NUMERIC(5, 1),
+    apg NUMERIC(5, 1),
+    high_points INTEGER,
+    PRIMARY KEY (player_id, season)
+);
+"""
+
+# game_id -> hash of everything the game's stats are computed from
+SOURCE_HASHES = """
+CREATE TEMP TABLE stat_src ON COMMIT DROP AS
+SELECT g.game_id, md5(g::text || coalesce(x.rows, '')) AS source_hash
+FROM game_details g
+LEFT JOIN (
+    SELECT game_id, string_agg(b::text, ',' ORDER BY person_id) AS rows
+    FROM player_box_scores b GROUP BY game_id
+) x ON x.game_id = g.game_id
+"""
+
+INSERT_GAMES = """
+INSERT INTO stat_games
+SELECT g.game_id, g.season, g.game_timestamp::date,
+       g.home_team_id, g.away_team_id, g.home_points, g.away_points, g.winning_team_id,
+       CASE WHEN g.winning_team_id = g.home_team_id THEN g.away_team_id
+            WHEN g.winning_team_id = g.away_team_id THEN g.home_team_id END,
+       top.person_id, top.team_id, top.points, c.source_hash
+FROM stat_changed c
+JOIN game_details g ON g.game_id = c.game_id
+LEFT JOIN LATERAL (
+    SELECT person_id, team_id, points FROM player_box_scores b
+    WHERE b.game_id = g.game_id AND b.points IS NOT NULL
+    ORDER BY b.points DESC, b.person_id LIMIT 1
+) top ON true
+"""
+
+INSERT_TEAM_LEADERS = """
+INSERT INTO stat_team_leaders
+SELECT DISTINCT ON (b.game_id, b.team_id)
+       b.game_id, b.team_id, b.person_id, b.points,
+       coalesce(b.offensive_reb, 0) + coalesce(b.defensive_reb, 0), b.assists
+FROM player_box_scores b
+JOIN stat_changed c ON c.game_id = b.game_id
+WHERE b.team_id IS NOT NULL AND b.points IS NOT NULL
+ORDER BY b.game_id, b.team_id, b.points DESC, b.person_id
+"""
+
+# per (player, season) in stat_touched, see refresh_stats
+INSERT_PLAYER_SEASONS = """
+INSERT INTO stat_player_seasons
+SELECT b.person_id, g.season, count(*),
+       sum(b.points),
+       sum(coalesce(b.offensive_reb, 0) + coalesce(b.defensive_reb, 0)),
+       sum(b.assists),
+       round(avg(b.points), 1),
+       round(avg(coalesce(b.offensive_reb, 0) + coalesce(b.defensive_reb, 0)), 1),
+       round(avg(b.assists), 1),
+       max(b.points)
+FROM player_box_scores b
+JOIN game_details g ON g.game_id = b.game_id
+JOIN stat_touched t ON t.player_id = b.person_id AND t.season = g.season
+WHERE b.seconds > 0 AND g.season IS NOT NULL
+GROUP BY b.person_id, g.season
+"""
+
+
+def create_stat_tables(cx):
+    cx.execute(text(DDL))
+
+
+def refresh_stats(eng, rebuild: bool = False) -> dict:
+    """Bring the stat tables in line with game_details / player_box_scores.
+
+    Only games that are new, changed or gone (by source hash) are recomputed,
+    along with the season lines of the players in them.
+    """
+    start = time.perf_counter()
+    with eng.begin() as cx:
+        if rebuild:
+            cx.execute(text(f"DROP TABLE IF EXISTS {', '.join(STAT_TABLES)}"))
+        create_stat_tables(cx)
+        cx.execute(text(SOURCE_HASHES))
+        cx.execute(text(
+            "CREATE TEMP TABLE stat_changed ON COMMIT DROP AS "
+            "SELECT s.game_id, s.source_hash FROM stat_src s "
+            "LEFT JOIN stat_games sg ON sg.game_id = s.game_id "
+            "WHERE sg.source_hash IS DISTINCT FROM s.source_hash"
+        ))
+        cx.execute(text(
+            "CREATE TEMP TABLE stat_removed ON COMMIT DROP AS "
+            "SELECT sg.game_id FROM stat_games sg "
+            "WHERE NOT EXISTS (SELECT 1 FROM stat_src s WHERE s.game_id = sg.game_id)"
+        ))
+        changed = cx.execute(text("SELECT count(*) FROM stat_changed")).scalar()
+        removed = cx.execute(text("SELECT count(*) FROM stat_removed")).scalar()
+        if changed or removed:
+            # season lines to recompute: the players in new / changed games, and every
+            # player of a season where an existing game changed or went away (their old
+            # box scores are gone, so who was in them isn't known any more)
+            cx.execute(text(
+                "CREATE TEMP TABLE stat_touched ON COMMIT DROP AS "
+                "SELECT DISTINCT b.person_id AS player_id, g.season "
+                "FROM stat_changed c JOIN player_box_scores b ON b.game_id = c.game_id "
+                "JOIN game_details g ON g.game_id = c.game_id WHERE g.season IS NOT NULL "
+                "UNION "
+                "SELECT ps.player_id, ps.season FROM stat_player_seasons ps "
+                "WHERE ps.season IN (SELECT sg.season FROM stat_games sg WHERE sg.game_id IN "
+                "(SELECT game_id FROM stat_removed UNION ALL SELECT game_id FROM stat_changed))"
+            ))
+            for table in ("stat_games", "stat_team_leaders"):
+                cx.execute(text(
+                    f"DELETE FROM {table} WHERE game_id IN "
+                    f"(SELECT game_id FROM stat_changed UNION ALL SELECT game_id FROM stat_removed)"
+                ))
+            cx.execute(text(
+                "DELETE FROM stat_player_seasons ps USING stat_touched t "
+                "WHERE ps.player_id = t.player_id AND ps.season = t.season"
+            ))
+            cx.execute(text(INSERT_GAMES))
+            cx.execute(text(INSERT_TEAM_LEADERS))
+            cx.execute(text(INSERT_PLAYER_SEASONS))
+            for table in STAT_TABLES:
+                cx.execute(text(f"ANALYZE {table}"))
+    elapsed = time.perf_counter() - start
+    print(f"Stat tables: {changed} games recomputed, {removed} removed in {elapsed:.2f}s")
+    return {"changed": changed, "removed": removed, "seconds": round(elapsed, 2)}
+
+
+def stats_status(eng) -> dict:
+    out = {}
+    with eng.connect() as cx:
+        for table in STAT_TABLES:
+            exists = cx.execute(text("SELECT to_regclass(:t)"), {"t": table}).scalar()
+            out[table] = cx.execute(text(f"SELECT count(*) FROM {table}")).scalar() if exists else None
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the precomputed stat tables")
+    parser.add_argument("action", choices=["refresh", "rebuild", "status"])
+    args = parser.parse_args()
+    eng = sa.create_engine(DB_DSN)
+    if args.action == "status":
+        print(stats_status(eng))
+    else:
+        refresh_stats(eng, rebuild=args.action == "rebuild")
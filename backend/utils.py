@@ -1,14 +1,77 @@
 import requests, json
+import httpx
 from backend.config import OLLAMA_HOST
 
+# keep-alive session so repeated calls reuse the same connection
+session = requests.Session()
+
 
 def ollama_embed(model: str, text: str):
-    r = requests.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": model, "prompt": text})
+    r = session.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": model, "prompt": text})
     r.raise_for_status()
     return r.json()["embedding"]
 
 
-def ollama_generate(model: str, prompt: str):
-    r = requests.post(f"{OLLAMA_HOST}/api/generate", json={"model": model, "prompt": prompt, "stream": False})
+def ollama_embed_many(model: str, texts):
+    # one /api/embed request for a list of inputs (vectors come back normalized)
+    r = session.post(f"{OLLAMA_HOST}/api/embed", json={"model": model, "input": list(texts)})
+    r.raise_for_status()
+    return r.json()["embeddings"]
+
+
+def _generate_stats(data: dict, stats):
+    # ollama's token counters from the final response, for callers that pass a dict in
+    if stats is not None:
+        stats.update({k: data.get(k) for k in ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration")})
+
+
+def ollama_generate(model: str, prompt: str, stats: dict = None):
+    r = session.post(f"{OLLAMA_HOST}/api/generate", json={"model": model, "prompt": prompt, "stream": False})
     r.raise_for_status()
-    return r.json()["response"]
+    data = r.json()
+    _generate_stats(data, stats)
+    return data["response"]
+
+
+# async variants take a shared httpx.AsyncClient (see backend/server.py lifespan)
+async def ollama_embed_async(client: httpx.AsyncClient, model: str, text: str):
+    r = await client.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": model, "prompt": text})
+    r.raise_for_status()
+    return r.json()["embedding"]
+
+
+async def ollama_generate_async(client: httpx.AsyncClient, model: str, prompt: str, stats: dict = None):
+    r = await client.post(f"{OLLAMA_HOST}/api/generate", json={"model": model, "prompt": prompt, "stream": False})
+    r.raise_for_status()
+    data = r.json()
+    _generate_stats(data, stats)
+    return data["response"]
+
+
+class OllamaStreamError(RuntimeError):
+    # an {"error": ...} line in ollama's stream, sent once the 200 is already out
+    pass
+
+
+async def ollama_generate_stream_async(client: httpx.AsyncClient, model: str, prompt: str, stats: dict = None):
+    # yields response fragments as ollama streams them (one ndjson object per line)
+    async with client.stream(
+        "POST", f"{OLLAMA_HOST}/api/generate", json={"model": model, "prompt": prompt, "stream": True}
+    ) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise OllamaStreamError(chunk["error"])
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                _generate_stats(chunk, stats)
+                break
+
+
+def vector_literal(vec) -> str:
+    # pgvector text format, lets drivers without a vector codec bind it as text
+    return "[" + ",".join(repr(float(x)) for x in vec) + "]"
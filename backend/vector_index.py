@@ -0,0 +1,328 @@
+import argparse
+import os
+import shutil
+import threading
+import time
+from datetime import timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from backend.config import DB_DSN, VECTOR_DISTANCE, VECTOR_INDEX_DIR, CACHE_VERSION_CHECK_SECS
+from backend.retrieval import DEFAULT_TYPE_K, ENTITY_TYPES, QuestionFilters, relaxations
+
+LOAD_SQL = """
+    SELECT e.id, e.entity_type, e.entity_id,
+           COALESCE(e.game_id, 0) AS game_id, COALESCE(e.team_id, 0) AS team_id,
+           COALESCE(e.player_id, 0) AS player_id, COALESCE(e.season, 0) AS season, e.game_date,
+           COALESCE(g.home_team_id, 0) AS home_team_id, COALESCE(g.away_team_id, 0) AS away_team_id,
+           e.content_text, e.embedding::text AS embedding, e.updated_at
+    FROM nba_embeddings e
+    LEFT JOIN game_details g ON g.game_id = e.game_id
+    WHERE e.embedding IS NOT NULL
+    """
+# rows whose transaction started before the last refresh can commit after it, re-read this far back
+REFRESH_SLACK_SECS = 60
+# rebuild from scratch once this share of the rows has been superseded
+COMPACT_DEAD_RATIO = 0.25
+
+_INT_COLUMNS = ("game_id", "team_id", "player_id", "season", "home_team_id", "away_team_id")
+
+
+def _utc(ts):
+    # naive utc datetime, numpy can't hold timezones
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class VectorIndex:
+    """Exact in-process top-k over nba_embeddings, an alternative to pgvector.
+
+    Vectors are kept in an append-only float32 file that is memory-mapped
+    read-only, next to side arrays for the filter columns (``meta.npz``) and a
+    utf-8 blob of the content texts. ``sync`` loads the files (building them
+    from postgres the first time) and appends rows the pipeline wrote since;
+    a replaced row is masked out rather than overwritten, so searches running
+    during a refresh keep a consistent snapshot.
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_DIR, distance: str = VECTOR_DISTANCE):
+        self.path = path
+        self.distance = distance
+        self.state = None
+        self.version = None
+        self.version_checked = 0.0
+        self.lock = threading.Lock()
+
+    # --- loading / refreshing ---
+
+    def due(self) -> bool:
+        return self.state is None or time.monotonic() - self.version_checked >= CACHE_VERSION_CHECK_SECS
+
+    def sync(self, cx, rebuild: bool = False):
+        """Load or build the index, then pull in rows written since the last sync."""
+        with self.lock:
+            self.version_checked = time.monotonic()
+            if self.state is None and not rebuild and os.path.exists(os.path.join(self.path, "meta.npz")):
+                self._open()
+            version = cx.execute(text("SELECT version FROM nba_embeddings_version WHERE id = 1")).scalar()
+            if self.state is None or rebuild:
+                self._build(cx, version)
+            elif version != self.version:
+                self._refresh(cx, version)
+
+    def _open(self):
+        meta = np.load(os.path.join(self.path, "meta.npz"))
+        st = {key: meta[key] for key in meta.files}
+        self.version = int(st.pop("version"))
+        self._attach(st)
+
+    def _attach(self, st: dict):
+        # map the data files for the rows meta describes (anything past that is a torn append)
+        n, dim = len(st["ids"]), int(st["dim"])
+        st["vectors"] = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r", shape=(n, dim)) \
+            if n else np.zeros((0, dim), np.float32)
+        size = int(st["text_start"][-1] + st["text_len"][-1]) if n else 0
+        st["texts"] = np.memmap(os.path.join(self.path, "texts.bin"), dtype=np.uint8, mode="r", shape=(size,)) \
+            if size else np.zeros(0, np.uint8)
+        st["row_of"] = {doc_id: i for i, doc_id in enumerate(st["ids"]) if st["live"][i]}
+        self.state = st
+
+    def _read(self, cx, where: str = "", params: Optional[dict] = None, chunk_size: int = 5000):
+        # per statement options, cx may be the caller's connection
+        res = cx.execute(
+            text(LOAD_SQL + where), params or {},
+            execution_options={"stream_results": True, "yield_per": chunk_size},
+        )
+        for part in res.partitions(chunk_size):
+            yield [row._mapping for row in part]
+
+    def _columns(self, rows) -> dict:
+        # one chunk of nba_embeddings rows -> side arrays + float32 matrix
+        # parse all vector literals of the chunk in one go
+        vectors = np.fromstring(",".join(r["embedding"][1:-1] for r in rows), dtype=np.float32, sep=",")
+        cols = {
+            "ids": np.array([r["id"] for r in rows], dtype=str),
+            "entity_type": np.array([r["entity_type"] for r in rows], dtype=str),
+            "entity_id": np.array([r["entity_id"] for r in rows], dtype=str),
+            "game_date": np.array([r["game_date"] or np.datetime64("NaT") for r in rows], dtype="datetime64[D]"),
+            "updated_at": np.array([_utc(r["updated_at"]) for r in rows], dtype="datetime64[us]"),
+            "vectors": vectors.reshape(len(rows), -1),
+            "texts": [r["content_text"].encode() for r in rows],
+        }
+        for key in _INT_COLUMNS:
+            cols[key] = np.array([r[key] for r in rows], dtype=np.int64)
+        return cols
+
+    def _append(self, st: dict, cols: dict, path: str) -> dict:
+        # append a chunk to the data files and return the extended side arrays
+        lens = np.array([len(t) for t in cols["texts"]], dtype=np.int64)
+        text_end = int(st["text_start"][-1] + st["text_len"][-1]) if len(st["ids"]) else 0
+        with open(os.path.join(path, "vectors.f32"), "ab") as f:
+            f.write(np.ascontiguousarray(cols["vectors"], dtype=np.float32).tobytes())
+        with open(os.path.join(path, "texts.bin"), "ab") as f:
+            f.write(b"".join(cols["texts"]))
+
+        out = {"dim": np.int64(cols["vectors"].shape[1])}
+        for key in ("ids", "entity_type", "entity_id", "game_date", "updated_at") + _INT_COLUMNS:
+            out[key] = np.concatenate([st[key], cols[key]])
+        out["norms"] = np.concatenate([st["norms"], np.linalg.norm(cols["vectors"], axis=1).astype(np.float32)])
+        out["text_start"] = np.concatenate([st["text_start"], text_end + np.cumsum(lens) - lens])
+        out["text_len"] = np.concatenate([st["text_len"], lens])
+        out["live"] = np.concatenate([st["live"], np.ones(len(lens), dtype=bool)])
+        return out
+
+    def _save_meta(self, st: dict, path: str, version):
+        keys = ("dim", "ids", "entity_type", "entity_id", "game_date", "updated_at", "norms",
+                "text_start", "text_len", "live") + _INT_COLUMNS
+        tmp = os.path.join(path, "meta.tmp.npz")
+        np.savez(tmp, version=np.int64(version or 0), **{k: st[k] for k in keys})
+        os.replace(tmp, os.path.join(path, "meta.npz"))
+
+    @staticmethod
+    def _empty() -> dict:
+        st = {"dim": np.int64(0), "game_date": np.zeros(0, "datetime64[D]"), "updated_at": np.zeros(0, "datetime64[us]"),
+              "norms": np.zeros(0, np.float32), "text_start": np.zeros(0, np.int64), "text_len": np.zeros(0, np.int64),
+              "live": np.zeros(0, bool)}
+        for key in ("ids", "entity_type", "entity_id"):
+            st[key] = np.zeros(0, dtype=str)
+        for key in _INT_COLUMNS:
+            st[key] = np.zeros(0, np.int64)
+        return st
+
+    def _build(self, cx, version):
+        # write a fresh copy next to the live one and swap directories, open memmaps stay valid
+        t0 = time.perf_counter()
+        tmp = self.path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        st = self._empty()
+        for rows in self._read(cx):
+            st = self._append(st, self._columns(rows), tmp)
+        self._save_meta(st, tmp, version)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path + ".old", ignore_errors=True)
+            os.replace(self.path, self.path + ".old")
+        os.replace(tmp, self.path)
+        shutil.rmtree(self.path + ".old", ignore_errors=True)
+        self.version = version
+        self._attach(st)
+        print(f"Vector index built: {len(st['ids'])} rows in {time.perf_counter() - t0:.1f}s")
+
+    def _refresh(self, cx, version):
+        st = self.state
+        since = st["updated_at"].max() - np.timedelta64(REFRESH_SLACK_SECS, "s") if len(st["ids"]) else None
+        params = {"since": since.astype(object).replace(tzinfo=timezone.utc)} if since is not None else {}
+        new = {key: st[key] for key in st if key not in ("vectors", "texts", "row_of")}
+        live = new["live"].copy()
+        added = 0
+        for rows in self._read(cx, " AND e.updated_at >= :since" if since is not None else "", params):
+            fresh = []
+            for r in rows:
+                i = st["row_of"].get(r["id"])
+                if i is not None:
+                    if np.datetime64(_utc(r["updated_at"]), "us") <= st["updated_at"][i]:
+                        continue  # already have this version of the row
+                    live[i] = False
+                fresh.append(r)
+            if fresh:
+                new = self._append(new, self._columns(fresh), self.path)
+                live = np.concatenate([live, np.ones(len(fresh), bool)])
+                added += len(fresh)
+        new["live"] = live
+
+        # deletes (ON DELETE CASCADE) don't show up in the delta, fall back to a rebuild
+        total = cx.execute(text("SELECT COUNT(*) FROM nba_embeddings WHERE embedding IS NOT NULL")).scalar()
+        dead = len(live) - int(live.sum())
+        if total != int(live.sum()) or dead > COMPACT_DEAD_RATIO * len(live):
+            self._build(cx, version)
+            return
+        self._save_meta(new, self.path, version)
+        self.version = version
+        self._attach(new)
+        if added:
+            print(f"Vector index refreshed: {added} rows added/replaced")
+
+    # --- search ---
+
+    def _mask(self, st: dict, filters: QuestionFilters, entity_type: Optional[str] = None) -> np.ndarray:
+        # same conditions as retrieval.filter_clauses, over the side arrays
+        mask = st["live"].copy()
+        if entity_type:
+            mask &= st["entity_type"] == entity_type
+        if filters.dates:
+            mask &= np.isin(st["game_date"], np.array(sorted(filters.dates), dtype="datetime64[D]"))
+        if filters.season is not None:
+            mask &= st["season"] == filters.season
+        if filters.team_ids:
+            ids = np.array(sorted(filters.team_ids), dtype=np.int64)
+            mask &= (np.isin(st["team_id"], ids) | np.isin(st["home_team_id"], ids)
+                     | np.isin(st["away_team_id"], ids))
+        if filters.player_ids:
+            ids = np.array(sorted(filters.player_ids), dtype=np.int64)
+            mask &= (st["player_id"] == 0) | np.isin(st["player_id"], ids)
+        return mask
+
+    def _scores(self, st: dict, queries: np.ndarray):
+        # one matrix product for all queries: (n, m) cosine similarity and ranking score
+        dots = st["vectors"] @ queries.T
+        qnorms = np.linalg.norm(queries, axis=1)
+        sim = dots / np.maximum(st["norms"][:, None] * qnorms[None, :], 1e-12)
+        if self.distance == "l2":
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, the last term doesn't change the order
+            rank = 2 * dots - (st["norms"] ** 2)[:, None]
+        elif self.distance == "ip":
+            rank = dots
+        else:
+            rank = sim
+        return sim, rank
+
+    @staticmethod
+    def _top_k(rank: np.ndarray, mask: np.ndarray, k: int) -> np.ndarray:
+        idx = np.flatnonzero(mask)
+        if len(idx) > k:
+            idx = idx[np.argpartition(-rank[idx], k - 1)[:k]]
+        return idx[np.argsort(-rank[idx], kind="stable")]
+
+    def _row(self, st: dict, i: int, score: float) -> dict:
+        start, n = int(st["text_start"][i]), int(st["text_len"][i])
+        game_date = st["game_date"][i]
+        return {
+            "id": str(st["ids"][i]),
+            "entity_type": str(st["entity_type"][i]),
+            "entity_id": str(st["entity_id"][i]),
+            "game_id": int(st["game_id"][i]) or None,
+            "team_id": int(st["team_id"][i]) or None,
+            "player_id": int(st["player_id"][i]) or None,
+            "content_text": bytes(st["texts"][start:start + n]).decode(),
+            "season": int(st["season"][i]) or None,
+            "game_date": None if np.isnat(game_date) else game_date.astype(object),
+            "score": float(score),
+            "source": {},  # no join-back in process, format_source falls back to content_text
+        }
+
+    def _search_one(self, st, sim, rank, filters, k) -> List[dict]:
+        for f in relaxations(filters or QuestionFilters()):
+            hits = self._top_k(rank, self._mask(st, f), k)
+            if len(hits):
+                return [self._row(st, i, sim[i]) for i in hits]
+        return []
+
+    def search(self, qvec: List[float], filters: Optional[QuestionFilters] = None, k: int = 5) -> List[dict]:
+        """Filtered top-k for one query, same rows and relaxations as ``retrieve_filtered``."""
+        return self.search_many([qvec], [filters], k)[0]
+
+    def search_many(self, qvecs: List[List[float]], filters: Optional[List[Optional[QuestionFilters]]] = None,
+                    k: int = 5) -> List[List[dict]]:
+        # batched queries share a single (n x m) matrix product
+        st = self.state
+        if not len(st["ids"]):
+            return [[] for _ in qvecs]
+        sim, rank = self._scores(st, np.asarray(qvecs, dtype=np.float32))
+        filters = filters or [None] * len(qvecs)
+        return [self._search_one(st, sim[:, j], rank[:, j], filters[j], k) for j in range(len(qvecs))]
+
+    def search_multi(self, qvec: List[float], filters: Optional[QuestionFilters] = None,
+                     type_k: Optional[Dict[str, int]] = None) -> List[dict]:
+        """Per-entity-type top-k, the in-process counterpart of ``retrieve_multi``."""
+        st = self.state
+        if not len(st["ids"]):
+            return []
+        sim, rank = self._scores(st, np.asarray([qvec], dtype=np.float32))
+        sim, rank = sim[:, 0], rank[:, 0]
+        for f in relaxations(filters or QuestionFilters()):
+            base = self._mask(st, f)
+            hits = []
+            for etype, k in (type_k or DEFAULT_TYPE_K).items():
+                if etype in ENTITY_TYPES and k > 0:
+                    hits.extend(self._top_k(rank, base & (st["entity_type"] == etype), k))
+            if hits:
+                hits.sort(key=lambda i: -sim[i])
+                return [self._row(st, i, sim[i]) for i in hits]
+        return []
+
+    def retrieve(self, cx, qvec: List[float], type_k: Optional[Dict[str, int]] = None,
+                 filters: Optional[QuestionFilters] = None) -> List[dict]:
+        # drop-in for rag.retrieve, only touches the db when a version check is due
+        if self.due():
+            self.sync(cx)
+        return self.search_multi(qvec, filters, type_k)
+
+    def stats(self) -> dict:
+        st = self.state
+        if st is None:
+            return {"rows": 0}
+        return {"rows": int(st["live"].sum()), "dead": int((~st["live"]).sum()),
+                "mb": st["vectors"].nbytes / 1e6, "version": self.version}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build / refresh the in-process vector index")
+    parser.add_argument("action", choices=["build", "refresh", "stats"])
+    args = parser.parse_args()
+
+    index = VectorIndex()
+    with sa.create_engine(DB_DSN).connect() as cx:
+        index.sync(cx, rebuild=args.action == "build")
+    print(index.stats())